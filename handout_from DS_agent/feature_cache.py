@@ -0,0 +1,146 @@
+"""Disk cache of transformed training matrices, keyed by input data, feature code and config.
+
+Each entry is a directory holding ``.npy`` arrays (loaded with ``mmap_mode="r"``), the
+fitted preprocessor and a ``meta.json`` written last, so a half-written entry is never
+read. Entries are evicted least-recently-used once the cache exceeds ``max_bytes``.
+"""
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Dict, Iterable, Optional
+
+import joblib
+import numpy as np
+
+# bump when the on-disk layout changes
+CACHE_VERSION = 1
+
+
+def file_digest(path: str, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cache_key(data_files: Iterable[str], code: Iterable, config: dict) -> str:
+    """sha256 over input file contents, source of the feature code, and the config subset."""
+    h = hashlib.sha256(f"feature-cache-v{CACHE_VERSION}".encode())
+    for path in data_files:
+        h.update(file_digest(path).encode())
+    for obj in code:
+        h.update(inspect.getsource(obj).encode())
+    h.update(json.dumps(config, sort_keys=True, default=str).encode())
+    return h.hexdigest()[:32]
+
+
+def _dir_bytes(path: str) -> int:
+    total = 0
+    for dirpath, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def load_entry(path: str) -> Dict:
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in meta["arrays"]}
+    return {
+        "arrays": arrays,
+        "preprocessor": joblib.load(os.path.join(path, "preprocessor.joblib")),
+        "feature_names": meta["feature_names"],
+        "bytes": meta["bytes"],
+    }
+
+
+class FeatureCache:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def entry_path(self, key: str) -> Optional[str]:
+        """Directory of a complete entry, or None; lets other processes call load_entry directly."""
+        path = self._entry(key)
+        return path if os.path.exists(os.path.join(path, "meta.json")) else None
+
+    def load(self, key: str) -> Optional[Dict]:
+        path = self.entry_path(key)
+        if path is None:
+            self._bump("misses")
+            return None
+        entry = load_entry(path)
+        os.utime(os.path.join(path, "meta.json"))  # mark as recently used for LRU eviction
+        self._bump("hits")
+        return entry
+
+    def store(self, key: str, arrays: Dict[str, np.ndarray], preprocessor, feature_names) -> int:
+        tmp = tempfile.mkdtemp(prefix=f".{key}-", dir=self.root)
+        try:
+            for name, arr in arrays.items():
+                np.save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(arr))
+            joblib.dump(preprocessor, os.path.join(tmp, "preprocessor.joblib"))
+            size = _dir_bytes(tmp)
+            with open(os.path.join(tmp, "meta.json"), "w") as f:
+                json.dump({
+                    "arrays": sorted(arrays),
+                    "feature_names": list(feature_names),
+                    "bytes": size,
+                    "created": time.time(),
+                }, f)
+            target = self._entry(key)
+            if os.path.exists(target):
+                shutil.rmtree(target, ignore_errors=True)
+            os.replace(tmp, target)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        self.evict(keep=key)
+        return size
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        entries = []
+        for name in os.listdir(self.root):
+            meta_path = os.path.join(self.root, name, "meta.json")
+            if os.path.exists(meta_path):
+                entries.append((os.path.getmtime(meta_path), name, _dir_bytes(os.path.join(self.root, name))))
+        total = sum(e[2] for e in entries)
+        evicted = 0
+        for _, name, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+            total -= size
+            evicted += 1
+        if evicted:
+            self._bump("evictions", evicted)
+        return evicted
+
+    def stats(self) -> Dict[str, int]:
+        try:
+            with open(os.path.join(self.root, "stats.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _bump(self, counter: str, n: int = 1):
+        stats = self.stats()
+        stats[counter] = stats.get(counter, 0) + n
+        tmp = os.path.join(self.root, f".stats.json.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(stats, f)
+        os.replace(tmp, os.path.join(self.root, "stats.json"))
@@ -1,6 +1,6 @@
 import numpy as np
 import pandas as pd
-from typing import Any, List
+from typing import Any, Dict, List, Optional
 from dataclasses import dataclass
 
 from sklearn.compose import ColumnTransformer
@@ -16,6 +16,21 @@ def _safe_divide(a, b, default=np.nan):
     return out
 
 
+def stable_id_hash(ids, seed: int = 0) -> np.ndarray:
+    """SplitMix64 of integer ids: same value on every run, machine and row order."""
+    with np.errstate(over="ignore"):
+        x = np.asarray(ids, dtype=np.int64).astype(np.uint64)
+        x = x + (np.uint64(seed) + np.uint64(1)) * np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+def id_hash_unit(ids, seed: int = 0) -> np.ndarray:
+    """Map ids to [0, 1) via stable_id_hash; ``id_hash_unit(ids) < f`` selects a stable fraction f."""
+    return (stable_id_hash(ids, seed) >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+
 def add_features(df: pd.DataFrame) -> pd.DataFrame:
     df = df.copy()
     if "Gender" not in df.columns and "Sex" in df.columns:
@@ -50,12 +65,45 @@ def add_features(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def build_preprocessor(X: pd.DataFrame) -> ColumnTransformer:
+# raw request fields whose serving distribution is compared with training (see build_reference)
+DRIFT_NUMERIC = ["Age", "Height", "Weight", "Duration", "Heart_Rate", "Body_Temp"]
+DRIFT_CATEGORICAL = ["Gender"]
+
+
+def histogram_reference(values, bins: int = 10) -> Dict[str, list]:
+    """Quantile bin edges and per-bin proportions; bin i holds ``edges[i-1] <= x < edges[i]``."""
+    x = np.asarray(values, dtype=float)
+    x = x[np.isfinite(x)]
+    edges = np.unique(np.quantile(x, np.linspace(0.0, 1.0, bins + 1)[1:-1]))
+    counts = np.bincount(np.searchsorted(edges, x, side="right"), minlength=len(edges) + 1)
+    return {"edges": edges.tolist(), "probs": (counts / max(1, counts.sum())).tolist()}
+
+
+def category_reference(values) -> Dict[str, list]:
+    freq = pd.Series(values).dropna().astype(str).str.strip().str.lower().value_counts(normalize=True).sort_index()
+    return {"categories": freq.index.tolist(), "probs": freq.tolist()}
+
+
+def build_reference(df: pd.DataFrame, preds, bins: int = 10) -> Dict[str, Any]:
+    """Training-time distributions of the raw inputs and of the model's predictions."""
+    if "Gender" not in df.columns and "Sex" in df.columns:
+        df = df.rename(columns={"Sex": "Gender"})
+    numeric = {c: histogram_reference(df[c], bins) for c in DRIFT_NUMERIC if c in df.columns}
+    numeric["prediction"] = histogram_reference(preds, bins)
+    categorical = {c: category_reference(df[c]) for c in DRIFT_CATEGORICAL if c in df.columns}
+    return {"numeric": numeric, "categorical": categorical, "rows": int(len(df))}
+
+
+def build_preprocessor(X: pd.DataFrame, categories: Optional[Dict[str, List[str]]] = None) -> ColumnTransformer:
+    # categories: full per-column category lists when X is only a sample (chunked training)
     categorical_cols = [c for c in X.columns if X[c].dtype == "object"]
     numeric_cols = [c for c in X.columns if c not in categorical_cols]
+    encoder = OneHotEncoder(handle_unknown="ignore")
+    if categories is not None:
+        encoder = OneHotEncoder(handle_unknown="ignore", categories=[categories[c] for c in categorical_cols])
     pre = ColumnTransformer(
         transformers=[
-            ("cat", OneHotEncoder(handle_unknown="ignore"), categorical_cols),
+            ("cat", encoder, categorical_cols),
             ("num", "passthrough", numeric_cols),
         ]
     )
@@ -67,11 +115,22 @@ class ModelWrapper:
     preprocessor: Any
     booster: xgb.Booster
     feature_names: List[str]
+    # optional drift reference from build_reference; older artifacts load without it
+    reference: Optional[Dict[str, Any]] = None
 
-    def predict(self, df: pd.DataFrame) -> np.ndarray:
+    def predict(self, df: pd.DataFrame, timer: Any = None) -> np.ndarray:
+        # timer: optional object with .mark(stage) called after each pipeline stage
         X = add_features(df)
+        if timer is not None:
+            timer.mark("add_features")
         Xt = self.preprocessor.transform(X)
+        if timer is not None:
+            timer.mark("transform")
         d = xgb.DMatrix(Xt, feature_names=self.feature_names)
+        if timer is not None:
+            timer.mark("dmatrix")
         pred_log = self.booster.predict(d, iteration_range=(0, getattr(self.booster, 'best_iteration', None)))
+        if timer is not None:
+            timer.mark("booster_predict")
         return np.expm1(pred_log)
 
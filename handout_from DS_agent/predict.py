@@ -1,19 +1,164 @@
 import argparse
+import multiprocessing as mp
 import os
+import resource
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 import joblib
 import pandas as pd
 
+try:  # optional: faster CSV parsing and Parquet in/out
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - depends on environment
+    pa = pa_csv = pq = None
+
+
+# Set once per process by _init_worker; chunks are scored against it
+_MODEL = None
+
+# SCHEMA.md input columns. pyarrow infers CSV types from the first block only, so a column
+# that looks integral there (Age) would fail on a later "34.5"; pin every known column.
+NUMERIC_COLUMNS = ("Age", "Height", "Weight", "Duration", "Heart_Rate", "Body_Temp", "Calories")
+
+
+def csv_column_types() -> dict:
+    types = {"id": pa.int64(), "Gender": pa.string(), "Sex": pa.string()}
+    types.update({c: pa.float64() for c in NUMERIC_COLUMNS})
+    return types
+
+
+def _init_worker(model_path: str, threads: int):
+    global _MODEL
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["XGBOOST_NUM_THREADS"] = str(threads)
+    _MODEL = joblib.load(model_path)
+    _MODEL.booster.set_param({"nthread": threads})
+
+
+def _score_chunk(df: pd.DataFrame, offset: int) -> pd.DataFrame:
+    ids = df["id"].to_numpy() if "id" in df.columns else range(offset, offset + len(df))
+    return pd.DataFrame({"id": ids, "Calories": _MODEL.predict(df)})
+
+
+def iter_chunks(path: str, chunk_size: int):
+    """Yield DataFrames of exactly chunk_size rows (last one may be shorter)."""
+    if path.endswith(".parquet"):
+        if pq is None:
+            raise SystemExit("Parquet input requires pyarrow (pip install pyarrow)")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    elif pa_csv is not None:
+        # pyarrow reads by byte blocks; re-slice into fixed-size row chunks
+        pending, n = [], 0
+        convert = pa_csv.ConvertOptions(column_types=csv_column_types())
+        for batch in pa_csv.open_csv(path, convert_options=convert):
+            pending.append(batch)
+            n += batch.num_rows
+            while n >= chunk_size:
+                table = pa.Table.from_batches(pending)
+                yield table.slice(0, chunk_size).to_pandas()
+                rest = table.slice(chunk_size)
+                pending, n = rest.to_batches(), rest.num_rows
+        if n:
+            yield pa.Table.from_batches(pending).to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size)
+
+
+class ChunkWriter:
+    """Appends scored chunks to CSV or Parquet in arrival order."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.parquet = path.endswith(".parquet")
+        if self.parquet and pq is None:
+            raise SystemExit("Parquet output requires pyarrow (pip install pyarrow)")
+        self._writer = None
+        self._fh = None
+
+    def write(self, out: pd.DataFrame):
+        if self.parquet:
+            table = pa.Table.from_pandas(out, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table)
+        else:
+            if self._fh is None:
+                self._fh = open(self.path, "w", newline="")
+                out.to_csv(self._fh, index=False)
+            else:
+                out.to_csv(self._fh, index=False, header=False)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._fh is not None:
+            self._fh.close()
+
+
+def predict_chunked(input_path: str, model_path: str, out_path: str, chunk_size: int,
+                    workers: int, threads_per_worker: int) -> int:
+    writer = ChunkWriter(out_path)
+    rows = 0
+    try:
+        if workers <= 1:
+            _init_worker(model_path, threads_per_worker)
+            for chunk in iter_chunks(input_path, chunk_size):
+                writer.write(_score_chunk(chunk, rows))
+                rows += len(chunk)
+            return rows
+        # spawn: workers start clean (no inherited OpenMP/pyarrow thread state)
+        ctx = mp.get_context("spawn")
+        with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(model_path, threads_per_worker)) as pool:
+            # bounded in-flight window keeps memory flat and output in input order
+            inflight = deque()
+            for chunk in iter_chunks(input_path, chunk_size):
+                inflight.append(pool.submit(_score_chunk, chunk, rows))
+                rows += len(chunk)
+                if len(inflight) >= 2 * workers:
+                    writer.write(inflight.popleft().result())
+            while inflight:
+                writer.write(inflight.popleft().result())
+        return rows
+    finally:
+        writer.close()
+
 
 def main():
     parser = argparse.ArgumentParser()
     here = os.path.dirname(__file__)
     parser.add_argument("--data-dir", default=os.path.join(here, "data_sample"))
+    parser.add_argument("--input", default=None, help="CSV or Parquet to score (default: <data-dir>/test.csv)")
     parser.add_argument("--model", default=os.path.join(here, "model.joblib"))
-    parser.add_argument("--out", default=os.path.join(here, "submission.csv"))
+    parser.add_argument("--out", default=os.path.join(here, "submission.csv"), help=".csv or .parquet")
+    parser.add_argument("--chunk-size", type=int, default=0, help="Rows per chunk (0=score whole file in memory)")
+    parser.add_argument("--workers", type=int, default=1, help="Scoring processes in chunked mode")
+    parser.add_argument("--threads-per-worker", type=int, default=0,
+                        help="XGBoost threads per worker (0=cpu_count/workers)")
     args = parser.parse_args()
 
-    test_csv = os.path.join(args.data_dir, "test.csv")
-    df = pd.read_csv(test_csv)
+    test_csv = args.input or os.path.join(args.data_dir, "test.csv")
+
+    if args.chunk_size > 0:
+        threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // max(1, args.workers))
+        t0 = time.perf_counter()
+        rows = predict_chunked(test_csv, args.model, args.out, args.chunk_size, args.workers, threads)
+        dt = time.perf_counter() - t0
+        # ru_maxrss is KiB on Linux
+        rss_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        rss_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0
+        print(f"Saved submission to {args.out}")
+        print(f"rows={rows} seconds={dt:.2f} rows_per_sec={rows / dt if dt > 0 else 0.0:.0f} "
+              f"workers={args.workers} threads_per_worker={threads} chunk_size={args.chunk_size} "
+              f"peak_rss_mb_main={rss_self:.0f} peak_rss_mb_worker={rss_children:.0f}")
+        return
+
+    df = pd.read_parquet(test_csv) if test_csv.endswith(".parquet") else pd.read_csv(test_csv)
     ids = df["id"] if "id" in df.columns else pd.Series(range(len(df)))
 
     model = joblib.load(args.model)
@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+import warnings
+
+import joblib
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+from model import add_features, id_hash_unit, ModelWrapper
+from train import booster_params, load_config, rmsle_from_logspace
+
+
+def served_booster(wrapper: ModelWrapper) -> xgb.Booster:
+    """The trees ModelWrapper.predict actually uses (it predicts over [0, best_iteration))."""
+    end = getattr(wrapper.booster, "best_iteration", None)
+    if end is None or end <= 0 or end >= wrapper.booster.num_boosted_rounds():
+        return wrapper.booster.copy()
+    return wrapper.booster[:end]
+
+
+def feedback_matrix(wrapper: ModelWrapper, df: pd.DataFrame) -> xgb.DMatrix:
+    # the preprocessor stays frozen: new rows are encoded exactly as at serving time
+    Xt = wrapper.preprocessor.transform(add_features(df.drop(columns=["Calories"])))
+    return xgb.DMatrix(Xt, label=np.log1p(df["Calories"].astype(float)), feature_names=wrapper.feature_names)
+
+
+def update_booster(base: xgb.Booster, params: dict, dtrain: xgb.DMatrix, mode: str, rounds: int,
+                   prune_gamma: float) -> xgb.Booster:
+    if mode == "add":
+        # warm start: keep every existing tree, fit ``rounds`` new ones to the residuals
+        return xgb.train(params, dtrain, num_boost_round=rounds, xgb_model=base)
+    n_trees = base.num_boosted_rounds()
+    update = dict(params, process_type="update")
+    if mode == "refresh":
+        # same structure, leaf values and node stats re-estimated on the new data
+        update.update(updater="refresh", refresh_leaf=True)
+    else:
+        # refresh stats on the new data, then drop splits whose gain falls below gamma
+        update.update(updater="refresh,prune", refresh_leaf=True, gamma=prune_gamma)
+    with warnings.catch_warnings():
+        # the base booster's tree_method is ignored in favour of the explicit updater, as intended
+        warnings.filterwarnings("ignore", message=".*updater.*")
+        return xgb.train(update, dtrain, num_boost_round=n_trees, xgb_model=base)
+
+
+def save_atomic(wrapper: ModelWrapper, path: str):
+    d = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=".model-", suffix=".joblib", dir=d)
+    os.close(fd)
+    try:
+        joblib.dump(wrapper, tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    here = os.path.dirname(__file__)
+    parser.add_argument("--feedback", required=True, help="CSV written by the service (FEEDBACK_STORE_PATH)")
+    parser.add_argument("--model", default=os.path.join(here, "model.joblib"))
+    parser.add_argument("--out", default=None, help="Where to promote the new model (default: --model)")
+    parser.add_argument("--config", default=os.path.join(here, "config.yaml"))
+    parser.add_argument("--mode", choices=["add", "refresh", "prune"], default="add")
+    parser.add_argument("--rounds", type=int, default=50, help="Trees to add in --mode add")
+    parser.add_argument("--eta", type=float, default=None, help="Learning rate for added trees (default: config)")
+    parser.add_argument("--prune-gamma", type=float, default=0.01, help="Min split gain kept in --mode prune")
+    parser.add_argument("--holdout", default=None,
+                        help="Labelled CSV to compare on (default: hash-split --holdout-frac of the feedback)")
+    parser.add_argument("--holdout-frac", type=float, default=0.2)
+    parser.add_argument("--since", type=float, default=None, help="Only use feedback with ts_feedback >= this epoch")
+    parser.add_argument("--min-rows", type=int, default=200)
+    parser.add_argument("--min-improvement", type=float, default=0.0,
+                        help="Promote only if holdout RMSLE drops by more than this")
+    parser.add_argument("--dry-run", action="store_true", help="Evaluate but never promote")
+    parser.add_argument("--history", default=os.path.join(here, "retrain_history.jsonl"))
+    args = parser.parse_args()
+
+    t_start = time.perf_counter()
+    cfg = load_config(args.config)
+    wrapper: ModelWrapper = joblib.load(args.model)
+
+    fb = pd.read_csv(args.feedback)
+    if args.since is not None and "ts_feedback" in fb.columns:
+        fb = fb[fb["ts_feedback"] >= args.since]
+    # the service may log an id more than once (resent feedback); keep the latest label
+    fb = fb.drop_duplicates(subset="id", keep="last")
+    if args.holdout:
+        train_df, holdout_df = fb, pd.read_csv(args.holdout)
+    else:
+        in_holdout = id_hash_unit(fb["id"].to_numpy(), cfg["train"]["random_state"]) < args.holdout_frac
+        train_df, holdout_df = fb[~in_holdout], fb[in_holdout]
+    if len(train_df) < args.min_rows or holdout_df.empty:
+        raise SystemExit(f"Not enough feedback: train_rows={len(train_df)} holdout_rows={len(holdout_df)} "
+                         f"(need --min-rows {args.min_rows} and a non-empty holdout)")
+
+    base = served_booster(wrapper)
+    params = booster_params(cfg)
+    if args.eta is not None:
+        params["eta"] = args.eta
+    dtrain = feedback_matrix(wrapper, train_df)
+    booster = update_booster(base, params, dtrain, args.mode, args.rounds, args.prune_gamma)
+    # predict over every tree: ModelWrapper.predict uses best_iteration as the range end
+    booster.set_attr(best_iteration=str(booster.num_boosted_rounds()))
+    # keep the training-time drift reference: without it the service turns the drift monitor off
+    candidate = ModelWrapper(wrapper.preprocessor, booster, feature_names=wrapper.feature_names,
+                             reference=wrapper.reference)
+
+    y_hold = np.log1p(holdout_df["Calories"].astype(float).to_numpy())
+    x_hold = holdout_df.drop(columns=["Calories"])
+    rmsle_before = rmsle_from_logspace(y_hold, np.log1p(wrapper.predict(x_hold)))
+    rmsle_after = rmsle_from_logspace(y_hold, np.log1p(candidate.predict(x_hold)))
+    # drift signal: how the serving model does on the newest labels
+    rmsle_feedback = rmsle_from_logspace(np.log1p(train_df["Calories"].astype(float).to_numpy()),
+                                         np.log1p(wrapper.predict(train_df.drop(columns=["Calories"]))))
+    promote = (not args.dry_run) and rmsle_after < rmsle_before - args.min_improvement
+    out = args.out or args.model
+    if promote:
+        save_atomic(candidate, out)
+
+    wall = time.perf_counter() - t_start
+    record = {
+        "ts": time.time(),
+        "mode": args.mode,
+        "rounds": args.rounds if args.mode == "add" else 0,
+        "train_rows": int(len(train_df)),
+        "holdout_rows": int(len(holdout_df)),
+        "trees_before": base.num_boosted_rounds(),
+        "trees_after": booster.num_boosted_rounds(),
+        "holdout_rmsle_before": rmsle_before,
+        "holdout_rmsle_after": rmsle_after,
+        "feedback_rmsle_serving": rmsle_feedback,
+        "promoted": bool(promote),
+        "wall_time_sec": wall,
+    }
+    with open(args.history, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+    print(f"mode={args.mode} train_rows={len(train_df)} holdout_rows={len(holdout_df)} "
+          f"trees={record['trees_before']}->{record['trees_after']} wall_time_sec={wall:.1f}")
+    print(f"holdout RMSLE before={rmsle_before:.5f} after={rmsle_after:.5f} "
+          f"feedback RMSLE (serving model)={rmsle_feedback:.5f}")
+    print(f"Promoted to {out}" if promote else "Not promoted")
+
+
+if __name__ == "__main__":
+    main()
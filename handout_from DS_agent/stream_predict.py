@@ -1,38 +1,149 @@
 import argparse
+import csv
 import json
+import math
 import os
+import queue
 import sys
+import threading
 import time
 
 import joblib
 import pandas as pd
 
+_EOF = object()
+# numeric model inputs; a row must carry each of them (empty = missing, as in read_csv)
+NUMERIC_COLUMNS = ("Age", "Height", "Weight", "Duration", "Heart_Rate", "Body_Temp")
+
+
+def _read_lines(stream, q: "queue.Queue", sleep: float):
+    # Producer thread: lets the scorer flush on a timeout while stdin blocks
+    for line in stream:
+        if not line.strip():
+            continue
+        q.put(line)
+        if sleep > 0:
+            time.sleep(sleep)
+    q.put(_EOF)
+
+
+def parse_row(line: str, fmt: str, columns, index: int) -> dict:
+    """One validated input row; raises ValueError so a bad row never reaches a batch.
+
+    Rows without an ``id`` get their position in the stream.
+    """
+    if fmt == "ndjson":
+        row = json.loads(line)
+        if not isinstance(row, dict):
+            raise ValueError("not a JSON object")
+    else:
+        values = next(csv.reader([line]))
+        if len(values) != len(columns):
+            raise ValueError(f"expected {len(columns)} fields, got {len(values)}")
+        row = dict(zip(columns, values))
+    for c in NUMERIC_COLUMNS:
+        if c not in row:
+            raise ValueError(f"missing column {c}")
+        v = row[c]
+        row[c] = math.nan if v is None or v == "" else float(v)
+    row["id"] = int(row["id"]) if "id" in row else index
+    return row
+
+
+def score_batch(model, rows) -> str:
+    df = pd.DataFrame.from_records(rows)
+    preds = model.predict(df)
+    return "".join(json.dumps({"id": r["id"], "Calories": float(p)}) + "\n" for r, p in zip(rows, preds))
+
+
+def run(model, stream, out, fmt: str = "auto", batch_size: int = 64, max_wait: float = 0.05,
+        sleep: float = 0.0, limit: int = 0, report_every: float = 5.0) -> int:
+    """Score rows from ``stream`` in micro-batches; flush by size or after ``max_wait`` seconds."""
+    q: "queue.Queue" = queue.Queue(maxsize=max(1, batch_size) * 4)
+    threading.Thread(target=_read_lines, args=(stream, q, sleep), daemon=True).start()
+
+    columns = None
+    batch = []
+    deadline = 0.0
+    emitted = 0
+    seen = 0
+    bad = 0
+    t_start = last_report = time.monotonic()
+
+    def flush():
+        nonlocal batch, emitted, last_report
+        out.write(score_batch(model, batch))
+        out.flush()
+        emitted += len(batch)
+        batch = []
+        now = time.monotonic()
+        if report_every > 0 and now - last_report >= report_every:
+            sys.stderr.write(f"rows={emitted} rows_per_sec={emitted / (now - t_start):.0f}\n")
+            last_report = now
+
+    while True:
+        timeout = max(0.0, deadline - time.monotonic()) if batch else None
+        try:
+            line = q.get(timeout=timeout)
+        except queue.Empty:
+            flush()
+            continue
+        if line is _EOF:
+            break
+        if fmt == "auto":
+            fmt = "ndjson" if line.lstrip().startswith("{") else "csv"
+        if fmt == "csv" and columns is None:
+            columns = next(csv.reader([line]))
+            continue
+        seen += 1
+        try:
+            row = parse_row(line, fmt, columns, seen - 1)
+        except ValueError as e:  # json.JSONDecodeError is a ValueError too
+            # skip the row, keep the stream (and the rest of its micro-batch) alive
+            bad += 1
+            sys.stderr.write(f"bad row {seen}: {e}: {line.strip()[:200]}\n")
+            continue
+        if not batch:
+            deadline = time.monotonic() + max_wait
+        batch.append(row)
+        if limit and emitted + len(batch) >= limit:
+            sys.stderr.write(f"stopping at --limit {limit}\n")
+            break
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    dt = time.monotonic() - t_start
+    sys.stderr.write(f"done rows={emitted} bad_rows={bad} seconds={dt:.2f} "
+                     f"rows_per_sec={emitted / dt if dt > 0 else 0.0:.0f}\n")
+    return emitted
+
 
 def main():
     parser = argparse.ArgumentParser()
     here = os.path.dirname(__file__)
-    parser.add_argument("--data", default=os.path.join(here, "data_sample", "test.csv"))
+    parser.add_argument("--data", default=os.path.join(here, "data_sample", "test.csv"), help="CSV/NDJSON file, or - for stdin")
     parser.add_argument("--model", default=os.path.join(here, "model.joblib"))
+    parser.add_argument("--format", choices=["auto", "csv", "ndjson"], default="auto")
+    parser.add_argument("--batch-size", type=int, default=64, help="Max rows per micro-batch")
+    parser.add_argument("--max-wait-ms", type=float, default=50.0, help="Flush a partial batch after this long")
     parser.add_argument("--sleep", type=float, default=0.0, help="Seconds to sleep between records")
-    parser.add_argument("--limit", type=int, default=100, help="Max records to emit (0=all)")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="Max records to emit (0=all; default: all from stdin, 100 from a file as in the demo)")
+    parser.add_argument("--report-every", type=float, default=5.0, help="Seconds between rows/sec reports on stderr")
     args = parser.parse_args()
 
-    df = pd.read_csv(args.data)
+    if args.limit is None:
+        args.limit = 0 if args.data == "-" else 100
     model = joblib.load(args.model)
-
-    total = len(df) if args.limit == 0 else min(args.limit, len(df))
-    for i in range(total):
-        row = df.iloc[[i]].copy()
-        pred = float(model.predict(row)[0])
-        if "id" in row.columns:
-            rid = int(row["id"].iloc[0])
-        else:
-            rid = i
-        rec = {"id": rid, "Calories": pred}
-        sys.stdout.write(json.dumps(rec) + "\n")
-        sys.stdout.flush()
-        if args.sleep > 0:
-            time.sleep(args.sleep)
+    stream = sys.stdin if args.data == "-" else open(args.data, "r")
+    try:
+        run(model, stream, sys.stdout, fmt=args.format, batch_size=args.batch_size,
+            max_wait=args.max_wait_ms / 1000.0, sleep=args.sleep, limit=args.limit,
+            report_every=args.report_every)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
 
 
 if __name__ == "__main__":
@@ -1,6 +1,10 @@
 import argparse
 import json
 import os
+import resource
+import shutil
+import tempfile
+import time
 
 import joblib
 import numpy as np
@@ -10,7 +14,8 @@ from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error
 import xgboost as xgb
 
-from model import add_features, build_preprocessor, ModelWrapper
+from feature_cache import FeatureCache, cache_key
+from model import _safe_divide, add_features, build_preprocessor, build_reference, id_hash_unit, stable_id_hash, ModelWrapper
 
 
 def load_config(path: str):
@@ -22,19 +27,42 @@ def rmsle_from_logspace(y_log_true, y_log_pred) -> float:
     return float(np.sqrt(mean_squared_error(y_log_true, y_log_pred)))
 
 
-def main():
-    parser = argparse.ArgumentParser()
-    here = os.path.dirname(__file__)
-    parser.add_argument("--data-dir", default=os.path.join(here, "data_sample"))
-    parser.add_argument("--config", default=os.path.join(here, "config.yaml"))
-    parser.add_argument("--out", default=os.path.join(here, "model.joblib"))
-    parser.add_argument("--metrics", default=os.path.join(here, "metrics.json"))
-    args = parser.parse_args()
+def booster_params(cfg) -> dict:
+    return {
+        "objective": "reg:squarederror",
+        "eval_metric": "rmse",
+        "eta": cfg["model"]["eta"],
+        "max_depth": cfg["model"]["max_depth"],
+        "min_child_weight": cfg["model"]["min_child_weight"],
+        "subsample": cfg["model"]["subsample"],
+        "colsample_bytree": cfg["model"]["colsample_bytree"],
+        "lambda": cfg["model"]["reg_lambda"],
+        "alpha": cfg["model"]["reg_alpha"],
+        "tree_method": cfg["model"]["tree_method"],
+        "seed": cfg["train"]["random_state"],
+    }
 
-    cfg = load_config(args.config)
-    train_csv = os.path.join(args.data_dir, cfg["data"]["train_csv"])
 
+class Phases:
+    """Wall time per training phase. ``mark(name)`` closes the phase ending now and prints
+    ``phase <name> seconds=<s>`` (parsed by tools/train_mlflow.py while training runs)."""
+
+    def __init__(self):
+        self.seconds = {}
+        self._t = time.perf_counter()
+
+    def mark(self, name: str):
+        now = time.perf_counter()
+        self.seconds[name] = self.seconds.get(name, 0.0) + now - self._t
+        self._t = now
+        print(f"phase {name} seconds={self.seconds[name]:.3f}", flush=True)
+
+
+def build_feature_arrays(cfg, train_csv: str, phases: Phases = None):
+    """Original path: whole CSV in pandas, random split, dense transformed matrices."""
     df = pd.read_csv(train_csv)
+    if phases is not None:
+        phases.mark("load")
     y = df["Calories"].astype(float)
     X = df.drop(columns=["Calories"])
 
@@ -46,46 +74,219 @@ def main():
         test_size=cfg["train"]["valid_size"], random_state=cfg["train"]["random_state"]
     )
 
-    Xt_tr = pre.fit_transform(X_tr)
-    Xt_val = pre.transform(X_val)
-
-    dtr = xgb.DMatrix(Xt_tr, label=y_tr, feature_names=pre.get_feature_names_out().tolist())
-    dval = xgb.DMatrix(Xt_val, label=y_val, feature_names=pre.get_feature_names_out().tolist())
-
-    params = {
-        "objective": "reg:squarederror",
-        "eval_metric": "rmse",
-        "eta": cfg["model"]["eta"],
-        "max_depth": cfg["model"]["max_depth"],
-        "min_child_weight": cfg["model"]["min_child_weight"],
-        "subsample": cfg["model"]["subsample"],
-        "colsample_bytree": cfg["model"]["colsample_bytree"],
-        "lambda": cfg["model"]["reg_lambda"],
-        "alpha": cfg["model"]["reg_alpha"],
-        "tree_method": cfg["model"]["tree_method"],
-        "seed": cfg["train"]["random_state"],
+    # float32 is what DMatrix stores anyway; halves the cache footprint
+    arrays = {
+        "X_train": np.asarray(pre.fit_transform(X_tr), dtype=np.float32),
+        "y_train": y_tr.to_numpy(dtype=np.float32),
+        "X_valid": np.asarray(pre.transform(X_val), dtype=np.float32),
+        "y_valid": y_val.to_numpy(dtype=np.float32),
     }
+    return pre, arrays
 
-    booster = xgb.train(
-        params,
-        dtr,
-        num_boost_round=cfg["train"]["num_boost_round"],
-        evals=[(dval, "valid")],
-        early_stopping_rounds=cfg["train"]["early_stopping_rounds"],
-        verbose_eval=False,
+
+def feature_cache_key(cfg, train_csv: str) -> str:
+    # model.* and boosting rounds are deliberately excluded: they do not change the matrices
+    return cache_key(
+        [train_csv],
+        [_safe_divide, add_features, build_preprocessor, build_feature_arrays],
+        {"data": cfg["data"], "valid_size": cfg["train"]["valid_size"],
+         "random_state": cfg["train"]["random_state"]},
     )
 
-    # metrics
-    val_pred_log = booster.predict(dval, iteration_range=(0, booster.best_iteration + 1))
-    rmsle_val = rmsle_from_logspace(y_val, val_pred_log)
+
+def in_memory_dmatrices(cfg, train_csv: str, cache: FeatureCache = None, phases: Phases = None):
+    """Returns (pre, dtr, dval, cache_hit); reuses cached matrices when data/code/config are unchanged."""
+    key = None
+    cached = None
+    if cache is not None:
+        key = feature_cache_key(cfg, train_csv)
+        cached = cache.load(key)
+    if cached is not None:
+        pre, arrays, names = cached["preprocessor"], cached["arrays"], cached["feature_names"]
+        print(f"feature cache hit key={key} size_mb={cached['bytes'] / 1e6:.1f}")
+    else:
+        pre, arrays = build_feature_arrays(cfg, train_csv, phases)
+        names = pre.get_feature_names_out().tolist()
+        if cache is not None:
+            size = cache.store(key, arrays, pre, names)
+            print(f"feature cache miss key={key}; stored size_mb={size / 1e6:.1f}")
+
+    dtr = xgb.DMatrix(arrays["X_train"], label=arrays["y_train"], feature_names=names)
+    dval = xgb.DMatrix(arrays["X_valid"], label=arrays["y_valid"], feature_names=names)
+    return pre, dtr, dval, (cached is not None) if cache is not None else None
+
+
+class FeatureChunkIter(xgb.DataIter):
+    """Streams feature-engineered CSV chunks into XGBoost.
+
+    Rows are assigned to train/valid by hashing ``id`` (see id_hash_unit), so both
+    iterators see a deterministic, order-independent split without holding the data.
+    """
+
+    def __init__(self, csv_path: str, pre, feature_names, chunk_size: int, valid_size: float,
+                 seed: int, valid: bool, cache_prefix=None):
+        super().__init__(cache_prefix=cache_prefix)
+        self.csv_path = csv_path
+        self.pre = pre
+        self.feature_names = feature_names
+        self.chunk_size = chunk_size
+        self.valid_size = valid_size
+        self.seed = seed
+        self.valid = valid
+        self._reader = None
+
+    def reset(self):
+        self._reader = None
+
+    def next(self, input_data) -> bool:
+        if self._reader is None:
+            self._reader = pd.read_csv(self.csv_path, chunksize=self.chunk_size)
+        for chunk in self._reader:
+            in_valid = id_hash_unit(chunk["id"].to_numpy(), self.seed) < self.valid_size
+            part = chunk[in_valid if self.valid else ~in_valid]
+            if part.empty:
+                continue
+            y = np.log1p(part["Calories"].astype(float).to_numpy())
+            Xt = self.pre.transform(add_features(part.drop(columns=["Calories"])))
+            input_data(data=Xt, label=y, feature_names=self.feature_names)
+            return True
+        return False
+
+
+def fit_chunked_preprocessor(train_csv: str, chunk_size: int):
+    """One streaming pass to collect every category, then fit on the first chunk."""
+    first = None
+    categories = {}
+    for chunk in pd.read_csv(train_csv, chunksize=chunk_size):
+        Xf = add_features(chunk.drop(columns=["Calories"]))
+        if first is None:
+            first = Xf
+        for c in Xf.columns:
+            if Xf[c].dtype == "object":
+                categories.setdefault(c, set()).update(Xf[c].dropna().unique().tolist())
+    pre = build_preprocessor(first, categories={c: sorted(v) for c, v in categories.items()})
+    pre.fit(first)
+    return pre
+
+
+def out_of_core_dmatrices(cfg, train_csv: str, mode: str, chunk_size: int, cache_dir: str):
+    pre = fit_chunked_preprocessor(train_csv, chunk_size)
+    names = pre.get_feature_names_out().tolist()
+    common = dict(valid_size=cfg["train"]["valid_size"], seed=cfg["train"]["random_state"])
+    extmem = mode == "extmem"
+    it_tr = FeatureChunkIter(train_csv, pre, names, chunk_size, valid=False,
+                             cache_prefix=os.path.join(cache_dir, "train") if extmem else None, **common)
+    it_val = FeatureChunkIter(train_csv, pre, names, chunk_size, valid=True,
+                              cache_prefix=os.path.join(cache_dir, "valid") if extmem else None, **common)
+    if extmem and hasattr(xgb, "ExtMemQuantileDMatrix"):
+        # pages spill to cache_dir; only a page at a time is resident
+        dtr = xgb.ExtMemQuantileDMatrix(it_tr)
+        dval = xgb.ExtMemQuantileDMatrix(it_val, ref=dtr)
+    elif extmem:
+        # xgboost < 3.0: external-memory DMatrix paged through the iterators' cache_prefix
+        print("xgboost<3.0 has no ExtMemQuantileDMatrix; using external-memory DMatrix", flush=True)
+        dtr = xgb.DMatrix(it_tr)
+        dval = xgb.DMatrix(it_val)
+    else:
+        # compressed quantile matrix built from chunks; raw floats never fully materialized
+        dtr = xgb.QuantileDMatrix(it_tr)
+        dval = xgb.QuantileDMatrix(it_val, ref=dtr)
+    return pre, dtr, dval
+
+
+def reference_sample(train_csv: str, max_rows: int, chunk_size: int = 100000) -> pd.DataFrame:
+    """Uniform, order-independent sample of raw rows: the max_rows smallest id hashes (bottom-k)."""
+    sample = None
+    for chunk in pd.read_csv(train_csv, chunksize=chunk_size, usecols=lambda c: c != "Calories"):
+        chunk = chunk.assign(_h=stable_id_hash(chunk["id"].to_numpy()))
+        sample = chunk if sample is None else pd.concat([sample, chunk], ignore_index=True)
+        if len(sample) > max_rows:
+            sample = sample.nsmallest(max_rows, "_h")
+    return sample.drop(columns=["_h"])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    here = os.path.dirname(__file__)
+    parser.add_argument("--data-dir", default=os.path.join(here, "data_sample"))
+    parser.add_argument("--config", default=os.path.join(here, "config.yaml"))
+    parser.add_argument("--out", default=os.path.join(here, "model.joblib"))
+    parser.add_argument("--metrics", default=os.path.join(here, "metrics.json"))
+    parser.add_argument("--out-of-core", choices=["quantile", "extmem"], default=None,
+                        help="Stream CSV chunks into QuantileDMatrix / external-memory DMatrix")
+    parser.add_argument("--chunk-size", type=int, default=100000, help="Rows per chunk in --out-of-core mode")
+    parser.add_argument("--reference-rows", type=int, default=50000,
+                        help="Rows sampled for the drift reference stored in the artifact (0=skip)")
+    parser.add_argument("--feature-cache-dir", default=os.getenv("FEATURE_CACHE_DIR"),
+                        help="Reuse transformed matrices across runs (in-memory mode; default: $FEATURE_CACHE_DIR)")
+    parser.add_argument("--feature-cache-max-mb", type=float, default=float(os.getenv("FEATURE_CACHE_MAX_MB", "2048")),
+                        help="Evict least-recently-used cache entries beyond this size")
+    parser.add_argument("--log-every", type=int, default=0,
+                        help="Print the validation metric every N boosting rounds (0=quiet)")
+    args = parser.parse_args()
+
+    t_start = time.perf_counter()
+    phases = Phases()
+    cfg = load_config(args.config)
+    train_csv = os.path.join(args.data_dir, cfg["data"]["train_csv"])
+
+    cache_hit = None
+    dtr = dval = None
+    cache_dir = tempfile.mkdtemp(prefix="xgb-extmem-") if args.out_of_core == "extmem" else None
+    try:
+        if args.out_of_core:
+            pre, dtr, dval = out_of_core_dmatrices(cfg, train_csv, args.out_of_core, args.chunk_size, cache_dir)
+        else:
+            cache = None
+            if args.feature_cache_dir:
+                cache = FeatureCache(args.feature_cache_dir, int(args.feature_cache_max_mb * 1e6))
+            pre, dtr, dval, cache_hit = in_memory_dmatrices(cfg, train_csv, cache, phases)
+        # a feature-cache hit or the out-of-core readers fold loading into this phase
+        phases.mark("features")
+
+        booster = xgb.train(
+            booster_params(cfg),
+            dtr,
+            num_boost_round=cfg["train"]["num_boost_round"],
+            evals=[(dval, "valid")],
+            early_stopping_rounds=cfg["train"]["early_stopping_rounds"],
+            verbose_eval=args.log_every if args.log_every > 0 else False,
+        )
+
+        # metrics
+        val_pred_log = booster.predict(dval, iteration_range=(0, booster.best_iteration + 1))
+        rmsle_val = rmsle_from_logspace(dval.get_label(), val_pred_log)
+    finally:
+        if cache_dir is not None:
+            # external-memory pages can be large; remove them even when training fails
+            dtr = dval = None
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    phases.mark("train")
 
     wrapper = ModelWrapper(pre, booster, feature_names=pre.get_feature_names_out().tolist())
+    if args.reference_rows > 0:
+        # served by the API as the baseline for per-feature PSI/KS drift gauges
+        sample = reference_sample(train_csv, args.reference_rows, chunk_size=args.chunk_size)
+        wrapper.reference = build_reference(sample, wrapper.predict(sample))
     joblib.dump(wrapper, args.out)
+    phases.mark("save")
 
+    wall = time.perf_counter() - t_start
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0  # KiB on Linux
+    metrics = {
+        "valid_rmsle": rmsle_val,
+        "best_iteration": int(booster.best_iteration),
+        "wall_time_sec": wall,
+        "peak_rss_mb": peak_rss_mb,
+        "phase_seconds": phases.seconds,
+    }
+    if cache_hit is not None:
+        metrics["feature_cache_hit"] = int(cache_hit)
     with open(args.metrics, "w") as f:
-        json.dump({"valid_rmsle": rmsle_val, "best_iteration": int(booster.best_iteration)}, f)
+        json.dump(metrics, f)
 
     print(f"Saved model to {args.out}; valid RMSLE={rmsle_val:.5f}; best_iter={booster.best_iteration}")
+    print(f"mode={args.out_of_core or 'in-memory'} wall_time_sec={wall:.1f} peak_rss_mb={peak_rss_mb:.0f}")
 
 
 if __name__ == "__main__":
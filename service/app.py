@@ -1,28 +1,53 @@
 import os
 import sys
+import csv
+import fcntl
+import gc
+import bisect
+import gzip
 import time
+import hmac
+import heapq
+import itertools
+import json
+import queue
+import signal
 import logging
+import threading
+import tracemalloc
 import traceback
 from collections import deque
+from contextvars import ContextVar
 from datetime import datetime, timezone
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
+import anyio
 import joblib
 import numpy as np
 import pandas as pd
 from fastapi import FastAPI, Request, Response
 from fastapi.responses import JSONResponse, PlainTextResponse
-from pydantic import BaseModel, field_validator
-from starlette.middleware.base import BaseHTTPMiddleware
+from pydantic import BaseModel, PrivateAttr, field_validator
+
+try:  # optional: Parquet prediction-log segments
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - depends on environment
+    pa = pq = None
 
 # Prometheus metrics
 from prometheus_client import (
     Counter,
     Histogram,
     Gauge,
+    REGISTRY,
     generate_latest,
     CONTENT_TYPE_LATEST,
 )
+from prometheus_client.openmetrics.exposition import (
+    CONTENT_TYPE_LATEST as OPENMETRICS_CONTENT_TYPE,
+    generate_latest as generate_openmetrics,
+)
 
 
 # --------------------
@@ -37,7 +62,55 @@ MODEL_PATH = os.environ.get(
     "MODEL_PATH", os.path.join(HANDOUT_DIR, "model.joblib")
 )
 PREDICTION_WINDOW_SECONDS = int(os.environ.get("PREDICTION_WINDOW_SECONDS", "300"))
+# >1 runs the rolling-metrics clock faster than wall time (time-compressed simulations)
+CLOCK_SCALE = float(os.environ.get("CLOCK_SCALE", "1"))
 ALLOW_STARTUP_FAILURE = os.environ.get("ALLOW_STARTUP_FAILURE", "1") == "1"
+# Per-stage timers on the /predict hot path; toggle at runtime via /debug/stage-timers
+stage_timers_enabled = os.environ.get("STAGE_TIMERS", "1") == "1"
+# /debug/* endpoints require X-Admin-Token to match; they are disabled when unset
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "60"))
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "10"))
+SLOW_LOG_SIZE = int(os.environ.get("SLOW_LOG_SIZE", "20"))
+SLOW_LOG_WINDOW_SECONDS = float(os.environ.get("SLOW_LOG_WINDOW_SECONDS", "300"))
+# Rolling aggregates/eviction run on a background tick; /metrics bytes are cached for METRICS_CACHE_MS
+METRICS_REFRESH_SECONDS = float(os.environ.get("METRICS_REFRESH_SECONDS", "1"))
+METRICS_CACHE_MS = float(os.environ.get("METRICS_CACHE_MS", "1000"))
+METRICS_GZIP = os.environ.get("METRICS_GZIP", "1") == "1"
+# Joined (features, prediction, label) rows for handout_from DS_agent/retrain.py; empty disables
+FEEDBACK_STORE_PATH = os.environ.get("FEEDBACK_STORE_PATH", "")
+FEEDBACK_FLUSH_SECONDS = float(os.environ.get("FEEDBACK_FLUSH_SECONDS", "5"))
+# Evicted predictions spill here so feedback older than the window still joins; empty disables
+SPILL_DIR = os.environ.get("SPILL_DIR", "")
+SPILL_RETENTION_SECONDS = float(os.environ.get("SPILL_RETENTION_SECONDS", "86400"))
+SPILL_SEGMENT_ROWS = int(os.environ.get("SPILL_SEGMENT_ROWS", "65536"))
+SPILL_FLUSH_SECONDS = float(os.environ.get("SPILL_FLUSH_SECONDS", "60"))
+# Label-free drift: request histograms vs the artifact's training reference
+DRIFT_ENABLED = os.environ.get("DRIFT_ENABLED", "1") == "1"
+DRIFT_WINDOW_SECONDS = float(os.environ.get("DRIFT_WINDOW_SECONDS", "900"))
+DRIFT_MIN_SAMPLES = int(os.environ.get("DRIFT_MIN_SAMPLES", "200"))
+# Periodic snapshot of the join/aggregate state, restored on startup; empty disables
+SNAPSHOT_PATH = os.environ.get("SNAPSHOT_PATH", "")
+SNAPSHOT_INTERVAL_SECONDS = float(os.environ.get("SNAPSHOT_INTERVAL_SECONDS", "30"))
+SNAPSHOT_MAX_AGE_SECONDS = float(os.environ.get("SNAPSHOT_MAX_AGE_SECONDS", "900"))
+SNAPSHOT_TERM_TIMEOUT_SECONDS = float(os.environ.get("SNAPSHOT_TERM_TIMEOUT_SECONDS", "5"))
+# Served predictions + feedback as rotating segment files; empty disables
+PREDICTION_LOG_DIR = os.environ.get("PREDICTION_LOG_DIR", "")
+PREDICTION_LOG_FORMAT = os.environ.get("PREDICTION_LOG_FORMAT", "ndjson")  # ndjson (gzip) | parquet
+PREDICTION_LOG_QUEUE = int(os.environ.get("PREDICTION_LOG_QUEUE", "10000"))
+PREDICTION_LOG_BATCH = int(os.environ.get("PREDICTION_LOG_BATCH", "512"))
+PREDICTION_LOG_FLUSH_SECONDS = float(os.environ.get("PREDICTION_LOG_FLUSH_SECONDS", "1"))
+PREDICTION_LOG_SEGMENT_MB = float(os.environ.get("PREDICTION_LOG_SEGMENT_MB", "64"))
+PREDICTION_LOG_SEGMENT_SECONDS = float(os.environ.get("PREDICTION_LOG_SEGMENT_SECONDS", "3600"))
+# Raw /predict + /feedback capture for tools/replay_traffic.py; empty disables
+CAPTURE_DIR = os.environ.get("CAPTURE_DIR", "")
+CAPTURE_FORMAT = os.environ.get("CAPTURE_FORMAT", "ndjson")  # ndjson (gzip) | parquet
+CAPTURE_SAMPLE_RATE = float(os.environ.get("CAPTURE_SAMPLE_RATE", "1"))
+# Candidate model scored off the request path on a sample of live traffic; empty disables
+SHADOW_MODEL_PATH = os.environ.get("SHADOW_MODEL_PATH", "")
+SHADOW_SAMPLE_RATE = float(os.environ.get("SHADOW_SAMPLE_RATE", "1"))
+SHADOW_QUEUE = int(os.environ.get("SHADOW_QUEUE", "10000"))
+SHADOW_BATCH = int(os.environ.get("SHADOW_BATCH", "256"))
 
 # Threading controls (honored by xgboost/BLAS if set before import/use)
 _half_threads = max(1, os.cpu_count() // 2 if os.cpu_count() else 1)
@@ -59,6 +132,8 @@ class PredictRecord(BaseModel):
     Body_Temp: float
     Gender: Optional[str] = None
     Sex: Optional[str] = None
+    # perf_counter() at the end of validation; splits ingress time into validate vs queue wait
+    _validated_at: float = PrivateAttr(default=0.0)
 
     @field_validator("Sex")
     @classmethod
@@ -122,6 +197,7 @@ class PredictRecord(BaseModel):
     def model_post_init(self, __context):
         if self.Gender is None and self.Sex is None:
             raise ValueError("One of 'Gender' or 'Sex' must be provided")
+        self._validated_at = time.perf_counter()
 
 
 class FeedbackRecord(BaseModel):
@@ -139,87 +215,1145 @@ REQUEST_COUNT = Counter(
 REQUEST_LATENCY = Histogram(
     "app_request_latency_seconds", "Request latency seconds", ["route", "method"]
 )
+# DS metrics carry model="live" or "shadow" (see ShadowScorer); each MetricsState writes one label
 PRED_VALUE = Histogram(
-    "app_pred_calories", "Predicted calories value"
+    "app_pred_calories", "Predicted calories value", ["model"]
 )
 FEEDBACK_LAG = Histogram(
-    "app_feedback_lag_seconds", "Seconds between prediction and feedback"
+    "app_feedback_lag_seconds", "Seconds between prediction and feedback", ["model"]
+)
+FEEDBACK_JOINS = Counter(
+    "app_feedback_joins_total",
+    "Feedback by join outcome: in-memory window, late (spilled to disk) or missing",
+    ["model", "result"],
+)
+LATE_FEEDBACK_LAG = Histogram(
+    "app_late_feedback_lag_seconds",
+    "Seconds between prediction and feedback for late (disk-joined) feedback",
+    ["model"],
+    buckets=(60, 300, 900, 1800, 3600, 4 * 3600, 12 * 3600, 86400, 3 * 86400, 7 * 86400),
+)
+ROLLING_LATE_RMSLE_5M = Gauge(
+    "app_rolling_late_rmsle_5m", "Rolling RMSLE of late-joined feedback received in the last 5 minutes", ["model"]
 )
-ROLLING_RMSLE_5M = Gauge("app_rolling_rmsle_5m", "Rolling RMSLE over last 5 minutes")
-ROLLING_MAE_5M = Gauge("app_rolling_mae_5m", "Rolling MAE over last 5 minutes")
+ROLLING_LATE_MAE_5M = Gauge(
+    "app_rolling_late_mae_5m", "Rolling MAE of late-joined feedback received in the last 5 minutes", ["model"]
+)
+SPILL_ROWS = Gauge("app_spill_rows", "Evicted predictions held on disk (plus unflushed buffer)")
+SPILL_SEGMENTS = Gauge("app_spill_segments", "Spill segment files on disk")
+SPILL_BYTES = Gauge("app_spill_bytes", "Bytes of spill segment files on disk")
+ROLLING_RMSLE_5M = Gauge("app_rolling_rmsle_5m", "Rolling RMSLE over last 5 minutes", ["model"])
+ROLLING_MAE_5M = Gauge("app_rolling_mae_5m", "Rolling MAE over last 5 minutes", ["model"])
 COVERAGE_5M = Gauge(
     "app_feedback_coverage_5m",
     "Fraction of predictions in last 5 minutes that have feedback",
+    ["model"],
+)
+STAGE_LATENCY = Histogram(
+    "app_stage_latency_seconds",
+    "Per-stage latency of the predict pipeline",
+    ["stage", "batch"],
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+
+
+def batch_bucket(n: int) -> str:
+    if n <= 1:
+        return "1"
+    if n <= 16:
+        return "2-16"
+    if n <= 128:
+        return "17-128"
+    return "129+"
+
+
+class StageTimer:
+    """Consecutive stage durations for one request, flushed to STAGE_LATENCY in one go."""
+
+    __slots__ = ("last", "batch", "stages")
+
+    def __init__(self, start: Optional[float] = None, batch: int = 1):
+        self.last = time.perf_counter() if start is None else start
+        self.batch = batch
+        self.stages: List[Tuple[str, float]] = []
+
+    def mark(self, stage: str, now: Optional[float] = None):
+        if now is None:
+            now = time.perf_counter()
+        self.stages.append((stage, now - self.last))
+        self.last = now
+
+    def observe(self):
+        bucket = batch_bucket(self.batch)
+        for stage, dt in self.stages:
+            child = _stage_children.get((stage, bucket))
+            if child is None:
+                child = _stage_children[(stage, bucket)] = STAGE_LATENCY.labels(stage=stage, batch=bucket)
+            child.observe(max(0.0, dt))
+
+
+# labels() does a locked dict lookup per call; cache children for the hot path
+_stage_children: Dict[Tuple[str, str], Histogram] = {}
+
+
+class RequestTrace:
+    """Per-request context shared by the middleware and handlers (via a ContextVar)."""
+
+    __slots__ = ("request_id", "record_id", "timer", "payload_bytes", "pool_busy", "pool_size")
+
+    def __init__(self, request_id: str, timer: Optional[StageTimer] = None):
+        self.request_id = request_id
+        self.record_id: Optional[int] = None
+        self.timer = timer
+        self.payload_bytes = 0
+        self.pool_busy = 0
+        self.pool_size = 0
+
+    def exemplar(self) -> Dict[str, str]:
+        ex = {"request_id": self.request_id}
+        if self.record_id is not None:
+            ex["record_id"] = str(self.record_id)
+        return ex
+
+    def describe(self, route: str, method: str, status: int, duration: float) -> dict:
+        stages = {k: round(v * 1000.0, 3) for k, v in self.timer.stages} if self.timer else {}
+        return {
+            "ts": time.time(),
+            "route": route,
+            "method": method,
+            "status": status,
+            "duration_ms": round(duration * 1000.0, 3),
+            "request_id": self.request_id,
+            "record_id": self.record_id,
+            "payload_bytes": self.payload_bytes,
+            "stages_ms": stages,
+            "queue_wait_ms": stages.get("queue_wait"),
+            "threadpool_busy": self.pool_busy,
+            "threadpool_size": self.pool_size,
+        }
+
+
+# Set by the middleware for the duration of a request; read by handlers (incl. threadpool)
+_request_trace: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+_request_seq = itertools.count(1)
+_request_prefix = f"{os.getpid():x}"
+
+
+def _new_request_id() -> str:
+    return f"{_request_prefix}-{next(_request_seq):x}"
+
+
+def _reset_request_prefix():
+    global _request_prefix
+    _request_prefix = f"{os.getpid():x}"
+
+
+# workers forked by service/preload.py must not reuse the parent's request-id prefix
+os.register_at_fork(after_in_child=_reset_request_prefix)
+
+
+class SlowRequestLog:
+    """Slowest-N requests over a sliding window, in fixed memory.
+
+    The window is split into ``slots`` time slices, each a min-heap of at most
+    ``capacity`` entries. Slices are reused ring-style as time advances, so memory is
+    bounded by slots * capacity entries no matter how much traffic arrives.
+    """
+
+    def __init__(self, capacity: int = 20, window_seconds: float = 300.0, slots: int = 6):
+        self.capacity = max(1, capacity)
+        self.window = window_seconds
+        self.slot_seconds = window_seconds / slots
+        self._heaps: List[list] = [[] for _ in range(slots)]
+        self._epochs = [-1] * slots
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def _slot(self, now: float) -> Tuple[int, int]:
+        epoch = int(now // self.slot_seconds)
+        return epoch, epoch % len(self._heaps)
+
+    def admits(self, duration: float, now: Optional[float] = None) -> bool:
+        # lock-free pre-check so fast requests never build a record
+        epoch, i = self._slot(time.time() if now is None else now)
+        heap = self._heaps[i]
+        return self._epochs[i] != epoch or len(heap) < self.capacity or duration > heap[0][0]
+
+    def add(self, duration: float, record: dict, now: Optional[float] = None):
+        epoch, i = self._slot(time.time() if now is None else now)
+        with self._lock:
+            if self._epochs[i] != epoch:
+                self._heaps[i] = []
+                self._epochs[i] = epoch
+            heap = self._heaps[i]
+            entry = (duration, next(self._seq), record)
+            if len(heap) < self.capacity:
+                heapq.heappush(heap, entry)
+            elif duration > heap[0][0]:
+                heapq.heapreplace(heap, entry)
+
+    def snapshot(self, now: Optional[float] = None) -> List[dict]:
+        epoch, _ = self._slot(time.time() if now is None else now)
+        oldest = epoch - len(self._heaps) + 1
+        with self._lock:
+            entries = [e for i, h in enumerate(self._heaps) if self._epochs[i] >= oldest for e in h]
+        entries.sort(key=lambda e: -e[0])
+        return [e[2] for e in entries[: self.capacity]]
+
+
+slow_log = SlowRequestLog(SLOW_LOG_SIZE, SLOW_LOG_WINDOW_SECONDS)
+
+
+METRICS_SCRAPE_DURATION = Histogram(
+    "app_metrics_scrape_duration_seconds",
+    "Time to serve /metrics (cache hit or re-render)",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
 )
+METRICS_SNAPSHOT_AGE = Gauge(
+    "app_metrics_snapshot_age_seconds",
+    "Age of the rolling aggregates (last metrics-refresh tick) when this exposition was rendered",
+)
+
+
+class ScaledClock:
+    """Epoch seconds that advance ``scale`` times faster than wall time from ``anchor`` on.
+
+    Lets tools/sim_stream.py --time-scale replay an hour of traffic in minutes while
+    the rolling windows still see an hour pass.
+    """
+
+    def __init__(self, scale: float, anchor: Optional[float] = None):
+        self.scale = scale
+        self.anchor = time.time() if anchor is None else anchor
+
+    def __call__(self) -> float:
+        return self.anchor + (time.time() - self.anchor) * self.scale
+
+
+class _ModelMetrics:
+    """The DS metric children of one ``model`` label value, bound once."""
+
+    def __init__(self, model: str):
+        self.pred_value = PRED_VALUE.labels(model)
+        self.lag = FEEDBACK_LAG.labels(model)
+        self.late_lag = LATE_FEEDBACK_LAG.labels(model)
+        self.join_window = FEEDBACK_JOINS.labels(model, "window")
+        self.join_late = FEEDBACK_JOINS.labels(model, "late")
+        self.join_missing = FEEDBACK_JOINS.labels(model, "missing")
+        self.rmsle = ROLLING_RMSLE_5M.labels(model)
+        self.mae = ROLLING_MAE_5M.labels(model)
+        self.coverage = COVERAGE_5M.labels(model)
+        self.late_rmsle = ROLLING_LATE_RMSLE_5M.labels(model)
+        self.late_mae = ROLLING_LATE_MAE_5M.labels(model)
 
 
 class MetricsState:
-    def __init__(self, window_seconds: int = 300):
+    def __init__(self, window_seconds: int = 300, clock=time.time, model: str = "live"):
         self.window = window_seconds
-        # predictions: id -> (ts_pred, y_pred)
-        self.pred_index: Dict[int, Tuple[float, float]] = {}
+        # every timestamp the state stamps itself comes from here; see ScaledClock
+        self.clock = clock
+        self.model = model
+        self._metrics = _ModelMetrics(model)
+        # predictions: id -> (ts_pred, y_pred, raw features or None)
+        self.pred_index: Dict[int, Tuple[float, float, Optional[dict]]] = {}
         self.pred_deque: deque[Tuple[int, float]] = deque()
         # evaluations: deque of (ts_eval, sq_log_err, abs_err)
         self.eval_deque: deque[Tuple[float, float, float]] = deque()
         # matched by id for coverage accounting
         self.matched_ids: Dict[int, float] = {}
+        # running sums over eval_deque, maintained on append/evict
+        self._sum_sq = 0.0
+        self._sum_abs = 0.0
+        # late (disk-joined) evaluations, kept apart so they do not skew the live window
+        self.late_deque: deque[Tuple[float, float, float]] = deque()
+        self._late_sum_sq = 0.0
+        self._late_sum_abs = 0.0
+        # handlers run on threadpool workers concurrently with the refresh thread
+        self._lock = threading.Lock()
+        # receives joined rows when predictions were stored with their features
+        self.feedback_store: Optional["FeedbackStore"] = None
+        # second tier of the prediction index: evicted predictions on disk
+        self.spill: Optional["SpillIndex"] = None
 
-    def add_prediction(self, rec_id: int, y_pred: float, ts_pred: Optional[float] = None):
-        ts = time.time() if ts_pred is None else ts_pred
-        self.pred_index[rec_id] = (ts, y_pred)
-        self.pred_deque.append((rec_id, ts))
-        PRED_VALUE.observe(float(y_pred))
+    def add_prediction(self, rec_id: int, y_pred: float, ts_pred: Optional[float] = None,
+                       features: Optional[dict] = None):
+        ts = self.clock() if ts_pred is None else ts_pred
+        with self._lock:
+            self.pred_index[rec_id] = (ts, y_pred, features)
+            self.pred_deque.append((rec_id, ts))
+        self._metrics.pred_value.observe(float(y_pred))
 
-    def add_feedback(self, rec_id: int, y_true: float, ts_true: Optional[float] = None):
-        now = time.time()
+    def add_feedback(self, rec_id: int, y_true: float, ts_true: Optional[float] = None) -> bool:
+        now = self.clock()
         ts_feedback = now if ts_true is None else ts_true
-        pred = self.pred_index.get(rec_id)
-        if pred is None:
-            return  # unknown id; ignore silently
-        ts_pred, y_pred = pred
+        with self._lock:
+            pred = self.pred_index.get(rec_id)
+        late = pred is None
+        if late:
+            spilled = self.spill.lookup(rec_id) if self.spill is not None else None
+            if spilled is None:
+                self._metrics.join_missing.inc()
+                return False  # unknown or expired id; ignore silently
+            (ts_pred, y_pred), features = spilled, None
+        else:
+            ts_pred, y_pred, features = pred
         lag = max(0.0, ts_feedback - ts_pred)
-        FEEDBACK_LAG.observe(lag)
+        (self._metrics.late_lag if late else self._metrics.lag).observe(lag)
         # compute errors
         y_true = float(y_true)
         y_pred = float(y_pred)
         sq_log_err = float((np.log1p(y_true) - np.log1p(y_pred)) ** 2)
         abs_err = float(abs(y_true - y_pred))
-        self.eval_deque.append((now, sq_log_err, abs_err))
-        self.matched_ids[rec_id] = ts_pred
-        self._recompute(now)
+        if late:
+            with self._lock:
+                self.late_deque.append((now, sq_log_err, abs_err))
+                self._late_sum_sq += sq_log_err
+                self._late_sum_abs += abs_err
+            self._metrics.join_late.inc()
+            return True
+        with self._lock:
+            self.eval_deque.append((now, sq_log_err, abs_err))
+            self._sum_sq += sq_log_err
+            self._sum_abs += abs_err
+            self.matched_ids[rec_id] = ts_pred
+        self._metrics.join_window.inc()
+        if features is not None and self.feedback_store is not None:
+            self.feedback_store.append(features, y_pred, y_true, ts_pred, ts_feedback)
+        # gauges are refreshed by the background tick (_recompute), not per feedback
+        return True
+
+    def snapshot(self) -> Dict[str, np.ndarray]:
+        """Join and aggregate state as flat arrays; only shallow copies happen under the lock."""
+        with self._lock:
+            preds = list(self.pred_deque)
+            index = dict(self.pred_index)
+            matched = list(self.matched_ids.items())
+            evals = list(self.eval_deque)
+            late = list(self.late_deque)
+        # the deque can hold stale entries for re-predicted ids; keep the one the index points to
+        live = [(rid, ts, index[rid][1]) for rid, ts in preds if rid in index and index[rid][0] == ts]
+        return {
+            "pred_id": np.array([r[0] for r in live], dtype=np.int64),
+            "pred_ts": np.array([r[1] for r in live], dtype=np.float64),
+            "pred_y": np.array([r[2] for r in live], dtype=np.float64),
+            "matched_id": np.array([m[0] for m in matched], dtype=np.int64),
+            "matched_ts": np.array([m[1] for m in matched], dtype=np.float64),
+            "evals": np.array(evals, dtype=np.float64).reshape(-1, 3),
+            "late_evals": np.array(late, dtype=np.float64).reshape(-1, 3),
+        }
+
+    def restore(self, snap: Dict[str, np.ndarray], now: Optional[float] = None) -> int:
+        """Merge a snapshot, dropping entries already outside the window; returns predictions restored.
+
+        Predictions that aged out while the service was down go to the spill tier when enabled.
+        """
+        if now is None:
+            now = self.clock()
+        cutoff = now - self.window
+        pred_ts = snap["pred_ts"]
+        keep = pred_ts >= cutoff
+        ids, ts, ys = snap["pred_id"][keep].tolist(), pred_ts[keep].tolist(), snap["pred_y"][keep].tolist()
+        evals = snap["evals"][snap["evals"][:, 0] >= cutoff]
+        late = snap["late_evals"][snap["late_evals"][:, 0] >= cutoff]
+        if self.spill is not None and (~keep).any():
+            self.spill.append(list(zip(snap["pred_id"][~keep].tolist(), pred_ts[~keep].tolist(),
+                                       snap["pred_y"][~keep].tolist())))
+        with self._lock:
+            for rid, t, y in zip(ids, ts, ys):
+                self.pred_index[rid] = (t, y, None)
+                self.pred_deque.append((rid, t))
+            for rid, t in zip(snap["matched_id"].tolist(), snap["matched_ts"].tolist()):
+                if rid in self.pred_index:
+                    self.matched_ids[rid] = t
+            self.eval_deque.extend(map(tuple, evals.tolist()))
+            self._sum_sq += float(evals[:, 1].sum())
+            self._sum_abs += float(evals[:, 2].sum())
+            self.late_deque.extend(map(tuple, late.tolist()))
+            self._late_sum_sq += float(late[:, 1].sum())
+            self._late_sum_abs += float(late[:, 2].sum())
+        return len(ids)
 
     def _recompute(self, now: Optional[float] = None):
         if now is None:
-            now = time.time()
+            now = self.clock()
         cutoff = now - self.window
-        # evict old preds
-        while self.pred_deque and self.pred_deque[0][1] < cutoff:
-            rid, _ = self.pred_deque.popleft()
-            self.pred_index.pop(rid, None)
-            self.matched_ids.pop(rid, None)
-        # evict old evals
-        while self.eval_deque and self.eval_deque[0][0] < cutoff:
-            self.eval_deque.popleft()
-        # recompute DS aggregates
-        n = len(self.eval_deque)
+        evicted: List[Tuple[int, float, float]] = []
+        with self._lock:
+            # evict old preds
+            while self.pred_deque and self.pred_deque[0][1] < cutoff:
+                rid, _ = self.pred_deque.popleft()
+                entry = self.pred_index.pop(rid, None)
+                self.matched_ids.pop(rid, None)
+                if entry is not None and self.spill is not None:
+                    evicted.append((rid, entry[0], entry[1]))
+            # evict old evals
+            while self.eval_deque and self.eval_deque[0][0] < cutoff:
+                _, sq, ab = self.eval_deque.popleft()
+                self._sum_sq -= sq
+                self._sum_abs -= ab
+            n = len(self.eval_deque)
+            if n == 0:
+                # drop accumulated float drift whenever the window empties
+                self._sum_sq = 0.0
+                self._sum_abs = 0.0
+            sum_sq = max(0.0, self._sum_sq)
+            sum_abs = max(0.0, self._sum_abs)
+            total_preds = len(self.pred_deque)
+            matched = len(self.matched_ids)
+            while self.late_deque and self.late_deque[0][0] < cutoff:
+                _, sq, ab = self.late_deque.popleft()
+                self._late_sum_sq -= sq
+                self._late_sum_abs -= ab
+            n_late = len(self.late_deque)
+            if n_late == 0:
+                self._late_sum_sq = 0.0
+                self._late_sum_abs = 0.0
+            late_sq = max(0.0, self._late_sum_sq)
+            late_abs = max(0.0, self._late_sum_abs)
+        if self.spill is not None:
+            # file I/O stays outside the state lock
+            self.spill.append(evicted)
+            self.spill.maintain(now)
+        # DS aggregates from running sums: O(1) per tick plus amortized eviction
+        g = self._metrics
         if n > 0:
-            sum_sq = sum(x[1] for x in self.eval_deque)
-            sum_abs = sum(x[2] for x in self.eval_deque)
-            rmsle = float(np.sqrt(sum_sq / n))
-            mae = float(sum_abs / n)
-            ROLLING_RMSLE_5M.set(rmsle)
-            ROLLING_MAE_5M.set(mae)
+            g.rmsle.set(float(np.sqrt(sum_sq / n)))
+            g.mae.set(float(sum_abs / n))
         else:
-            ROLLING_RMSLE_5M.set(0.0)
-            ROLLING_MAE_5M.set(0.0)
+            g.rmsle.set(0.0)
+            g.mae.set(0.0)
         # coverage = matched predictions / total predictions in window
-        total_preds = len(self.pred_deque)
-        matched = len(self.matched_ids)
         cov = float(matched) / float(total_preds) if total_preds > 0 else 0.0
-        COVERAGE_5M.set(cov)
+        g.coverage.set(cov)
+        g.late_rmsle.set(float(np.sqrt(late_sq / n_late)) if n_late else 0.0)
+        g.late_mae.set(float(late_abs / n_late) if n_late else 0.0)
+
 
+class SpillIndex:
+    """Evicted predictions on disk as id-sorted, memory-mapped ``.npy`` segments.
 
-state = MetricsState(PREDICTION_WINDOW_SECONDS)
+    A segment is one int64 array of shape (3, n): sorted ids, then the float64 bits of
+    ts_pred and y_pred. The id row is contiguous, so ``searchsorted`` runs directly on the
+    mmap and touches only O(log n) pages. Evictions collect in a small buffer and are
+    written as one segment once ``segment_rows`` accumulate or the buffer is
+    ``flush_seconds`` old. Lookups visit segments whose id range covers the id, newest
+    first. Segments whose newest prediction is older than ``retention_seconds`` are
+    deleted. Existing segments are picked up on start.
+    """
+
+    def __init__(self, directory: str, retention_seconds: float, segment_rows: int = 65536,
+                 flush_seconds: float = 60.0):
+        self.directory = directory
+        self.retention = retention_seconds
+        self.segment_rows = segment_rows
+        self.flush_seconds = flush_seconds
+        # (min_id, max_id, max_ts, path, (3, n) array), oldest first
+        self._segments: List[Tuple[int, int, float, str, np.ndarray]] = []
+        self._pending: List[np.ndarray] = []
+        self._pending_rows = 0
+        self._pending_since: Optional[float] = None
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load_existing()
+
+    def _load_existing(self):
+        for name in sorted(os.listdir(self.directory)):
+            if not (name.startswith("spill-") and name.endswith(".npy")):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                # spill-<min_ts>-<max_ts>-<pid>-<seq>.npy
+                max_ts = float(name[:-4].split("-")[2])
+                arr = np.load(path, mmap_mode="r").view(np.ndarray)
+            except (ValueError, IndexError, OSError):
+                logging.warning("Skipping unreadable spill segment %s", path)
+                continue
+            if arr.ndim == 2 and arr.shape[1]:
+                self._segments.append((int(arr[0, 0]), int(arr[0, -1]), max_ts, path, arr))
+        self._segments.sort(key=lambda seg: seg[2])
+
+    def append(self, rows: List[Tuple[int, float, float]]):
+        if not rows:
+            return
+        ids, ts, preds = zip(*rows)
+        block = np.empty((3, len(rows)), dtype=np.int64)
+        block[0] = ids
+        block[1] = np.asarray(ts, dtype=np.float64).view(np.int64)
+        block[2] = np.asarray(preds, dtype=np.float64).view(np.int64)
+        with self._lock:
+            self._pending.append(block)
+            self._pending_rows += len(rows)
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+
+    @staticmethod
+    def _row(arr: np.ndarray, i: int) -> Tuple[float, float]:
+        return float(arr[1, i:i + 1].view(np.float64)[0]), float(arr[2, i:i + 1].view(np.float64)[0])
+
+    def lookup(self, rec_id: int) -> Optional[Tuple[float, float]]:
+        with self._lock:
+            pending = list(self._pending)
+            segments = list(self._segments)
+        for arr in reversed(pending):
+            hits = np.flatnonzero(arr[0] == rec_id)
+            if hits.size:
+                return self._row(arr, int(hits[-1]))
+        for min_id, max_id, _, _, arr in reversed(segments):
+            if not min_id <= rec_id <= max_id:
+                continue
+            # duplicates keep time order (stable sort), so the rightmost match is the newest
+            i = int(arr[0].searchsorted(rec_id, side="right")) - 1
+            if i >= 0 and arr[0, i] == rec_id:
+                return self._row(arr, i)
+        return None
+
+    def maintain(self, now: float, force_flush: bool = False):
+        with self._lock:
+            due = self._pending_rows >= self.segment_rows or (
+                self._pending_since is not None
+                and (force_flush or time.monotonic() - self._pending_since >= self.flush_seconds)
+            )
+            taken = list(self._pending) if due else []
+            expired = [seg for seg in self._segments if seg[2] < now - self.retention]
+        if taken:
+            self._write_segment(taken)
+        if expired:
+            gone = {seg[3] for seg in expired}
+            with self._lock:
+                self._segments = [seg for seg in self._segments if seg[3] not in gone]
+            for path in gone:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+        with self._lock:
+            SPILL_ROWS.set(sum(seg[4].shape[1] for seg in self._segments) + self._pending_rows)
+            SPILL_SEGMENTS.set(len(self._segments))
+            SPILL_BYTES.set(sum(seg[4].nbytes for seg in self._segments))
+
+    def _write_segment(self, taken: List[np.ndarray]):
+        arr = np.concatenate(taken, axis=1)
+        arr = np.ascontiguousarray(arr[:, np.argsort(arr[0], kind="stable")])
+        ts = arr[1].view(np.float64)
+        name = f"spill-{ts.min():.3f}-{ts.max():.3f}-{os.getpid()}-{next(self._seq):06d}.npy"
+        path = os.path.join(self.directory, name)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, arr)
+        os.replace(tmp, path)
+        mm = np.load(path, mmap_mode="r").view(np.ndarray)
+        with self._lock:
+            # lookups switch from the buffer to the mmap in one step
+            self._segments.append((int(arr[0, 0]), int(arr[0, -1]), float(ts.max()), path, mm))
+            del self._pending[:len(taken)]
+            self._pending_rows = sum(a.shape[1] for a in self._pending)
+            self._pending_since = time.monotonic() if self._pending else None
+
+    def close(self, now: float):
+        # ``now`` from MetricsState.clock, so expiry follows CLOCK_SCALE like every other cutoff
+        self.maintain(now, force_flush=True)
+
+
+FEEDBACK_STORE_ROWS = Counter(
+    "app_feedback_store_rows_total", "Joined feedback rows appended to the retraining store"
+)
+
+
+class FeedbackStore:
+    """Buffers joined feedback rows and appends them to a CSV readable like train.csv.
+
+    Handlers only append to an in-memory list; ``flush`` (on a PeriodicTask and at
+    shutdown) does the file I/O.
+    """
+
+    COLUMNS = ["id", "Gender", "Age", "Height", "Weight", "Duration", "Heart_Rate", "Body_Temp",
+               "Calories", "prediction", "ts_pred", "ts_feedback"]
+
+    def __init__(self, path: str):
+        self.path = path
+        self._rows: List[list] = []
+        self._lock = threading.Lock()
+
+    def append(self, features: dict, y_pred: float, y_true: float, ts_pred: float, ts_feedback: float):
+        row = [features.get(c) for c in self.COLUMNS[:8]] + [y_true, y_pred, ts_pred, ts_feedback]
+        with self._lock:
+            self._rows.append(row)
+
+    def flush(self) -> int:
+        with self._lock:
+            rows, self._rows = self._rows, []
+        if not rows:
+            return 0
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, "a", newline="") as f:
+            w = csv.writer(f)
+            if new_file:
+                w.writerow(self.COLUMNS)
+            w.writerows(rows)
+        FEEDBACK_STORE_ROWS.inc(len(rows))
+        return len(rows)
+
+
+state = MetricsState(PREDICTION_WINDOW_SECONDS, clock=ScaledClock(CLOCK_SCALE) if CLOCK_SCALE != 1 else time.time)
+feedback_store: Optional[FeedbackStore] = FeedbackStore(FEEDBACK_STORE_PATH) if FEEDBACK_STORE_PATH else None
+state.feedback_store = feedback_store
+if SPILL_DIR:
+    state.spill = SpillIndex(SPILL_DIR, SPILL_RETENTION_SECONDS, SPILL_SEGMENT_ROWS, SPILL_FLUSH_SECONDS)
+
+
+class PeriodicTask:
+    """Calls ``fn`` every ``interval`` seconds on a daemon thread until stopped."""
+
+    def __init__(self, name: str, interval: float, fn):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.fn()
+            except Exception:
+                logging.exception("%s tick failed", self.name)
+
+
+class ExpositionCache:
+    """Pre-rendered /metrics bytes per format, re-rendered at most every ``ttl`` seconds.
+
+    Concurrent scrapers share one render; the gzip body is built lazily once per render.
+    ``on_render`` runs just before each render, so gauges it sets describe that body.
+    """
+
+    def __init__(self, ttl: float, on_render=None):
+        self.ttl = ttl
+        self.on_render = on_render
+        self._lock = threading.Lock()
+        # fmt -> [rendered_at (monotonic), body, gzipped body or None]
+        self._entries: Dict[str, list] = {}
+
+    @staticmethod
+    def _render(fmt: str) -> bytes:
+        if fmt == "openmetrics":
+            return generate_openmetrics(REGISTRY)
+        return generate_latest()
+
+    def get(self, fmt: str, want_gzip: bool = False) -> Tuple[bytes, float, bool]:
+        entry = self._entries.get(fmt)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            with self._lock:
+                entry = self._entries.get(fmt)
+                if entry is None or time.monotonic() - entry[0] > self.ttl:
+                    if self.on_render is not None:
+                        self.on_render()
+                    entry = [time.monotonic(), self._render(fmt), None]
+                    self._entries[fmt] = entry
+        age = time.monotonic() - entry[0]
+        if not want_gzip:
+            return entry[1], age, False
+        if entry[2] is None:
+            entry[2] = gzip.compress(entry[1], compresslevel=5)
+        return entry[2], age, True
+
+
+def _stamp_aggregates_age():
+    refreshed = _aggregates_refreshed_at
+    METRICS_SNAPSHOT_AGE.set(time.monotonic() - refreshed if refreshed is not None else float("nan"))
+
+
+metrics_cache = ExpositionCache(METRICS_CACHE_MS / 1000.0, on_render=_stamp_aggregates_age)
+# --------------------
+# Feature drift
+# --------------------
+FEATURE_PSI = Gauge(
+    "app_feature_psi", "Population stability index of recent requests vs the training reference", ["feature"]
+)
+FEATURE_KS = Gauge(
+    "app_feature_ks", "Max CDF gap (binned KS) of recent requests vs the training reference", ["feature"]
+)
+DRIFT_SAMPLES = Gauge("app_drift_window_samples", "Requests in the drift window")
+
+
+class DriftMonitor:
+    """Fixed-memory histograms of request features and predictions over a sliding window.
+
+    Bins come from the reference saved by train.py (``ModelWrapper.reference``): quantile
+    edges for numeric features, categories (+1 unseen bin) for categorical ones. Each
+    request adds one count per feature to the current slot of a ring of ``slots`` time
+    slices; ``publish`` sums live slots and sets PSI/KS gauges in O(features * bins).
+    """
+
+    PSI_EPS = 1e-4
+
+    def __init__(self, reference: dict, window_seconds: float, slots: int = 6, min_samples: int = 200):
+        self.slot_seconds = window_seconds / slots
+        self.min_samples = min_samples
+        # (name, edges or category index, reference probs, numeric?)
+        self.features: List[Tuple[str, object, np.ndarray, bool]] = []
+        for name, ref in reference.get("numeric", {}).items():
+            self.features.append((name, list(ref["edges"]), np.asarray(ref["probs"], dtype=float), True))
+        for name, ref in reference.get("categorical", {}).items():
+            index = {c: i for i, c in enumerate(ref["categories"])}
+            self.features.append((name, index, np.append(np.asarray(ref["probs"], dtype=float), 0.0), False))
+        self._sizes = [len(f[2]) for f in self.features]
+        self._slot_ids = [-1] * slots
+        self._counts = [[[0] * n for n in self._sizes] for _ in range(slots)]
+        self._totals = [0] * slots
+        self._lock = threading.Lock()
+        self._psi = [FEATURE_PSI.labels(f[0]) for f in self.features]
+        self._ks = [FEATURE_KS.labels(f[0]) for f in self.features]
+
+    def observe(self, row: dict, y_pred: float, now: Optional[float] = None):
+        slot_id = int((time.time() if now is None else now) // self.slot_seconds)
+        k = slot_id % len(self._slot_ids)
+        with self._lock:
+            if self._slot_ids[k] != slot_id:
+                self._slot_ids[k] = slot_id
+                self._counts[k] = [[0] * n for n in self._sizes]
+                self._totals[k] = 0
+            counts = self._counts[k]
+            self._totals[k] += 1
+            for i, (name, lookup, _, numeric) in enumerate(self.features):
+                v = y_pred if name == "prediction" else row.get(name)
+                if v is None:
+                    continue
+                if numeric:
+                    counts[i][bisect.bisect_right(lookup, v)] += 1
+                else:
+                    counts[i][lookup.get(str(v).strip().lower(), len(lookup))] += 1
+
+    def window_counts(self, now: Optional[float] = None) -> Tuple[int, List[np.ndarray]]:
+        current = int((time.time() if now is None else now) // self.slot_seconds)
+        live = [k for k, sid in enumerate(self._slot_ids) if current - len(self._slot_ids) < sid <= current]
+        with self._lock:
+            total = sum(self._totals[k] for k in live)
+            sums = [np.sum([self._counts[k][i] for k in live], axis=0) if live else np.zeros(n)
+                    for i, n in enumerate(self._sizes)]
+        return total, sums
+
+    def publish(self, now: Optional[float] = None):
+        total, sums = self.window_counts(now)
+        DRIFT_SAMPLES.set(total)
+        for i, (_, _, ref, numeric) in enumerate(self.features):
+            n = sums[i].sum()
+            if n < self.min_samples:
+                # too few requests to say anything; NaN keeps alerts from firing on noise
+                self._psi[i].set(float("nan"))
+                self._ks[i].set(float("nan"))
+                continue
+            p = np.maximum(sums[i] / n, self.PSI_EPS)
+            q = np.maximum(ref, self.PSI_EPS)
+            self._psi[i].set(float(np.sum((p - q) * np.log(p / q))))
+            # KS over ordered bins; for categories the order is arbitrary, so report total variation
+            diff = np.abs(np.cumsum(sums[i] / n - ref)) if numeric else np.abs(sums[i] / n - ref) / 2.0
+            self._ks[i].set(float(diff.max() if numeric else diff.sum()))
+
+
+drift_monitor: Optional[DriftMonitor] = None
+
+
+def _init_drift(loaded_model):
+    global drift_monitor
+    reference = getattr(loaded_model, "reference", None)
+    if not DRIFT_ENABLED or not reference:
+        drift_monitor = None
+        if DRIFT_ENABLED:
+            logging.info("Drift monitor off: model artifact has no reference histograms (retrain to add them)")
+        return
+    drift_monitor = DriftMonitor(reference, DRIFT_WINDOW_SECONDS, min_samples=DRIFT_MIN_SAMPLES)
+
+
+# monotonic time of the last _refresh_aggregates; add_feedback does not refresh the gauges itself
+_aggregates_refreshed_at: Optional[float] = None
+
+
+def _refresh_aggregates():
+    global _aggregates_refreshed_at
+    now = state.clock()
+    state._recompute(now)
+    scorer = shadow
+    if scorer is not None:
+        scorer.state._recompute(now)
+    monitor = drift_monitor
+    if monitor is not None:
+        monitor.publish(now)
+    _aggregates_refreshed_at = time.monotonic()
+
+
+metrics_refresher = PeriodicTask("metrics-refresh", METRICS_REFRESH_SECONDS, _refresh_aggregates)
+
+
+# --------------------
+# State snapshots
+# --------------------
+SNAPSHOT_BYTES = Gauge("app_state_snapshot_bytes", "Size of the last MetricsState snapshot file")
+SNAPSHOT_SECONDS = Histogram(
+    "app_state_snapshot_seconds",
+    "Time to build and write a MetricsState snapshot",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+SNAPSHOT_RESTORED = Gauge("app_state_snapshot_restored_predictions", "Predictions restored from the snapshot at startup")
+
+SNAPSHOT_VERSION = 1
+_snapshot_lock = threading.Lock()
+
+
+def write_snapshot(path: str, st: MetricsState) -> int:
+    """Write ``st`` as an uncompressed .npz next to ``path`` and rename it into place."""
+    t0 = time.perf_counter()
+    arrays = st.snapshot()
+    tmp = f"{path}.{os.getpid()}.tmp"
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    # the periodic task and the SIGTERM path may race; one writer at a time
+    with _snapshot_lock:
+        with open(tmp, "wb") as f:
+            np.savez(f, version=np.int64(SNAPSHOT_VERSION), written_at=np.float64(st.clock()), **arrays)
+        os.replace(tmp, path)
+    size = os.path.getsize(path)
+    SNAPSHOT_BYTES.set(size)
+    SNAPSHOT_SECONDS.observe(time.perf_counter() - t0)
+    return size
+
+
+def restore_snapshot(path: str, st: MetricsState, max_age: float) -> int:
+    if not os.path.exists(path):
+        return 0
+    try:
+        with np.load(path) as npz:
+            snap = {k: npz[k] for k in npz.files}
+    except Exception:
+        logging.exception("Ignoring unreadable snapshot %s", path)
+        return 0
+    # written_at and the age both use the state's clock, as the restore cutoff does
+    age = st.clock() - float(snap["written_at"])
+    if int(snap["version"]) != SNAPSHOT_VERSION or age > max_age:
+        logging.info("Ignoring snapshot %s (version=%s age=%.0fs)", path, int(snap["version"]), age)
+        return 0
+    restored = st.restore(snap)
+    SNAPSHOT_RESTORED.set(restored)
+    logging.info("Restored %d predictions from snapshot %s (age %.0fs)", restored, path, age)
+    return restored
+
+
+def claim_snapshot_path(path: str) -> Tuple[str, int]:
+    """First snapshot slot no other live process holds: ``path``, then ``<stem>.1<ext>``, ...
+
+    Each worker (uvicorn --workers, service.preload) keeps an flock on its slot for its
+    lifetime, so workers never overwrite each other and a restarted worker restores one
+    worker's state. Returns the path and the lock fd, which must stay open.
+    """
+    root, ext = os.path.splitext(path)
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    for slot in itertools.count():
+        candidate = path if slot == 0 else f"{root}.{slot}{ext}"
+        fd = os.open(f"{candidate}.lock", os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            continue
+        return candidate, fd
+
+
+def _install_sigterm_snapshot():
+    """Start the final snapshot on SIGTERM, then hand the signal to the previous handler (uvicorn's).
+
+    The write runs in a thread so the event loop can start its graceful shutdown at once;
+    ``_shutdown`` waits for that write instead of writing a second one.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def _on_sigterm(signum, frame):
+        global _term_snapshot
+        # a worker thread, so a lock held by the interrupted main thread cannot deadlock us
+        if _term_snapshot is None:
+            _term_snapshot = threading.Thread(target=write_snapshot, args=(snapshot_path, state),
+                                              name="snapshot-sigterm", daemon=True)
+            _term_snapshot.start()
+        if callable(previous):
+            previous(signum, frame)
+        elif previous == signal.SIG_DFL:
+            # nothing else will wait for the write before the process dies
+            _term_snapshot.join(SNAPSHOT_TERM_TIMEOUT_SECONDS)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, _on_sigterm)
+
+
+# set by _startup from claim_snapshot_path; the lock fd stays open for the process lifetime
+snapshot_path = SNAPSHOT_PATH
+_snapshot_slot_fd: Optional[int] = None
+_term_snapshot: Optional[threading.Thread] = None
+snapshotter = (PeriodicTask("state-snapshot", SNAPSHOT_INTERVAL_SECONDS, lambda: write_snapshot(snapshot_path, state))
+               if SNAPSHOT_PATH else None)
+feedback_flusher = (PeriodicTask("feedback-flush", FEEDBACK_FLUSH_SECONDS, feedback_store.flush)
+                    if feedback_store is not None else None)
+
+
+# --------------------
+# Prediction log
+# --------------------
+PREDICTION_LOG_RECORDS = Counter(
+    "app_prediction_log_records_total", "Records written to the prediction log", ["kind"]
+)
+PREDICTION_LOG_DROPPED = Counter(
+    "app_prediction_log_dropped_total", "Records dropped because the prediction log queue was full", ["kind"]
+)
+PREDICTION_LOG_QUEUE_DEPTH = Gauge(
+    "app_prediction_log_queue_depth", "Records waiting for the prediction log writer"
+)
+CAPTURE_QUEUE_DEPTH = Gauge("app_capture_queue_depth", "Records waiting for the traffic capture writer")
+CAPTURE_RECORDS = Counter("app_capture_records_total", "Records written to the traffic capture", ["kind"])
+CAPTURE_DROPPED = Counter(
+    "app_capture_dropped_total", "Records dropped because the traffic capture queue was full", ["kind"]
+)
+
+# column -> type; fixed so every Parquet segment of a kind shares one schema
+LOG_SCHEMAS: Dict[str, Dict[str, type]] = {
+    "predictions": {
+        "ts": float, "request_id": str, "id": int, "Gender": str, "Age": float, "Height": float,
+        "Weight": float, "Duration": float, "Heart_Rate": float, "Body_Temp": float, "prediction": float,
+    },
+    "feedback": {
+        "ts": float, "request_id": str, "id": int, "Calories": float, "ts_true": float, "matched": bool,
+    },
+}
+# request bodies as received, both routes in one arrival-ordered stream (kind = route)
+CAPTURE_SCHEMAS: Dict[str, Dict[str, type]] = {
+    "capture": {
+        "ts": float, "kind": str, "id": int, "Gender": str, "Sex": str, "Age": float, "Height": float,
+        "Weight": float, "Duration": float, "Heart_Rate": float, "Body_Temp": float, "Calories": float,
+        "ts_true": float,
+    },
+}
+
+
+class SegmentWriter:
+    """Appends record batches to size/age-rotated segment files of one kind.
+
+    Segments are written as ``<name>.part`` and renamed when rotated or closed, so a
+    reader globbing ``*.ndjson.gz`` / ``*.parquet`` only sees complete files. NDJSON is
+    gzip sync-flushed after every batch, so a crash loses at most the current batch.
+    """
+
+    def __init__(self, directory: str, kind: str, fmt: str, segment_bytes: int, segment_seconds: float,
+                 columns: Optional[Dict[str, type]] = None):
+        if fmt == "parquet" and pq is None:
+            raise RuntimeError(f"{fmt} segments require pyarrow")
+        self.directory = directory
+        self.kind = kind
+        self.fmt = fmt
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.columns = columns if columns is not None else LOG_SCHEMAS[kind]
+        self._seq = itertools.count()
+        self._path: Optional[str] = None
+        self._opened_at = 0.0
+        self._raw = None
+        self._gz = None
+        self._pq_writer = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _open(self):
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+        ext = "parquet" if self.fmt == "parquet" else "ndjson.gz"
+        name = f"{self.kind}-{stamp}-{os.getpid()}-{next(self._seq):05d}.{ext}"
+        self._path = os.path.join(self.directory, name)
+        self._opened_at = time.monotonic()
+        if self.fmt == "parquet":
+            schema = pa.schema([(c, {float: pa.float64(), int: pa.int64(), str: pa.string(), bool: pa.bool_()}[t])
+                                for c, t in self.columns.items()])
+            self._pq_writer = pq.ParquetWriter(self._path + ".part", schema, compression="zstd")
+        else:
+            self._raw = open(self._path + ".part", "wb")
+            self._gz = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=5)
+
+    def _size(self) -> int:
+        if self._raw is not None:
+            return self._raw.tell()
+        return os.path.getsize(self._path + ".part")
+
+    def write(self, records: List[dict]):
+        if self._path is None:
+            self._open()
+        if self.fmt == "parquet":
+            cols = {c: [r.get(c) for r in records] for c in self.columns}
+            self._pq_writer.write_table(pa.table(cols, schema=self._pq_writer.schema))
+        else:
+            self._gz.write("".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records).encode())
+            self._gz.flush()
+        if self._size() >= self.segment_bytes:
+            self.close()
+
+    def rotate_if_old(self):
+        if self._path is not None and time.monotonic() - self._opened_at >= self.segment_seconds:
+            self.close()
+
+    def close(self):
+        if self._path is None:
+            return
+        if self._pq_writer is not None:
+            self._pq_writer.close()
+        if self._gz is not None:
+            self._gz.close()
+            self._raw.close()
+        os.replace(self._path + ".part", self._path)
+        self._path = self._raw = self._gz = self._pq_writer = None
+
+
+class PredictionLog:
+    """Non-blocking prediction/feedback log.
+
+    Handlers only ``put_nowait`` a dict on a bounded queue (dropping and counting when it
+    is full); one writer thread drains up to ``batch_size`` records at a time into a
+    ``SegmentWriter`` per kind. ``close`` drains the queue and finalizes open segments.
+    """
+
+    def __init__(self, directory: str, fmt: str = "ndjson", max_queue: int = 10000, batch_size: int = 512,
+                 flush_interval: float = 1.0, segment_bytes: int = 64 << 20, segment_seconds: float = 3600.0,
+                 schemas: Optional[Dict[str, Dict[str, type]]] = None, depth_gauge: Optional[Gauge] = None,
+                 records_counter: Optional[Counter] = None, dropped_counter: Optional[Counter] = None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        schemas = LOG_SCHEMAS if schemas is None else schemas
+        self._writers = {kind: SegmentWriter(directory, kind, fmt, segment_bytes, segment_seconds, columns)
+                         for kind, columns in schemas.items()}
+        self._depth = PREDICTION_LOG_QUEUE_DEPTH if depth_gauge is None else depth_gauge
+        self._records = PREDICTION_LOG_RECORDS if records_counter is None else records_counter
+        self._dropped = PREDICTION_LOG_DROPPED if dropped_counter is None else dropped_counter
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def log(self, kind: str, record: dict) -> bool:
+        try:
+            self._queue.put_nowait((kind, record))
+            return True
+        except queue.Full:
+            self._dropped.labels(kind).inc()
+            return False
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="prediction-log", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                # still inside a write: draining here would share its segment writers
+                logging.warning("%s writer still busy after %.1fs; not draining %d queued records",
+                                self._thread.name, timeout or 0.0, self._queue.qsize())
+                return
+        while self._drain():
+            pass
+        for w in self._writers.values():
+            w.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._drain(block=True)
+            except Exception:
+                logging.exception("prediction log write failed")
+
+    def _drain(self, block: bool = False) -> int:
+        batches: Dict[str, List[dict]] = {}
+        n = 0
+        try:
+            item = self._queue.get(timeout=self.flush_interval) if block else self._queue.get_nowait()
+            while True:
+                batches.setdefault(item[0], []).append(item[1])
+                n += 1
+                if n >= self.batch_size:
+                    break
+                item = self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        for kind, records in batches.items():
+            self._writers[kind].write(records)
+            self._records.labels(kind).inc(len(records))
+        for w in self._writers.values():
+            w.rotate_if_old()
+        self._depth.set(self._queue.qsize())
+        return n
+
+
+prediction_log: Optional[PredictionLog] = None
+if PREDICTION_LOG_DIR:
+    prediction_log = PredictionLog(
+        PREDICTION_LOG_DIR,
+        fmt=PREDICTION_LOG_FORMAT,
+        max_queue=PREDICTION_LOG_QUEUE,
+        batch_size=PREDICTION_LOG_BATCH,
+        flush_interval=PREDICTION_LOG_FLUSH_SECONDS,
+        segment_bytes=int(PREDICTION_LOG_SEGMENT_MB * (1 << 20)),
+        segment_seconds=PREDICTION_LOG_SEGMENT_SECONDS,
+    )
+
+
+def _id_sampled(rec_id: int, rate: float) -> bool:
+    """Keep a stable ``rate`` share of ids, so an id's predict and feedback are kept together.
+
+    Scalar form of model.id_hash_unit (SplitMix64, seed 0).
+    """
+    if rate >= 1.0:
+        return True
+    mask = 0xFFFFFFFFFFFFFFFF
+    x = (rec_id + 0x9E3779B97F4A7C15) & mask
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & mask
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & mask
+    x ^= x >> 31
+    return (x >> 11) / float(1 << 53) < rate
+
+
+def _capture_sampled(rec_id: int) -> bool:
+    return _id_sampled(rec_id, CAPTURE_SAMPLE_RATE)
+
+
+capture_log: Optional[PredictionLog] = None
+if CAPTURE_DIR:
+    capture_log = PredictionLog(
+        CAPTURE_DIR,
+        fmt=CAPTURE_FORMAT,
+        max_queue=PREDICTION_LOG_QUEUE,
+        batch_size=PREDICTION_LOG_BATCH,
+        flush_interval=PREDICTION_LOG_FLUSH_SECONDS,
+        segment_bytes=int(PREDICTION_LOG_SEGMENT_MB * (1 << 20)),
+        segment_seconds=PREDICTION_LOG_SEGMENT_SECONDS,
+        schemas=CAPTURE_SCHEMAS,
+        depth_gauge=CAPTURE_QUEUE_DEPTH,
+        records_counter=CAPTURE_RECORDS,
+        dropped_counter=CAPTURE_DROPPED,
+    )
 
 
 # --------------------
@@ -234,6 +1368,248 @@ def load_model(model_path: str, handout_dir: str):
 
 
 model = None
+# set by preload_model(): the model was loaded in the parent before the workers forked
+preloaded = False
+WARMUP_ROW = {"id": 0, "Gender": "male", "Age": 30.0, "Height": 180.0, "Weight": 80.0,
+              "Duration": 20.0, "Heart_Rate": 100.0, "Body_Temp": 40.0}
+
+
+def preload_model():
+    """Load and warm the model once in a parent process that will fork the workers.
+
+    The warm-up predict runs the lazy first-call setup before the fork, then
+    ``gc.freeze()`` moves every object allocated so far into the permanent generation,
+    so collections in the workers never write their headers and those pages stay shared
+    copy-on-write. The booster's trees live in xgboost's native heap, outside the reach
+    of reference counting, and predict only reads them.
+    """
+    global model, preloaded
+    model = load_model(MODEL_PATH, HANDOUT_DIR)
+    _init_drift(model)
+    model.predict(pd.DataFrame([WARMUP_ROW]))
+    gc.collect()
+    gc.freeze()
+    preloaded = True
+    logging.info("Preload: model loaded and warmed, %d objects frozen", gc.get_freeze_count())
+    return model
+
+
+# --------------------
+# Shadow model
+# --------------------
+SHADOW_SCORED = Counter("app_shadow_scored_total", "Predictions scored by the shadow model")
+SHADOW_DROPPED = Counter(
+    "app_shadow_dropped_total", "Shadow work dropped because the shadow queue was full", ["kind"]
+)
+SHADOW_QUEUE_DEPTH = Gauge("app_shadow_queue_depth", "Predictions/feedback waiting for the shadow worker")
+SHADOW_LAG = Gauge("app_shadow_lag_seconds", "Age of the newest prediction in the last scored shadow batch")
+
+
+class ShadowScorer:
+    """Scores a candidate model on a sample of live traffic, off the request path.
+
+    Handlers only ``put_nowait`` on a bounded queue (dropping and counting when it is
+    full); one worker thread drains up to ``batch_size`` items, scores their predictions
+    in one ``predict`` call and feeds a separate MetricsState (``model="shadow"``)
+    stamped with the live request times. Predictions and feedback share the FIFO queue,
+    so feedback is applied after the prediction it joins however far the worker falls
+    behind. Ids are sampled by hash, so an id's predict and feedback are kept together.
+    """
+
+    def __init__(self, shadow_model, state: MetricsState, sample_rate: float = 1.0, max_queue: int = 10000,
+                 batch_size: int = 256, poll_interval: float = 1.0):
+        self.model = shadow_model
+        self.state = state
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def sampled(self, rec_id: int) -> bool:
+        return _id_sampled(rec_id, self.sample_rate)
+
+    def submit_prediction(self, row: dict) -> bool:
+        return self._put("predict", (row, self.state.clock()))
+
+    def submit_feedback(self, rec_id: int, y_true: float, ts_true: Optional[float] = None) -> bool:
+        ts = self.state.clock() if ts_true is None else ts_true
+        return self._put("feedback", (rec_id, y_true, ts))
+
+    def _put(self, kind: str, item) -> bool:
+        try:
+            self._queue.put_nowait((kind, item))
+            return True
+        except queue.Full:
+            SHADOW_DROPPED.labels(kind).inc()
+            return False
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="shadow-scorer", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        while self._drain():
+            pass
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._drain(block=True)
+            except Exception:
+                logging.exception("shadow scoring failed")
+
+    def _drain(self, block: bool = False) -> int:
+        items = []
+        try:
+            items.append(self._queue.get(timeout=self.poll_interval) if block else self._queue.get_nowait())
+            while len(items) < self.batch_size:
+                items.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        preds = [item for kind, item in items if kind == "predict"]
+        if preds:
+            y_hat = self.model.predict(pd.DataFrame([row for row, _ in preds]))
+            for (row, ts), y in zip(preds, y_hat):
+                self.state.add_prediction(row["id"], float(y), ts_pred=ts)
+            SHADOW_SCORED.inc(len(preds))
+            SHADOW_LAG.set(max(0.0, self.state.clock() - preds[-1][1]))
+        # every prediction a feedback in this batch can join was queued before it, and is now scored
+        for kind, (rec_id, y_true, ts) in ((k, i) for k, i in items if k == "feedback"):
+            self.state.add_feedback(rec_id, y_true, ts_true=ts)
+        SHADOW_QUEUE_DEPTH.set(self._queue.qsize())
+        return len(items)
+
+
+shadow: Optional[ShadowScorer] = None
+
+
+def _start_shadow():
+    """Load SHADOW_MODEL_PATH and start its worker; a bad candidate never blocks the live model."""
+    global shadow
+    if shadow is not None:
+        shadow.start()
+        return
+    try:
+        shadow_model = load_model(SHADOW_MODEL_PATH, HANDOUT_DIR)
+    except Exception:
+        logging.error("Shadow model load failed; shadow scoring off\n%s", traceback.format_exc())
+        return
+    shadow_state = MetricsState(PREDICTION_WINDOW_SECONDS, clock=state.clock, model="shadow")
+    shadow = ShadowScorer(shadow_model, shadow_state, sample_rate=SHADOW_SAMPLE_RATE, max_queue=SHADOW_QUEUE,
+                          batch_size=SHADOW_BATCH)
+    shadow.start()
+    logging.info("Shadow model %s scoring %.0f%% of ids", SHADOW_MODEL_PATH, SHADOW_SAMPLE_RATE * 100)
+
+
+# --------------------
+# Debug / profiling
+# --------------------
+class SamplingProfiler:
+    """Periodically samples every thread's Python stack via sys._current_frames().
+
+    Output is the collapsed-stack format (``thread;frame;frame count``) consumed by
+    flamegraph.pl / speedscope. The sampler thread never profiles itself.
+    """
+
+    def __init__(self, interval: float = 0.01, max_stacks: int = 20000):
+        self.interval = max(0.001, interval)
+        self.max_stacks = max_stacks
+        self.samples = 0
+        self.sampling_seconds = 0.0
+
+    def run(self, seconds: float) -> str:
+        counts: Dict[str, int] = {}
+        me = threading.get_ident()
+        names: Dict[int, str] = {}
+        names_at = 0.0
+        t_begin = time.monotonic()
+        deadline = t_begin + seconds
+        while True:
+            t0 = time.monotonic()
+            if t0 >= deadline:
+                break
+            frames = sys._current_frames()
+            if t0 - names_at > 1.0 or any(ident not in names for ident in frames):
+                names = {t.ident: t.name for t in threading.enumerate()}
+                names_at = t0
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}").replace(" ", "_"))
+                key = ";".join(reversed(stack))
+                if key not in counts and len(counts) >= self.max_stacks:
+                    key = "[truncated]"
+                counts[key] = counts.get(key, 0) + 1
+            self.samples += 1
+            t1 = time.monotonic()
+            self.sampling_seconds += t1 - t0
+            time.sleep(max(0.0, min(self.interval, deadline - t1)))
+        lines = [f"{k} {v}" for k, v in sorted(counts.items(), key=lambda kv: -kv[1])]
+        return "\n".join(lines) + ("\n" if lines else "")
+
+
+def heap_snapshot(seconds: float, top: int = 25) -> dict:
+    """Top allocation sites by live size, via tracemalloc.
+
+    If tracing is already on (PYTHONTRACEMALLOC) we snapshot everything traced so far;
+    otherwise tracing runs only for ``seconds`` so its overhead stays bounded.
+    """
+    window = not tracemalloc.is_tracing()
+    if window:
+        tracemalloc.start(1)
+        time.sleep(seconds)
+    try:
+        snap = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        if window:
+            tracemalloc.stop()
+    snap = snap.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+    stats = snap.statistics("lineno")
+    return {
+        "mode": "window" if window else "since_start",
+        "seconds": seconds if window else None,
+        "traced_current_bytes": int(current),
+        "traced_peak_bytes": int(peak),
+        "top": [
+            {
+                "site": f"{st.traceback[0].filename}:{st.traceback[0].lineno}",
+                "size_bytes": int(st.size),
+                "count": int(st.count),
+            }
+            for st in stats[:top]
+        ],
+    }
+
+
+# one profile/heap capture at a time; runs on its own limiter so it never waits on the
+# (possibly saturated) inference threadpool
+_profile_lock = threading.Lock()
+_debug_limiter = anyio.CapacityLimiter(1)
+
+
+def _admin_denied(request: Optional[Request]) -> Optional[JSONResponse]:
+    if request is None:
+        return None  # direct in-process call
+    if not ADMIN_TOKEN:
+        return JSONResponse({"error": "debug endpoints disabled; set ADMIN_TOKEN"}, status_code=403)
+    supplied = request.headers.get("x-admin-token", "")
+    if not hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode()):
+        return JSONResponse({"error": "forbidden"}, status_code=403)
+    return None
 
 
 # --------------------
@@ -243,22 +1619,85 @@ logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s %(me
 app = FastAPI(title="Calories Prediction Service", version="0.1.0")
 
 
-class MetricsMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
+_LABEL_METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"))
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording request count/latency per matched route template.
+
+    The route label comes from the route the router matched (e.g. ``/predict``), never
+    the raw URL, so scanners and typos all land in a single ``other`` series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._endpoint_paths: Optional[Dict[object, str]] = None
+        self._count_children: Dict[Tuple[str, str, str], Counter] = {}
+        self._latency_children: Dict[Tuple[str, str], Histogram] = {}
+
+    def _route_label(self, scope) -> str:
+        route = scope.get("route")
+        if route is not None:
+            return route.path
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "other"
+        if self._endpoint_paths is None:
+            # plain Starlette routes (e.g. /docs) only set scope["endpoint"]
+            self._endpoint_paths = {
+                getattr(r, "endpoint", None): r.path for r in scope["app"].routes if hasattr(r, "path")
+            }
+        return self._endpoint_paths.get(endpoint, "other")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
         start = time.perf_counter()
+        request_id = None
+        payload_bytes = 0
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+            elif name == b"content-length" and value.isdigit():
+                payload_bytes = int(value)
+        timer = StageTimer(start) if stage_timers_enabled else None
+        trace = RequestTrace(request_id or _new_request_id(), timer)
+        trace.payload_bytes = payload_bytes
+        limiter = anyio.to_thread.current_default_thread_limiter()
+        trace.pool_busy = int(limiter.borrowed_tokens)
+        trace.pool_size = int(limiter.total_tokens)
+        request_id_header = (b"x-request-id", trace.request_id.encode("latin-1"))
+        status_code = 500  # stays 500 if the app raises before starting a response
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = [*message.get("headers", ()), request_id_header]
+            await send(message)
+
+        token = _request_trace.set(trace)
         try:
-            response: Response = await call_next(request)
-            status_code = getattr(response, "status_code", 500)
-        except Exception:
-            status_code = 500
-            raise
+            await self.app(scope, receive, send_wrapper)
         finally:
             duration = time.perf_counter() - start
-            route = request.url.path
-            method = request.method
-            REQUEST_COUNT.labels(route=route, method=method, status=str(status_code)).inc()
-            REQUEST_LATENCY.labels(route=route, method=method).observe(duration)
-        return response
+            route = self._route_label(scope)
+            method = scope["method"] if scope["method"] in _LABEL_METHODS else "other"
+            key = (route, method, str(status_code))
+            counter = self._count_children.get(key)
+            if counter is None:
+                counter = self._count_children[key] = REQUEST_COUNT.labels(*key)
+            counter.inc()
+            hist = self._latency_children.get(key[:2])
+            if hist is None:
+                hist = self._latency_children[key[:2]] = REQUEST_LATENCY.labels(route, method)
+            hist.observe(duration, exemplar=trace.exemplar())
+            if timer is not None:
+                timer.observe()
+            if not route.startswith("/debug/") and slow_log.admits(duration):
+                slow_log.add(duration, trace.describe(route, method, status_code, duration))
+            _request_trace.reset(token)
 
 
 app.add_middleware(MetricsMiddleware)
@@ -269,8 +1708,27 @@ startup_error: Optional[str] = None
 
 @app.on_event("startup")
 def _startup():
-    global model, startup_error
+    global model, startup_error, snapshot_path, _snapshot_slot_fd
     logging.info("Startup: HANDOUT_DIR=%s MODEL_PATH=%s", HANDOUT_DIR, MODEL_PATH)
+    if snapshotter is not None:
+        if _snapshot_slot_fd is None:
+            snapshot_path, _snapshot_slot_fd = claim_snapshot_path(SNAPSHOT_PATH)
+            logging.info("Startup: state snapshot slot %s", snapshot_path)
+        restore_snapshot(snapshot_path, state, SNAPSHOT_MAX_AGE_SECONDS)
+        snapshotter.start()
+        _install_sigterm_snapshot()
+    metrics_refresher.start()
+    if feedback_flusher is not None:
+        feedback_flusher.start()
+    if prediction_log is not None:
+        prediction_log.start()
+    if capture_log is not None:
+        capture_log.start()
+    if SHADOW_MODEL_PATH:
+        _start_shadow()
+    if preloaded:
+        logging.info("Startup: using the model preloaded before fork")
+        return
     if not os.path.exists(MODEL_PATH):
         msg = f"Model artifact not found at {MODEL_PATH}. Run training first."
         logging.error(msg)
@@ -280,6 +1738,7 @@ def _startup():
         raise RuntimeError(msg)
     try:
         model = load_model(MODEL_PATH, HANDOUT_DIR)
+        _init_drift(model)
         logging.info("Startup: model loaded OK")
     except Exception:
         err = traceback.format_exc()
@@ -291,6 +1750,29 @@ def _startup():
         raise
 
 
+@app.on_event("shutdown")
+def _shutdown():
+    metrics_refresher.stop(timeout=5.0)
+    if snapshotter is not None:
+        snapshotter.stop(timeout=5.0)
+        if _term_snapshot is not None:
+            # SIGTERM already started the final snapshot; wait for it rather than write twice
+            _term_snapshot.join(SNAPSHOT_TERM_TIMEOUT_SECONDS)
+        else:
+            write_snapshot(snapshot_path, state)
+    if feedback_flusher is not None:
+        feedback_flusher.stop(timeout=5.0)
+        feedback_store.flush()
+    if prediction_log is not None:
+        prediction_log.close(timeout=5.0)
+    if capture_log is not None:
+        capture_log.close(timeout=5.0)
+    if shadow is not None:
+        shadow.close(timeout=5.0)
+    if state.spill is not None:
+        state.spill.close(state.clock())
+
+
 @app.get("/healthz")
 def healthz():
     try:
@@ -300,16 +1782,35 @@ def healthz():
     body = {"status": "ok" if ok else "uninitialized"}
     if startup_error:
         body["error"] = startup_error.splitlines()[-1][:240]
+    if CLOCK_SCALE != 1:
+        # lets a time-compressed client check it is driving a service with the same scale
+        body["clock_scale"] = CLOCK_SCALE
+        body["clock"] = state.clock()
     return body
 
 
 @app.post("/predict")
 def predict(rec: PredictRecord):
+    trace = _request_trace.get()
+    timer = trace.timer if trace is not None else None
+    owned_timer = False
+    if trace is not None:
+        trace.record_id = rec.id
+    if timer is not None:
+        # middleware start -> end of body validation -> pickup by the threadpool
+        timer.mark("validate", rec._validated_at)
+        timer.mark("queue_wait")
+    elif stage_timers_enabled:
+        # direct call without middleware: time the handler only and flush here
+        timer = StageTimer()
+        owned_timer = True
     # Convert to DataFrame expected by DS model
     data = rec.model_dump()
+    if capture_log is not None and _capture_sampled(rec.id):
+        capture_log.log("capture", dict(data, ts=time.time(), kind="predict"))
     if data.get("Gender") is None and data.get("Sex") is not None:
         data["Gender"] = data["Sex"]
-    df = pd.DataFrame([{
+    row = {
         "id": data["id"],
         "Gender": data.get("Gender"),
         "Age": data["Age"],
@@ -318,25 +1819,149 @@ def predict(rec: PredictRecord):
         "Duration": data["Duration"],
         "Heart_Rate": data["Heart_Rate"],
         "Body_Temp": data["Body_Temp"],
-    }])
+    }
+    df = pd.DataFrame([row])
+    if timer is not None:
+        timer.mark("dataframe")
     if model is None:
         return JSONResponse({"error": "model not loaded"}, status_code=503)
-    y_hat = float(model.predict(df)[0])
-    state.add_prediction(rec.id, y_hat)
+    y_hat = float(model.predict(df, timer=timer)[0])
+    state.add_prediction(rec.id, y_hat, features=row if feedback_store is not None else None)
+    monitor = drift_monitor
+    if monitor is not None:
+        monitor.observe(row, y_hat, state.clock())
+    scorer = shadow
+    if scorer is not None and scorer.sampled(rec.id):
+        scorer.submit_prediction(row)
+    if prediction_log is not None:
+        prediction_log.log("predictions", dict(
+            row, ts=time.time(), request_id=trace.request_id if trace is not None else None, prediction=y_hat,
+        ))
+    if timer is not None:
+        timer.mark("state_update")
+        if owned_timer:
+            timer.observe()
     return {"id": rec.id, "Calories": y_hat}
 
 
 @app.post("/feedback")
 def feedback(rec: FeedbackRecord):
-    state.add_feedback(rec.id, rec.Calories, ts_true=rec.ts)
+    trace = _request_trace.get()
+    if trace is not None:
+        trace.record_id = rec.id
+    if capture_log is not None and _capture_sampled(rec.id):
+        capture_log.log("capture", {"ts": time.time(), "kind": "feedback", "id": rec.id,
+                                    "Calories": rec.Calories, "ts_true": rec.ts})
+    matched = state.add_feedback(rec.id, rec.Calories, ts_true=rec.ts)
+    scorer = shadow
+    if scorer is not None and scorer.sampled(rec.id):
+        scorer.submit_feedback(rec.id, rec.Calories, rec.ts)
+    if prediction_log is not None:
+        prediction_log.log("feedback", {
+            "ts": time.time(), "request_id": trace.request_id if trace is not None else None,
+            "id": rec.id, "Calories": rec.Calories, "ts_true": rec.ts, "matched": matched,
+        })
     return {"status": "ok"}
 
 
+@app.post("/debug/stage-timers")
+def set_stage_timers(enabled: bool, request: Request = None):
+    global stage_timers_enabled
+    denied = _admin_denied(request)
+    if denied is not None:
+        return denied
+    stage_timers_enabled = enabled
+    logging.info("Stage timers %s", "enabled" if enabled else "disabled")
+    return {"stage_timers": stage_timers_enabled}
+
+
+@app.get("/debug/profile")
+async def debug_profile(seconds: float = 10.0, request: Request = None):
+    denied = _admin_denied(request)
+    if denied is not None:
+        return denied
+    seconds = min(max(0.1, seconds), PROFILE_MAX_SECONDS)
+    if not _profile_lock.acquire(blocking=False):
+        return JSONResponse({"error": "a profile is already running"}, status_code=409)
+    try:
+        profiler = SamplingProfiler(interval=PROFILE_INTERVAL_MS / 1000.0)
+        body = await anyio.to_thread.run_sync(profiler.run, seconds, limiter=_debug_limiter)
+    finally:
+        _profile_lock.release()
+    headers = {
+        "X-Profile-Samples": str(profiler.samples),
+        "X-Profile-Overhead": f"{profiler.sampling_seconds / seconds:.4f}",
+    }
+    return PlainTextResponse(body, headers=headers)
+
+
+@app.get("/debug/heap")
+async def debug_heap(seconds: float = 5.0, top: int = 25, request: Request = None):
+    denied = _admin_denied(request)
+    if denied is not None:
+        return denied
+    seconds = min(max(0.1, seconds), PROFILE_MAX_SECONDS)
+    if not _profile_lock.acquire(blocking=False):
+        return JSONResponse({"error": "a profile is already running"}, status_code=409)
+    try:
+        return await anyio.to_thread.run_sync(heap_snapshot, seconds, max(1, top), limiter=_debug_limiter)
+    finally:
+        _profile_lock.release()
+
+
+@app.get("/debug/slow")
+async def debug_slow(request: Request = None):
+    denied = _admin_denied(request)
+    if denied is not None:
+        return denied
+    return {
+        "window_seconds": slow_log.window,
+        "capacity": slow_log.capacity,
+        "requests": slow_log.snapshot(),
+    }
+
+
+@app.post("/admin/reload-model")
+def reload_model(request: Request = None):
+    """Swap in the artifact currently at MODEL_PATH (e.g. after retrain.py promoted one)."""
+    global model, startup_error
+    denied = _admin_denied(request)
+    if denied is not None:
+        return denied
+    try:
+        new_model = load_model(MODEL_PATH, HANDOUT_DIR)
+    except Exception as e:
+        logging.error("Model reload failed: %s", e)
+        return JSONResponse({"error": f"reload failed: {e}"}, status_code=500)
+    # a single reference assignment; in-flight requests finish on the old model
+    model = new_model
+    _init_drift(new_model)
+    startup_error = None
+    st = os.stat(MODEL_PATH)
+    logging.info("Model reloaded from %s", MODEL_PATH)
+    return {"status": "reloaded", "path": MODEL_PATH, "mtime": st.st_mtime}
+
+
 @app.get("/metrics")
-def metrics():
-    # scrape-time recompute to keep coverage fresh
-    state._recompute()
-    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+def metrics(request: Request = None):
+    # aggregates are refreshed by metrics_refresher; here we only serve cached bytes
+    t0 = time.perf_counter()
+    headers = request.headers if request is not None else {}
+    # exemplars are only carried by the OpenMetrics format; Prometheus asks for it via Accept
+    openmetrics = "application/openmetrics-text" in headers.get("accept", "")
+    want_gzip = METRICS_GZIP and "gzip" in headers.get("accept-encoding", "")
+    body, age, gzipped = metrics_cache.get("openmetrics" if openmetrics else "text", want_gzip)
+    # the body cannot carry its own cache age; add it to app_metrics_snapshot_age_seconds for total staleness
+    headers = {"X-Metrics-Cache-Age-Seconds": f"{age:.3f}"}
+    if gzipped:
+        headers.update({"Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
+    resp = Response(
+        body,
+        media_type=OPENMETRICS_CONTENT_TYPE if openmetrics else CONTENT_TYPE_LATEST,
+        headers=headers,
+    )
+    METRICS_SCRAPE_DURATION.observe(time.perf_counter() - t0)
+    return resp
 
 
 @app.get("/")
@@ -391,9 +2016,15 @@ def info():
         "fastapi": getattr(_fa, "__version__", None),
     }
 
+    scorer = shadow
+    shadow_info = None
+    if SHADOW_MODEL_PATH:
+        shadow_info = {"path": SHADOW_MODEL_PATH, "active": scorer is not None, "sample_rate": SHADOW_SAMPLE_RATE}
+
     return {
         "service": {"name": "Calories Prediction Service", "version": "0.1.0"},
         "model": model_stats,
+        "shadow": shadow_info,
         "metrics_json": metrics,
         "env": env,
         "versions": versions,
@@ -0,0 +1,127 @@
+"""Preforking launcher: load the model once, then fork uvicorn workers that share it.
+
+``uvicorn --workers N`` spawns fresh interpreters, so each worker unpickles its own
+copy of the model. Here the parent binds the listening socket, imports the app and
+calls ``preload_model()`` (load, warm-up, ``gc.freeze()``), then forks N workers that
+serve the inherited socket. Model pages stay shared copy-on-write until a worker
+writes to them; ``tools/mem_report.py`` shows the unique vs shared split.
+
+Usage: python -m service.preload --workers 2 --host 0.0.0.0 --port 8000
+
+The parent only supervises: a worker that dies is re-forked from the preloaded
+state, and SIGTERM/SIGINT are passed on to the workers for a graceful shutdown.
+POST /admin/reload-model still works, but the reloaded model is private to the
+worker that handled the call.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.abspath(os.path.join(HERE, os.pardir))
+# a worker that exits within this many seconds of its fork counts as a crash loop
+MIN_WORKER_LIFETIME = 5.0
+
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock: socket.socket, args) -> None:
+    # the parent's handlers do not belong here; uvicorn installs its own
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    config = uvicorn.Config(app, log_level=args.log_level, timeout_keep_alive=args.timeout_keep_alive,
+                            backlog=args.backlog, lifespan="on")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def fork_worker(app, sock: socket.socket, args) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(app, sock, args)
+        except BaseException:  # noqa: BLE001 - the child must never return into the supervisor loop
+            logging.exception("Worker %d crashed", os.getpid())
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def supervise(app, sock: socket.socket, args) -> int:
+    workers = {}  # pid -> fork time
+    stopping = False
+
+    def on_signal(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    for _ in range(args.workers):
+        workers[fork_worker(app, sock, args)] = time.monotonic()
+    logging.info("Preload: parent %d serving on %s:%d with workers %s", os.getpid(), args.host, args.port,
+                 sorted(workers))
+
+    exit_code = 0
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = workers.pop(pid, None)
+        if started is None or stopping:
+            continue
+        code = os.waitstatus_to_exitcode(status)
+        logging.warning("Preload: worker %d exited with %d", pid, code)
+        if time.monotonic() - started < MIN_WORKER_LIFETIME:
+            logging.error("Preload: worker died right after fork; stopping instead of crash-looping")
+            exit_code = 1
+            on_signal(signal.SIGTERM, None)
+            continue
+        workers[fork_worker(app, sock, args)] = time.monotonic()
+    return exit_code
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--host", default=os.environ.get("UVICORN_HOST", "127.0.0.1"))
+    p.add_argument("--port", type=int, default=int(os.environ.get("UVICORN_PORT", "8000")))
+    p.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", "2")))
+    p.add_argument("--backlog", type=int, default=2048)
+    p.add_argument("--timeout-keep-alive", type=int, default=5)
+    p.add_argument("--log-level", default="info")
+    args = p.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(levelname)s %(message)s")
+
+    sock = bind_socket(args.host, args.port, args.backlog)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    from service import app as app_module
+
+    app_module.preload_model()
+    sys.exit(supervise(app_module.app, sock, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+import pytest
+import yaml
+
+HANDOUT = os.path.join(os.getcwd(), 'handout_from DS_agent')
+
+
+@pytest.fixture
+def fc(monkeypatch):
+    monkeypatch.syspath_prepend(HANDOUT)
+    import feature_cache
+    return feature_cache
+
+
+def arrays(n=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    return {'X_train': rng.random((n, 4), dtype=np.float32), 'y_train': rng.random(n, dtype=np.float32)}
+
+
+def test_hit_returns_stored_arrays_and_counts(tmp_path, fc):
+    cache = fc.FeatureCache(str(tmp_path), max_bytes=1 << 30)
+    assert cache.load('k1') is None
+    data = arrays()
+    cache.store('k1', data, {'pre': 1}, ['a', 'b', 'c', 'd'])
+    entry = cache.load('k1')
+    np.testing.assert_array_equal(entry['arrays']['X_train'], data['X_train'])
+    assert isinstance(entry['arrays']['X_train'], np.memmap)
+    assert entry['preprocessor'] == {'pre': 1} and entry['feature_names'] == ['a', 'b', 'c', 'd']
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'evictions': 0}
+
+
+def test_key_follows_data_code_and_split_config_only(tmp_path, fc, monkeypatch):
+    import train
+
+    csv = tmp_path / 'train.csv'
+    csv.write_text('id,Age\n1,30\n')
+    with open(os.path.join(HANDOUT, 'config.yaml')) as f:
+        cfg = yaml.safe_load(f)
+    key = train.feature_cache_key(cfg, str(csv))
+
+    tuned = {**cfg, 'model': {**cfg['model'], 'eta': 0.5}, 'train': {**cfg['train'], 'num_boost_round': 7}}
+    assert train.feature_cache_key(tuned, str(csv)) == key  # model/rounds do not change the matrices
+    resplit = {**cfg, 'train': {**cfg['train'], 'valid_size': 0.2}}
+    assert train.feature_cache_key(resplit, str(csv)) != key
+    csv.write_text('id,Age\n1,31\n')
+    assert train.feature_cache_key(cfg, str(csv)) != key
+    csv.write_text('id,Age\n1,30\n')
+
+    def add_features(df):  # an edited feature function: same name, different source
+        return df.assign(extra=1)
+
+    monkeypatch.setattr(train, 'add_features', add_features)
+    assert train.feature_cache_key(cfg, str(csv)) != key
+
+
+def test_lru_eviction_keeps_recently_used_entries(tmp_path, fc):
+    cache = fc.FeatureCache(str(tmp_path), max_bytes=1 << 30)
+    size = cache.store('old', arrays(seed=1), {}, [])
+    cache.store('used', arrays(seed=2), {}, [])
+    # distinct, ordered mtimes: 'used' was written last but 'old' is read afterwards
+    os.utime(tmp_path / 'old' / 'meta.json', (1000, 1000))
+    os.utime(tmp_path / 'used' / 'meta.json', (2000, 2000))
+    assert cache.load('old') is not None  # now the most recently used
+    cache.max_bytes = 2 * size + size // 2
+    cache.store('new', arrays(seed=3), {}, [])
+    assert cache.entry_path('used') is None
+    assert cache.entry_path('old') and cache.entry_path('new')
+    assert cache.stats()['evictions'] == 1
+
+
+def test_entry_without_meta_is_ignored(tmp_path, fc):
+    cache = fc.FeatureCache(str(tmp_path), max_bytes=1)
+    partial = tmp_path / 'k1'
+    partial.mkdir()
+    np.save(partial / 'X_train.npy', np.zeros(3))  # a writer died before meta.json
+    assert cache.entry_path('k1') is None and cache.load('k1') is None
+    assert cache.evict() == 0  # not an entry, so not counted or evicted
+    cache.max_bytes = 1 << 30
+    cache.store('k1', arrays(), {}, [])
+    assert cache.load('k1') is not None
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+HANDOUT = os.path.join(os.getcwd(), 'handout_from DS_agent')
+SAMPLE = os.path.join(HANDOUT, 'data_sample', 'train.csv')
+
+
+def make_holdout(out_dir, *extra):
+    cmd = [sys.executable, os.path.join('tools', 'make_holdout.py'), '--out-dir', str(out_dir), *extra]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    with open(os.path.join(out_dir, 'manifest.json')) as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope='module')
+def source(tmp_path_factory):
+    df = pd.read_csv(SAMPLE, nrows=6000)
+    df['ts'] = np.arange(len(df)) * 60 + 1_700_000_000  # one row a minute
+    path = tmp_path_factory.mktemp('src') / 'train.csv'
+    df.to_csv(path, index=False)
+    return path, df
+
+
+def test_hash_split_ignores_row_order_and_chunk_size(tmp_path, source):
+    path, df = source
+    shuffled = tmp_path / 'shuffled.parquet'
+    df.sample(frac=1.0, random_state=1).to_parquet(shuffled, index=False)
+    a = make_holdout(tmp_path / 'a', '--source', str(path), '--fraction', '0.2', '--chunk-size', '6000')
+    b = make_holdout(tmp_path / 'b', '--source', str(shuffled), '--fraction', '0.2', '--chunk-size', '457')
+    held_a = set(pd.read_csv(a['outputs']['holdout']['path'])['id'])
+    held_b = set(pd.read_csv(b['outputs']['holdout']['path'])['id'])
+    assert held_a == held_b and 0.15 < len(held_a) / len(df) < 0.25
+    assert set(pd.read_csv(a['outputs']['train']['path'])['id']).isdisjoint(held_a)
+
+
+def test_time_cutoff_holds_out_the_latest_rows(tmp_path, source):
+    path, df = source
+    cutoff = int(df['ts'].iloc[4500])
+    m = make_holdout(tmp_path, '--source', str(path), '--method', 'time', '--time-column', 'ts',
+                     '--cutoff', str(cutoff), '--chunk-size', '1000')
+    hold = pd.read_csv(m['outputs']['holdout']['path'])
+    train = pd.read_csv(m['outputs']['train']['path'])
+    assert len(hold) == 1500 and hold['ts'].min() == cutoff and train['ts'].max() < cutoff
+    assert m['params']['cutoff'] == cutoff
+
+    # without --cutoff it is estimated from --fraction
+    m = make_holdout(tmp_path / 'est', '--source', str(path), '--method', 'time', '--time-column', 'ts',
+                     '--fraction', '0.1')
+    assert abs(m['rows']['holdout'] - 600) <= 5
+
+
+def test_stratified_counts_within_one_row_per_stratum(tmp_path, source):
+    path, _ = source
+    m = make_holdout(tmp_path, '--source', str(path), '--fraction', '0.15', '--stratify-bins', '5',
+                     '--chunk-size', '700')
+    edges = np.array(m['params']['strata_edges'])
+    hold = pd.read_csv(m['outputs']['holdout']['path'])
+    train = pd.read_csv(m['outputs']['train']['path'])
+    held = np.bincount(np.searchsorted(edges, hold['Calories'], side='right'), minlength=len(edges) + 1)
+    total = held + np.bincount(np.searchsorted(edges, train['Calories'], side='right'), minlength=len(edges) + 1)
+    assert held.tolist() == m['strata']['holdout'] and total.tolist() == m['strata']['rows']
+    assert np.all(np.abs(held - 0.15 * total) <= 1)
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'parquet'])
+def test_manifest_matches_outputs(tmp_path, source, fmt):
+    path, df = source
+    m = make_holdout(tmp_path, '--source', str(path), '--fraction', '0.2', '--format', fmt, '--chunk-size', '1000')
+    read = pd.read_parquet if fmt == 'parquet' else pd.read_csv
+    for split, out in m['outputs'].items():
+        assert out['path'] == os.path.join(str(tmp_path), f'{split}.{fmt}')
+        with open(out['path'], 'rb') as f:
+            data = f.read()
+        assert out['sha256'] == hashlib.sha256(data).hexdigest() and out['bytes'] == len(data)
+        assert out['rows'] == m['rows'][split] == len(read(out['path']))
+    assert m['rows']['total'] == len(df)
+    assert not [n for n in os.listdir(tmp_path) if n.endswith('.part')]
@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+HANDOUT = os.path.join(os.getcwd(), 'handout_from DS_agent')
+
+
+def run_predict(*args):
+    proc = subprocess.run([sys.executable, os.path.join(HANDOUT, 'predict.py'), *args],
+                          capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+
+
+@pytest.mark.parametrize('ext', ['csv', 'parquet'])
+def test_chunked_scoring_matches_single_shot(tmp_path, ext):
+    run_predict('--out', str(tmp_path / 'single.csv'))
+    out = tmp_path / f'chunked.{ext}'
+    # 5000 rows in chunks of 700 over 2 workers: several chunks in flight, short last chunk
+    run_predict('--out', str(out), '--chunk-size', '700', '--workers', '2', '--threads-per-worker', '1')
+
+    single = pd.read_csv(tmp_path / 'single.csv')
+    chunked = pd.read_parquet(out) if ext == 'parquet' else pd.read_csv(out)
+    assert chunked['id'].tolist() == single['id'].tolist()
+    # predictions are float32; the CSV holds their shortest repr, so compare at that precision
+    np.testing.assert_array_equal(chunked['Calories'].to_numpy(np.float32), single['Calories'].to_numpy(np.float32))
+
+
+def test_csv_chunks_keep_types_pinned_across_blocks(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(HANDOUT)
+    import predict
+
+    df = pd.read_csv(os.path.join(HANDOUT, 'data_sample', 'test.csv'))
+    big = pd.concat([df] * 10, ignore_index=True)  # > pyarrow's 1 MB block, so several blocks
+    big['Age'] = big['Age'].astype(object)
+    big.loc[len(big) - 1, 'Age'] = 34.5  # integral in the first block, a float only in the last
+    path = tmp_path / 'mixed.csv'
+    big.to_csv(path, index=False)
+    chunks = list(predict.iter_chunks(str(path), 20000))
+    assert [len(c) for c in chunks] == [20000, 20000, 10000]
+    assert chunks[-1]['Age'].iloc[-1] == 34.5 and chunks[0]['id'].dtype == np.int64
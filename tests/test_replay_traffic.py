@@ -0,0 +1,66 @@
+import asyncio
+import glob
+import json
+import os
+import subprocess
+import sys
+
+import httpx
+import pandas as pd
+
+from test_service_direct import load_app_module
+
+HANDOUT = os.path.join(os.getcwd(), 'handout_from DS_agent')
+
+
+FEATURES = ('Age', 'Height', 'Weight', 'Duration', 'Heart_Rate', 'Body_Temp')
+
+
+def predict_bodies(rows):
+    return [dict({k: float(row[k]) for k in FEATURES}, id=int(row['id']), Sex=row['Sex'])
+            for _, row in rows.iterrows()]
+
+
+async def send_traffic(app, rows):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://app') as client:
+        for body in predict_bodies(rows):
+            r = await client.post('/predict', json=body)
+            assert r.status_code == 200
+        for _, row in rows.iloc[::2].iterrows():
+            r = await client.post('/feedback', json={'id': int(row['id']), 'Calories': float(row['Calories'])})
+            assert r.status_code == 200
+
+
+def test_asgi_replay_is_deterministic(tmp_path, monkeypatch):
+    os.environ.setdefault('HANDOUT_DIR', HANDOUT)
+    os.environ.setdefault('MODEL_PATH', os.path.join(HANDOUT, 'model.joblib'))
+    mod = load_app_module()
+    mod._startup()
+    capture = tmp_path / 'capture'
+    log = mod.PredictionLog(str(capture), schemas=mod.CAPTURE_SCHEMAS, depth_gauge=mod.CAPTURE_QUEUE_DEPTH,
+                            records_counter=mod.CAPTURE_RECORDS, dropped_counter=mod.CAPTURE_DROPPED)
+    monkeypatch.setattr(mod, 'capture_log', log)
+    log.start()
+    rows = pd.read_csv(os.path.join(HANDOUT, 'data_sample', 'train.csv'), nrows=8)
+    asyncio.run(send_traffic(mod.app, rows))
+    log.close(timeout=5.0)
+    assert glob.glob(str(capture / 'capture-*.ndjson.gz'))
+
+    runs = []
+    for i in range(2):
+        out = tmp_path / f'responses-{i}.ndjson'
+        cmd = [sys.executable, os.path.join('tools', 'replay_traffic.py'), str(capture), '--asgi', '--speed', 'max',
+               '--concurrency', '4', '--settle', '0', '--responses', str(out)]
+        proc = subprocess.run(cmd, capture_output=True, text=True, env=dict(os.environ, CAPTURE_DIR=''))
+        assert proc.returncode == 0, proc.stdout + proc.stderr
+        runs.append([json.loads(line) for line in out.read_text().splitlines()])
+
+    first, second = runs
+    assert first == second
+    assert [(r['path'], r['request']['id']) for r in first] == \
+        [('/predict', int(i)) for i in rows['id']] + [('/feedback', int(i)) for i in rows['id'].iloc[::2]]
+    assert all(r['result'] == 'ok' for r in first)
+    # the replayed service scores the captured bodies exactly as the capturing one did
+    expected = {b['id']: mod.predict(mod.PredictRecord(**b))['Calories'] for b in predict_bodies(rows)}
+    assert {r['request']['id']: r['response']['Calories'] for r in first if r['path'] == '/predict'} == expected
@@ -0,0 +1,47 @@
+import json
+import os
+import subprocess
+import sys
+
+import joblib
+import pandas as pd
+import pytest
+
+HANDOUT = os.path.join(os.getcwd(), 'handout_from DS_agent')
+
+
+def run_retrain(tmp_path, mode, *extra):
+    feedback = tmp_path / 'feedback.csv'
+    if not feedback.exists():
+        pd.read_csv(os.path.join(HANDOUT, 'data_sample', 'train.csv'), nrows=1000).to_csv(feedback, index=False)
+    cmd = [sys.executable, os.path.join(HANDOUT, 'retrain.py'), '--feedback', str(feedback), '--mode', mode,
+           '--rounds', '5', '--out', str(tmp_path / 'model.joblib'), '--history', str(tmp_path / 'history.jsonl'),
+           *extra]
+    proc = subprocess.run(cmd, capture_output=True, text=True, cwd=HANDOUT)
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    with open(tmp_path / 'history.jsonl') as f:
+        return json.loads(f.readlines()[-1])
+
+
+@pytest.mark.parametrize('mode', ['add', 'refresh', 'prune'])
+def test_retrained_artifact_keeps_drift_reference(tmp_path, monkeypatch, mode):
+    monkeypatch.syspath_prepend(HANDOUT)  # the pickled artifact references model.py
+    base = joblib.load(os.path.join(HANDOUT, 'model.joblib'))
+    assert base.reference is not None
+    record = run_retrain(tmp_path, mode, '--min-improvement', '-1')  # always promote, so the candidate is written
+    assert record['promoted'] and record['train_rows'] + record['holdout_rows'] == 1000
+    # add appends --rounds trees to the served ones; refresh/prune rewrite them in place
+    assert record['trees_after'] == record['trees_before'] + (5 if mode == 'add' else 0)
+
+    candidate = joblib.load(tmp_path / 'model.joblib')
+    assert candidate.reference == base.reference
+    assert candidate.booster.num_boosted_rounds() == record['trees_after']
+
+
+def test_candidate_is_promoted_only_past_the_holdout_gate(tmp_path):
+    record = run_retrain(tmp_path, 'add', '--min-improvement', '10')
+    assert not record['promoted'] and not (tmp_path / 'model.joblib').exists()
+    record = run_retrain(tmp_path, 'add', '--min-improvement', '-1', '--dry-run')
+    assert not record['promoted'] and not (tmp_path / 'model.joblib').exists()
+    with open(tmp_path / 'history.jsonl') as f:
+        assert len(f.readlines()) == 2  # every run is recorded, promoted or not
@@ -1,15 +1,23 @@
 import os
+import sys
 import importlib.util
+import threading
 import time
 import pandas as pd
 
+LIVE = {'model': 'live'}
+
 
 def load_app_module():
+    # Prometheus collectors are process-global; load the service module only once
+    if 'service_app' in sys.modules:
+        return sys.modules['service_app']
     root = os.getcwd()
     svc_path = os.path.join(root, 'service', 'app.py')
     spec = importlib.util.spec_from_file_location('service_app', svc_path)
     module = importlib.util.module_from_spec(spec)
     assert spec and spec.loader
+    sys.modules['service_app'] = module
     spec.loader.exec_module(module)
     return module
 
@@ -47,3 +55,455 @@ def test_predict_and_feedback_direct():
     resp = mod.metrics()
     assert hasattr(resp, 'body') and b'app_feedback_coverage_5m' in resp.body
 
+
+
+def test_sampling_profiler_collapsed_stacks():
+    mod = load_app_module()
+    stop = threading.Event()
+    t = threading.Thread(target=stop.wait, name='idle worker')
+    t.start()
+    try:
+        out = mod.SamplingProfiler(interval=0.005).run(0.1)
+    finally:
+        stop.set()
+        t.join()
+    lines = out.strip().splitlines()
+    assert any(ln.startswith('idle_worker;') for ln in lines)
+    stack, count = lines[0].rsplit(' ', 1)
+    assert ';' in stack and int(count) > 0
+
+
+def test_slow_request_log_keeps_slowest_in_window():
+    mod = load_app_module()
+    log = mod.SlowRequestLog(capacity=3, window_seconds=60.0, slots=6)
+    for i in range(100):
+        d = float(i)
+        if log.admits(d, now=1000.0):
+            log.add(d, {'i': i}, now=1000.0)
+    assert [r['i'] for r in log.snapshot(now=1000.0)] == [99, 98, 97]
+    # bounded: one heap per slice, never more than capacity entries
+    assert all(len(h) <= 3 for h in log._heaps)
+    # entries age out once their slice leaves the window
+    assert log.snapshot(now=1000.0 + 61.0) == []
+
+
+def test_metrics_middleware_labels_route_templates():
+    import asyncio
+    import httpx
+    from fastapi import FastAPI
+
+    mod = load_app_module()
+    app = FastAPI()
+
+    @app.get('/items/{item_id}')
+    def item(item_id: int):
+        if item_id == 0:
+            raise RuntimeError('boom')
+        return {'id': item_id}
+
+    app.add_middleware(mod.MetricsMiddleware)
+
+    async def drive():
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url='http://t') as c:
+            for i in (1, 2, 0):
+                await c.get(f'/items/{i}')
+            await c.get('/no/such/path')
+
+    asyncio.run(drive())
+    value = mod.REGISTRY.get_sample_value
+    assert value('app_requests_total', {'route': '/items/{item_id}', 'method': 'GET', 'status': '200'}) == 2
+    assert value('app_requests_total', {'route': '/items/{item_id}', 'method': 'GET', 'status': '500'}) == 1
+    assert value('app_requests_total', {'route': 'other', 'method': 'GET', 'status': '404'}) >= 1
+    assert value('app_requests_total', {'route': '/no/such/path', 'method': 'GET', 'status': '404'}) is None
+
+
+def test_stage_timers_label_stages_and_toggle_at_runtime(monkeypatch):
+    import asyncio
+    import httpx
+
+    root = os.getcwd()
+    handout = os.path.join(root, 'handout_from DS_agent')
+    os.environ.setdefault('HANDOUT_DIR', handout)
+    os.environ.setdefault('MODEL_PATH', os.path.join(handout, 'model.joblib'))
+    mod = load_app_module()
+    mod._startup()
+    monkeypatch.setattr(mod, 'stage_timers_enabled', True)
+    monkeypatch.setattr(mod, 'ADMIN_TOKEN', 'secret')
+    stages = ('validate', 'queue_wait', 'dataframe', 'add_features', 'transform', 'dmatrix',
+              'booster_predict', 'state_update')
+    value = mod.REGISTRY.get_sample_value
+
+    def counts(batch='1'):
+        return [value('app_stage_latency_seconds_count', {'stage': s, 'batch': batch}) or 0.0 for s in stages]
+
+    body = {'id': 77, 'Sex': 'male', 'Age': 30.0, 'Height': 180.0, 'Weight': 80.0, 'Duration': 20.0,
+            'Heart_Rate': 100.0, 'Body_Temp': 40.0}
+
+    async def drive(enabled):
+        transport = httpx.ASGITransport(app=mod.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://app') as c:
+            assert (await c.post('/debug/stage-timers', params={'enabled': enabled})).status_code == 403
+            r = await c.post('/debug/stage-timers', params={'enabled': enabled}, headers={'x-admin-token': 'secret'})
+            assert r.json() == {'stage_timers': enabled}
+            assert (await c.post('/predict', json=body)).status_code == 200
+
+    before = counts()
+    asyncio.run(drive(True))
+    # one observation per pipeline stage, all under the single-record batch bucket
+    assert [b - a for a, b in zip(before, counts())] == [1.0] * len(stages)
+
+    before = counts()
+    asyncio.run(drive(False))
+    assert counts() == before
+    mod.predict(mod.PredictRecord(**body))  # direct calls honour the toggle too
+    assert counts() == before
+
+    assert [mod.batch_bucket(n) for n in (1, 2, 16, 17, 128, 129)] == \
+        ['1', '2-16', '2-16', '17-128', '17-128', '129+']
+    timer = mod.StageTimer(batch=40)
+    timer.mark('booster_predict')
+    before = value('app_stage_latency_seconds_count', {'stage': 'booster_predict', 'batch': '17-128'}) or 0.0
+    timer.observe()
+    assert value('app_stage_latency_seconds_count', {'stage': 'booster_predict', 'batch': '17-128'}) == before + 1
+
+
+def test_rolling_aggregates_and_cached_exposition():
+    import numpy as np
+
+    mod = load_app_module()
+    st = mod.MetricsState(window_seconds=60)
+    pairs = [(101, 100.0, 110.0), (102, 50.0, 40.0), (103, 200.0, 200.0)]
+    for rid, y_pred, _ in pairs:
+        st.add_prediction(rid, y_pred)
+    for rid, _, y_true in pairs[:2]:
+        st.add_feedback(rid, y_true)
+    st._recompute()
+    sq = [(np.log1p(t) - np.log1p(p)) ** 2 for _, p, t in pairs[:2]]
+    value = mod.REGISTRY.get_sample_value
+    assert abs(value('app_rolling_rmsle_5m', LIVE) - float(np.sqrt(np.mean(sq)))) < 1e-9
+    assert abs(value('app_rolling_mae_5m', LIVE) - 10.0) < 1e-9
+    assert abs(value('app_feedback_coverage_5m', LIVE) - 2.0 / 3.0) < 1e-9
+    # everything ages out of the window; running sums reset
+    st._recompute(time.time() + 120)
+    assert value('app_rolling_rmsle_5m', LIVE) == 0.0 and len(st.pred_index) == 0
+
+    cache = mod.ExpositionCache(ttl=60.0)
+    body, _, _ = cache.get('text')
+    again, age, _ = cache.get('text')
+    assert again is body and age >= 0.0
+    gz, _, gzipped = cache.get('text', want_gzip=True)
+    import gzip
+    assert gzipped and gzip.decompress(gz) == body
+
+    # the age gauge is stamped before the render, so the body carries its own staleness
+    mod._refresh_aggregates()
+    time.sleep(0.05)
+    stamped = mod.ExpositionCache(ttl=60.0, on_render=mod._stamp_aggregates_age)
+    line = next(ln for ln in stamped.get('text')[0].decode().splitlines()
+                if ln.startswith('app_metrics_snapshot_age_seconds '))
+    assert 0.05 <= float(line.split()[1]) < 1.0
+    resp = mod.metrics()
+    assert float(resp.headers['x-metrics-cache-age-seconds']) >= 0.0
+
+
+def test_metrics_state_uses_injected_clock():
+    mod = load_app_module()
+    now = [1_000_000.0]
+    st = mod.MetricsState(window_seconds=60, clock=lambda: now[0])
+    st.add_prediction(1, 100.0)
+    assert st.pred_index[1][0] == now[0]
+    now[0] += 30
+    st.add_feedback(1, 110.0)
+    assert st.eval_deque[0][0] == now[0]
+    now[0] += 61  # no wall time passes; the injected clock alone ages the window out
+    st._recompute()
+    assert not st.pred_index and not st.eval_deque
+
+    clock = mod.ScaledClock(60.0, anchor=time.time() - 1.0)
+    assert clock() - clock.anchor >= 60.0  # one wall second is a simulated minute
+
+
+def test_preload_freezes_model_and_forked_workers_get_own_request_ids():
+    import gc
+    mod = load_app_module()
+    try:
+        mod.preload_model()
+        assert mod.preloaded and mod.model is not None
+        assert gc.get_freeze_count() > 0
+        mod._startup()  # a forked worker's startup keeps the preloaded model
+        assert mod.model is not None
+
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(r)
+            os.write(w, mod._new_request_id().encode())
+            os._exit(0)
+        os.close(w)
+        child_id = os.read(r, 64).decode()
+        os.close(r)
+        os.waitpid(pid, 0)
+        assert child_id.split('-')[0] == f'{pid:x}'
+        assert mod._new_request_id().split('-')[0] == f'{os.getpid():x}'
+    finally:
+        mod._shutdown()
+        mod.preloaded = False
+        gc.unfreeze()
+
+
+def test_feedback_store_appends_joined_rows(tmp_path):
+    mod = load_app_module()
+    store = mod.FeedbackStore(str(tmp_path / 'feedback.csv'))
+    st = mod.MetricsState(window_seconds=60)
+    st.feedback_store = store
+    features = {'id': 7, 'Gender': 'male', 'Age': 30.0, 'Height': 180.0, 'Weight': 80.0,
+                'Duration': 20.0, 'Heart_Rate': 100.0, 'Body_Temp': 40.0}
+    st.add_prediction(7, 90.0, features=features)
+    st.add_prediction(8, 50.0)  # stored without features: scored, but not retrainable
+    st.add_feedback(7, 100.0)
+    st.add_feedback(8, 55.0)
+    st.add_feedback(9, 10.0)  # unknown id
+    assert store.flush() == 1 and store.flush() == 0
+
+    rows = pd.read_csv(tmp_path / 'feedback.csv')
+    assert list(rows.columns) == mod.FeedbackStore.COLUMNS
+    assert rows.loc[0, 'id'] == 7 and rows.loc[0, 'Calories'] == 100.0 and rows.loc[0, 'prediction'] == 90.0
+    assert rows.loc[0, 'Duration'] == 20.0
+
+
+def test_prediction_log_batches_rotates_and_counts_drops(tmp_path):
+    import glob
+    import gzip
+    import json
+
+    mod = load_app_module()
+    log = mod.PredictionLog(str(tmp_path), max_queue=3, batch_size=2, segment_bytes=1)
+    value = mod.REGISTRY.get_sample_value
+    dropped = value('app_prediction_log_dropped_total', {'kind': 'predictions'}) or 0.0
+    # writer not started yet: the fourth record overflows the queue instead of blocking
+    results = [log.log('predictions', {'ts': 1.0, 'id': i, 'prediction': 10.0 + i}) for i in range(4)]
+    assert results == [True, True, True, False]
+    assert value('app_prediction_log_dropped_total', {'kind': 'predictions'}) == dropped + 1
+
+    log.start()
+    log.log('feedback', {'ts': 2.0, 'id': 1, 'Calories': 12.0, 'matched': True})
+    log.close(timeout=5.0)
+
+    assert not glob.glob(str(tmp_path / '*.part'))
+    segments = sorted(glob.glob(str(tmp_path / 'predictions-*.ndjson.gz')))
+    assert len(segments) == 2  # 1-byte segments: one file per batch of 2
+    rows = [json.loads(line) for seg in segments for line in gzip.open(seg, 'rt')]
+    assert [r['id'] for r in rows] == [0, 1, 2]
+    fb = [json.loads(line) for seg in glob.glob(str(tmp_path / 'feedback-*.ndjson.gz')) for line in gzip.open(seg, 'rt')]
+    assert fb == [{'ts': 2.0, 'id': 1, 'Calories': 12.0, 'matched': True}]
+
+
+def test_prediction_log_close_leaves_a_busy_writer_alone(tmp_path):
+    mod = load_app_module()
+    log = mod.PredictionLog(str(tmp_path), batch_size=1)
+    writer = log._writers['predictions']
+    entered, release, calls = threading.Event(), threading.Event(), []
+    real_write = writer.write
+
+    def slow_write(records):
+        calls.append(threading.current_thread().name)
+        entered.set()
+        release.wait(5.0)
+        real_write(records)
+
+    writer.write = slow_write
+    log.start()
+    log.log('predictions', {'ts': 1.0, 'id': 1, 'prediction': 10.0})
+    assert entered.wait(5.0)
+    log.log('predictions', {'ts': 2.0, 'id': 2, 'prediction': 11.0})
+    log.close(timeout=0.05)  # join times out: no inline drain next to the writer thread
+    assert calls == ['prediction-log'] and log._queue.qsize() == 1
+    release.set()
+    log.close(timeout=5.0)
+    assert calls == ['prediction-log', 'MainThread']
+
+
+def test_capture_log_keeps_both_routes_in_arrival_order(tmp_path, monkeypatch):
+    import glob
+    import gzip
+    import json
+
+    mod = load_app_module()
+    value = mod.REGISTRY.get_sample_value
+    log = mod.PredictionLog(str(tmp_path), max_queue=2, schemas=mod.CAPTURE_SCHEMAS,
+                            depth_gauge=mod.CAPTURE_QUEUE_DEPTH, records_counter=mod.CAPTURE_RECORDS,
+                            dropped_counter=mod.CAPTURE_DROPPED)
+    before = {name: value(name, {'kind': 'capture'}) or 0.0
+              for name in ('app_capture_dropped_total', 'app_prediction_log_dropped_total')}
+    log.log('capture', {'ts': 1.0, 'kind': 'predict', 'id': 5, 'Sex': 'male', 'Age': 30.0})
+    log.log('capture', {'ts': 2.0, 'kind': 'feedback', 'id': 5, 'Calories': 80.0, 'ts_true': None})
+    assert not log.log('capture', {'ts': 3.0, 'kind': 'predict', 'id': 6})  # queue full
+    # capture overflow has its own counter, not the prediction log's
+    assert value('app_capture_dropped_total', {'kind': 'capture'}) == before['app_capture_dropped_total'] + 1
+    assert (value('app_prediction_log_dropped_total', {'kind': 'capture'}) or 0.0) == \
+        before['app_prediction_log_dropped_total']
+    log.start()
+    log.close(timeout=5.0)
+    rows = [json.loads(line) for seg in glob.glob(str(tmp_path / 'capture-*.ndjson.gz'))
+            for line in gzip.open(seg, 'rt')]
+    assert [(r['kind'], r['id']) for r in rows] == [('predict', 5), ('feedback', 5)]
+    # sampling is a pure function of the id, so a kept predict always keeps its feedback
+    monkeypatch.setattr(mod, 'CAPTURE_SAMPLE_RATE', 0.3)
+    kept = [i for i in range(10000) if mod._capture_sampled(i)]
+    assert 2700 < len(kept) < 3300 and kept == [i for i in range(10000) if mod._capture_sampled(i)]
+
+
+def test_shadow_scorer_batches_off_path_and_joins_feedback():
+    mod = load_app_module()
+    mod._startup()
+
+    class Candidate:  # scores every row as 5 * Duration
+        batches = []
+
+        def predict(self, df):
+            self.batches.append(len(df))
+            return df['Duration'].to_numpy() * 5.0
+
+    now = [1_000_000.0]
+    scorer = mod.ShadowScorer(Candidate(), mod.MetricsState(window_seconds=60, clock=lambda: now[0], model='shadow'),
+                              max_queue=3)
+    value = mod.REGISTRY.get_sample_value
+    dropped = value('app_shadow_dropped_total', {'kind': 'predict'}) or 0.0
+    mod.shadow = scorer
+    try:
+        rec = {'Gender': 'male', 'Age': 30.0, 'Height': 180.0, 'Weight': 80.0, 'Heart_Rate': 100.0, 'Body_Temp': 40.0}
+        live = mod.predict(mod.PredictRecord(id=901, Duration=20.0, **rec))['Calories']
+        mod.predict(mod.PredictRecord(id=902, Duration=10.0, **rec))
+        mod.feedback(mod.FeedbackRecord(id=901, Calories=110.0))
+        mod.predict(mod.PredictRecord(id=903, Duration=10.0, **rec))  # queue full: dropped, live still served
+        assert value('app_shadow_dropped_total', {'kind': 'predict'}) == dropped + 1
+        assert 901 in mod.state.pred_index and 901 not in scorer.state.pred_index  # nothing scored inline
+
+        assert scorer._drain() == 3
+        assert Candidate.batches == [2]  # both predictions in one predict call
+        assert scorer.state.pred_index[901][1] == 100.0 and 903 not in scorer.state.pred_index
+        scorer.state._recompute()
+        assert value('app_rolling_mae_5m', {'model': 'shadow'}) == 10.0
+        assert abs(value('app_feedback_coverage_5m', {'model': 'shadow'}) - 0.5) < 1e-9
+        assert mod.state.pred_index[901][1] == live  # the live state keeps the live model's prediction
+    finally:
+        mod.shadow = None
+
+
+def test_late_feedback_joins_spilled_predictions(tmp_path):
+    import numpy as np
+
+    mod = load_app_module()
+    st = mod.MetricsState(window_seconds=60)
+    st.spill = mod.SpillIndex(str(tmp_path), retention_seconds=3600, segment_rows=2, flush_seconds=60)
+    t0 = time.time() - 600
+    for rid, y_pred in [(5, 100.0), (3, 50.0), (9, 80.0)]:
+        st.add_prediction(rid, y_pred, ts_pred=t0)
+    st._recompute()  # all three leave the window -> one sorted segment on disk
+    assert len(st.pred_index) == 0 and len(list(tmp_path.glob('spill-*.npy'))) == 1
+
+    value = mod.REGISTRY.get_sample_value
+    late = value('app_feedback_joins_total', {'model': 'live', 'result': 'late'}) or 0.0
+    missing = value('app_feedback_joins_total', {'model': 'live', 'result': 'missing'}) or 0.0
+    assert st.add_feedback(3, 55.0)
+    assert not st.add_feedback(4, 10.0)
+    assert value('app_feedback_joins_total', {'model': 'live', 'result': 'late'}) == late + 1
+    assert value('app_feedback_joins_total', {'model': 'live', 'result': 'missing'}) == missing + 1
+    st._recompute()
+    expected = abs(np.log1p(55.0) - np.log1p(50.0))
+    assert abs(value('app_rolling_late_rmsle_5m', LIVE) - expected) < 1e-9
+    assert len(st.eval_deque) == 0  # live-window aggregates untouched
+
+    # segments survive a restart and expire after the retention horizon
+    reopened = mod.SpillIndex(str(tmp_path), retention_seconds=3600)
+    assert reopened.lookup(9) == (t0, 80.0)
+    reopened.maintain(time.time() + 7200)
+    assert reopened.lookup(9) is None and not list(tmp_path.glob('spill-*.npy'))
+
+
+def test_state_snapshot_round_trip_filters_by_age(tmp_path):
+    mod = load_app_module()
+    now = time.time()
+    st = mod.MetricsState(window_seconds=60)
+    st.add_prediction(1, 100.0, ts_pred=now - 10)
+    st.add_prediction(2, 50.0, ts_pred=now - 20)
+    st.add_prediction(3, 70.0, ts_pred=now - 30)
+    st.add_feedback(1, 110.0)
+    path = str(tmp_path / 'state.npz')
+    assert mod.write_snapshot(path, st) > 0
+    assert not list(tmp_path.glob('*.tmp'))
+
+    fresh = mod.MetricsState(window_seconds=60)
+    assert mod.restore_snapshot(path, fresh, max_age=300) == 3
+    assert fresh.pred_index[2][:2] == (now - 20, 50.0) and set(fresh.matched_ids) == {1}
+    assert len(fresh.eval_deque) == 1 and abs(fresh._sum_sq - st._sum_sq) < 1e-12
+    assert fresh.add_feedback(2, 55.0)  # joins a prediction made before the "restart"
+
+    # restored later: two predictions have aged out of the window
+    later = mod.MetricsState(window_seconds=60)
+    assert later.restore(st.snapshot(), now=now + 45) == 1
+    assert set(later.pred_index) == {1}
+    # too old to trust at all
+    assert mod.restore_snapshot(path, mod.MetricsState(window_seconds=60), max_age=-1) == 0
+
+    # the age is measured on the state's clock (e.g. CLOCK_SCALE), not wall time
+    clock = [now + 3600.0]
+    fast = mod.MetricsState(window_seconds=1000, clock=lambda: clock[0])
+    fast.add_prediction(4, 80.0)
+    mod.write_snapshot(path, fast)
+    clock[0] += 400
+    assert mod.restore_snapshot(path, mod.MetricsState(window_seconds=1000, clock=lambda: clock[0]), max_age=300) == 0
+
+
+def test_snapshot_slots_are_held_per_worker(tmp_path):
+    mod = load_app_module()
+    path = str(tmp_path / 'state.npz')
+    # flock is per open file, so two claims in one process behave like two workers
+    first, fd1 = mod.claim_snapshot_path(path)
+    second, fd2 = mod.claim_snapshot_path(path)
+    assert (first, second) == (path, str(tmp_path / 'state.1.npz'))
+    os.close(fd1)  # worker 0 exits; its replacement takes over slot 0 and its state
+    again, fd3 = mod.claim_snapshot_path(path)
+    assert again == path
+    os.close(fd2)
+    os.close(fd3)
+
+
+def test_drift_monitor_psi_against_reference():
+    import math
+    import numpy as np
+
+    mod = load_app_module()
+    ref = {
+        'numeric': {'Duration': {'edges': [10.0, 20.0], 'probs': [1 / 3, 1 / 3, 1 / 3]},
+                    'prediction': {'edges': [100.0], 'probs': [0.5, 0.5]}},
+        'categorical': {'Gender': {'categories': ['female', 'male'], 'probs': [0.5, 0.5]}},
+    }
+    mon = mod.DriftMonitor(ref, window_seconds=60, slots=6, min_samples=30)
+    now = 1_000_000.0
+    value = mod.REGISTRY.get_sample_value
+    for i in range(29):
+        mon.observe({'Duration': 5.0, 'Gender': 'male'}, 50.0, now=now)
+    mon.publish(now=now)
+    assert math.isnan(value('app_feature_psi', {'feature': 'Duration'}))  # below min_samples
+
+    # matches the reference: one third per Duration bin, half per prediction bin and gender
+    for i in range(60):
+        mon.observe({'Duration': (5.0, 15.0, 25.0)[i % 3], 'Gender': ('Male', 'female')[i % 2]},
+                    (50.0, 150.0)[i % 2], now=now + 20)
+    mon.publish(now=now + 70)  # the first slot (29 skewed rows) has left the window
+    assert value('app_drift_window_samples') == 60
+    assert value('app_feature_psi', {'feature': 'Duration'}) < 1e-9
+    assert value('app_feature_ks', {'feature': 'Gender'}) < 1e-9
+
+    # every request in the top Duration bin and an unseen category
+    for _ in range(60):
+        mon.observe({'Duration': 40.0, 'Gender': 'x'}, 150.0, now=now + 30)
+    mon.publish(now=now + 70)
+    total, sums = mon.window_counts(now=now + 70)
+    p = np.maximum(sums[0] / sums[0].sum(), 1e-4)
+    q = np.array([1 / 3, 1 / 3, 1 / 3])
+    assert abs(value('app_feature_psi', {'feature': 'Duration'}) - float(np.sum((p - q) * np.log(p / q)))) < 1e-9
+    assert abs(value('app_feature_ks', {'feature': 'Duration'}) - 1 / 3) < 1e-9
+    assert abs(value('app_feature_ks', {'feature': 'Gender'}) - 0.5) < 1e-9
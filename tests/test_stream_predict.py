@@ -0,0 +1,27 @@
+import io
+import json
+import os
+
+import joblib
+
+HANDOUT = os.path.join(os.getcwd(), 'handout_from DS_agent')
+
+
+def test_bad_rows_are_skipped_without_losing_the_batch(monkeypatch, capsys):
+    monkeypatch.syspath_prepend(HANDOUT)
+    import stream_predict
+
+    model = joblib.load(os.path.join(HANDOUT, 'model.joblib'))
+    with open(os.path.join(HANDOUT, 'data_sample', 'test.csv')) as f:
+        header, *rows = f.readlines()[:6]
+    fields = rows[2].split(',')
+    fields[2] = 'x'  # Age
+    lines = [header, rows[0], 'garbage,,,\n', rows[1], '{"id": 1}\n', ','.join(fields), *rows[3:]]
+    out = io.StringIO()
+    # one batch holds every row, so a bad row would otherwise take the good ones with it
+    assert stream_predict.run(model, iter(lines), out, fmt='csv', batch_size=64, report_every=0) == 4
+
+    got = [json.loads(ln) for ln in out.getvalue().splitlines()]
+    assert [r['id'] for r in got] == [int(r.split(',')[0]) for r in (rows[0], rows[1], rows[3], rows[4])]
+    err = capsys.readouterr().err
+    assert err.count('bad row') == 3 and 'bad_rows=3' in err
@@ -0,0 +1,81 @@
+import asyncio
+import math
+import random
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def sb(monkeypatch):
+    monkeypatch.syspath_prepend('tools')
+    import stress_burst
+    return stress_burst
+
+
+def load_args(**kw):
+    base = dict(profile='constant', duration=1.0, rps=10.0, start_rps=1.0, steps='', burst_rps=500.0,
+                burst_every=20.0, burst_duration=5.0, poisson=False, concurrency=64, max_inflight=10000,
+                drain_timeout=5.0)
+    return SimpleNamespace(**dict(base, **kw))
+
+
+def test_histogram_quantiles_within_relative_error(sb):
+    rng = np.random.default_rng(0)
+    values = np.exp(rng.uniform(np.log(1e-4), np.log(10.0), 20000))  # 100µs .. 10s
+    h = sb.LatencyHistogram()  # sub_bits=7: buckets are 1/128 of their power of two wide
+    for v in values:
+        h.record(float(v))
+    ranked = np.sort(values)
+    for q in (0.5, 0.9, 0.99, 0.999):
+        exact = ranked[int(math.ceil(q * len(values))) - 1]
+        assert abs(h.quantile(q) - exact) <= exact / 128
+    assert h.max == values.max() and h.total == len(values)
+    h.record(500.0)  # above ``highest``: clamped into the last bucket, but max stays exact
+    assert h.max == 500.0 and h.counts[-1] == 1 and h.quantile(1.0) >= 120.0
+
+
+def test_schedules_follow_the_profile(sb):
+    def offsets(**kw):
+        args = load_args(**kw)
+        return np.array(list(sb.schedule(sb.rate_fn(args), args.duration, False, random.Random(0))))
+
+    np.testing.assert_allclose(offsets(rps=10.0), np.arange(10) / 10.0, atol=1e-9)
+
+    ramp = offsets(profile='ramp', start_rps=5.0, rps=50.0, duration=4.0)
+    gaps = np.diff(ramp)
+    assert np.all(np.diff(gaps) < 0) and abs(gaps[0] - 1 / 5.0) < 0.02 and abs(gaps[-1] - 1 / 50.0) < 0.01
+
+    step = offsets(profile='step', steps='10:1,40:1', duration=3.0)  # last level held for the 3rd second
+    assert [int(np.sum((step >= s) & (step < s + 1))) for s in range(3)] == [10, 40, 40]
+
+    burst = offsets(profile='burst', rps=2.0, burst_rps=50.0, burst_every=5.0, burst_duration=1.0, duration=10.0)
+    per_second = [int(np.sum((burst >= s) & (burst < s + 1))) for s in range(10)]
+    assert per_second[0] == per_second[5] == 50
+    assert all(abs(n - 2) <= 1 for i, n in enumerate(per_second) if i not in (0, 5))
+
+
+class StallingClient:
+    """The first request stalls 0.3s; later ones answer at once (but queue behind it)."""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def post(self, path, json):
+        self.calls += 1
+        if self.calls == 1:
+            await asyncio.sleep(0.3)
+        return SimpleNamespace(status_code=200)
+
+
+def test_latency_counts_from_intended_send_time(sb):
+    source = SimpleNamespace(next=lambda: {'id': 1}, repeats=0)
+    # one connection at 20 rps: requests due at 0.05..0.25s wait for the stalled first one
+    args = load_args(rps=20.0, concurrency=1)
+    report = asyncio.run(sb.run_load(StallingClient(), '/predict', args, source, random.Random(0)))
+    assert report['requests']['ok'] == report['requests']['completed'] == 20
+    lat, svc = report['latency_s'], report['service_time_s']
+    # the queued requests show the stall in the corrected latency, not in service time
+    assert lat['max'] >= 0.29 and lat['p90'] >= 0.15
+    assert svc['p90'] < 0.05 and svc['max'] >= 0.29
@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+
+import pytest
+import yaml
+
+mlflow = pytest.importorskip('mlflow')
+
+
+def run_train_mlflow(tmp_path, *extra):
+    cmd = [sys.executable, os.path.join('tools', 'train_mlflow.py'),
+           '--tracking-uri', f'file:{tmp_path / "mlruns"}', '--config', str(tmp_path / 'config.yaml'),
+           '--out', str(tmp_path / 'model.joblib'), '--metrics', str(tmp_path / 'metrics.json'),
+           '--log-every', '10', *extra]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    return proc.stdout
+
+
+def test_unchanged_inputs_reuse_the_cached_run(tmp_path, monkeypatch):
+    # mlflow>=3 only opens a file store when asked to explicitly
+    monkeypatch.setenv('MLFLOW_ALLOW_FILE_STORE', 'true')
+    handout = os.path.join(os.getcwd(), 'handout_from DS_agent')
+    with open(os.path.join(handout, 'config.yaml')) as f:
+        cfg = yaml.safe_load(f)
+    cfg['train']['num_boost_round'] = 30
+    with open(tmp_path / 'config.yaml', 'w') as f:
+        yaml.safe_dump(cfg, f)
+
+    out = run_train_mlflow(tmp_path)
+    assert 'cache miss' in out and 'phase train seconds=' in out
+    model_mtime = os.stat(tmp_path / 'model.joblib').st_mtime_ns
+
+    out = run_train_mlflow(tmp_path)
+    assert 'cache hit' in out and 'Running:' not in out
+    assert os.stat(tmp_path / 'model.joblib').st_mtime_ns == model_mtime  # identical file is not rewritten
+
+    (tmp_path / 'model.joblib').unlink()
+    out = run_train_mlflow(tmp_path)
+    assert 'model downloaded to' in out and (tmp_path / 'model.joblib').exists()
+
+    mlflow.set_tracking_uri(f'file:{tmp_path / "mlruns"}')
+    runs = mlflow.search_runs(order_by=['attributes.start_time ASC'], output_format='list')
+    trained, *hits = runs
+    assert trained.data.tags['cache_hit'] == 'false'
+    assert [r.data.tags['source_run_id'] for r in hits] == [trained.info.run_id] * 2
+    client = mlflow.MlflowClient()
+    assert not client.list_artifacts(hits[0].info.run_id)  # nothing re-uploaded
+    history = client.get_metric_history(trained.info.run_id, 'valid_rmse')
+    assert [m.step for m in history][:3] == [0, 10, 20]
+    assert hits[0].data.metrics['valid_rmsle'] == trained.data.metrics['valid_rmsle']
+    assert 'phase_upload_sec' in trained.data.metrics
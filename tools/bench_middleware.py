@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Per-request overhead of the pure-ASGI MetricsMiddleware vs the former BaseHTTPMiddleware.
+
+Drives each app directly through the ASGI interface (no HTTP client) so the
+measured difference is the middleware itself. Also reports how many latency
+series each variant creates when hit by random scanner paths.
+"""
+import argparse
+import asyncio
+import importlib.util
+import os
+import statistics
+import time
+import uuid
+
+from fastapi import FastAPI, Request, Response
+from prometheus_client import CollectorRegistry, Counter, Histogram
+from starlette.middleware.base import BaseHTTPMiddleware
+
+
+def load_app_module():
+    root = os.getcwd()
+    svc_path = os.path.join(root, "service", "app.py")
+    spec = importlib.util.spec_from_file_location("service_app", svc_path)
+    module = importlib.util.module_from_spec(spec)
+    assert spec and spec.loader
+    spec.loader.exec_module(module)
+    return module
+
+
+LEGACY_REGISTRY = CollectorRegistry()
+LEGACY_COUNT = Counter(
+    "legacy_requests_total", "Total HTTP requests", ["route", "method", "status"], registry=LEGACY_REGISTRY
+)
+LEGACY_LATENCY = Histogram(
+    "legacy_request_latency_seconds", "Request latency seconds", ["route", "method"], registry=LEGACY_REGISTRY
+)
+
+
+class LegacyMetricsMiddleware(BaseHTTPMiddleware):
+    """The previous implementation: raw URL path labels, BaseHTTPMiddleware dispatch."""
+
+    async def dispatch(self, request: Request, call_next):
+        start = time.perf_counter()
+        try:
+            response: Response = await call_next(request)
+            status_code = getattr(response, "status_code", 500)
+        except Exception:
+            status_code = 500
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            route = request.url.path
+            method = request.method
+            LEGACY_COUNT.labels(route=route, method=method, status=str(status_code)).inc()
+            LEGACY_LATENCY.labels(route=route, method=method).observe(duration)
+        return response
+
+
+def build_app(middleware=None) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    if middleware is not None:
+        app.add_middleware(middleware)
+    return app
+
+
+def make_scope(path: str) -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("bench", 80),
+    }
+
+
+async def _receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def _send(message):
+    pass
+
+
+async def time_requests(app, n: int, path: str = "/ping") -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        await app(make_scope(path), _receive, _send)
+    return (time.perf_counter() - t0) / n
+
+
+def count_series(registry, name: str) -> int:
+    for metric in registry.collect():
+        if metric.name == name:
+            return len({tuple(sorted(s.labels.items())) for s in metric.samples if s.name.endswith("_count")})
+    return 0
+
+
+async def run(requests: int, rounds: int, scanner_paths: int):
+    module = load_app_module()
+    apps = {
+        "none": build_app(),
+        "legacy_base_http": build_app(LegacyMetricsMiddleware),
+        "asgi": build_app(module.MetricsMiddleware),
+    }
+    for app in apps.values():
+        await time_requests(app, 200)  # warm-up
+    samples = {name: [] for name in apps}
+    for _ in range(rounds):
+        for name, app in apps.items():
+            samples[name].append(await time_requests(app, requests))
+
+    base = statistics.median(samples["none"]) * 1e6
+    print(f"no_middleware_us={base:.1f}")
+    for name in ("legacy_base_http", "asgi"):
+        us = statistics.median(samples[name]) * 1e6
+        print(f"{name}_us={us:.1f} overhead_us={us - base:.1f}")
+
+    for _ in range(scanner_paths):
+        path = f"/scan/{uuid.uuid4().hex}"
+        await apps["legacy_base_http"](make_scope(path), _receive, _send)
+        await apps["asgi"](make_scope(path), _receive, _send)
+    print(f"latency_series_after_{scanner_paths}_scanner_paths: "
+          f"legacy={count_series(LEGACY_REGISTRY, 'legacy_request_latency_seconds')} "
+          f"asgi={count_series(module.REGISTRY, 'app_request_latency_seconds')}")
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--requests", type=int, default=2000, help="Requests per round per variant")
+    p.add_argument("--rounds", type=int, default=5)
+    p.add_argument("--scanner-paths", type=int, default=500)
+    args = p.parse_args()
+    asyncio.run(run(args.requests, args.rounds, args.scanner_paths))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""Measure the overhead of the /predict stage timers (on vs off) in-process."""
+import argparse
+import importlib.util
+import os
+import statistics
+import time
+
+import pandas as pd
+
+
+def load_app_module():
+    root = os.getcwd()
+    svc_path = os.path.join(root, "service", "app.py")
+    spec = importlib.util.spec_from_file_location("service_app", svc_path)
+    module = importlib.util.module_from_spec(spec)
+    assert spec and spec.loader
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_records(module, n: int):
+    handout = os.path.join(os.getcwd(), "handout_from DS_agent")
+    df = pd.read_csv(os.path.join(handout, "data_sample", "test.csv")).head(n)
+    recs = []
+    for row in df.itertuples(index=False):
+        recs.append(module.PredictRecord(
+            id=int(row.id), Sex=str(row.Sex), Age=float(row.Age), Height=float(row.Height),
+            Weight=float(row.Weight), Duration=float(row.Duration),
+            Heart_Rate=float(row.Heart_Rate), Body_Temp=float(row.Body_Temp),
+        ))
+    return recs
+
+
+def time_predict(module, recs) -> float:
+    t0 = time.perf_counter()
+    for rec in recs:
+        module.predict(rec)
+    return (time.perf_counter() - t0) / len(recs)
+
+
+def time_timer_only(module, n: int) -> float:
+    stages = ("validate", "queue_wait", "dataframe", "add_features", "transform",
+              "dmatrix", "booster_predict", "state_update")
+    t0 = time.perf_counter()
+    for _ in range(n):
+        timer = module.StageTimer()
+        for stage in stages:
+            timer.mark(stage)
+        timer.observe()
+    return (time.perf_counter() - t0) / n
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--records", type=int, default=200, help="Records per measurement round")
+    p.add_argument("--rounds", type=int, default=7, help="Interleaved on/off rounds")
+    args = p.parse_args()
+
+    module = load_app_module()
+    module._startup()
+    if module.model is None:
+        raise SystemExit("Model not loaded; run `make train` first")
+    recs = make_records(module, args.records)
+    time_predict(module, recs[:20])  # warm-up
+
+    on, off = [], []
+    for _ in range(args.rounds):
+        module.stage_timers_enabled = False
+        off.append(time_predict(module, recs))
+        module.stage_timers_enabled = True
+        on.append(time_predict(module, recs))
+
+    off_us = statistics.median(off) * 1e6
+    on_us = statistics.median(on) * 1e6
+    timer_us = time_timer_only(module, 20000) * 1e6
+    print(f"predict_off_us={off_us:.1f} predict_on_us={on_us:.1f} "
+          f"delta_us={on_us - off_us:.1f} ({(on_us - off_us) / off_us * 100:.2f}%)")
+    print(f"stage_timer_mark_observe_us={timer_us:.2f} (8 stages, isolated)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""Compare the former per-row stream_predict loop with micro-batched scoring."""
+import argparse
+import os
+import sys
+import time
+
+import joblib
+import pandas as pd
+
+
+def per_row_loop(model, df: pd.DataFrame, out) -> int:
+    # The previous stream_predict.py implementation (one model.predict per row)
+    import json
+    for i in range(len(df)):
+        row = df.iloc[[i]].copy()
+        pred = float(model.predict(row)[0])
+        rid = int(row["id"].iloc[0]) if "id" in row.columns else i
+        out.write(json.dumps({"id": rid, "Calories": pred}) + "\n")
+        out.flush()
+    return len(df)
+
+
+def main():
+    root = os.getcwd()
+    handout = os.path.join(root, "handout_from DS_agent")
+    p = argparse.ArgumentParser()
+    p.add_argument("--data", default=os.path.join(handout, "data_sample", "test.csv"))
+    p.add_argument("--model", default=os.path.join(handout, "model.joblib"))
+    p.add_argument("--rows", type=int, default=1000, help="Rows to score per variant (0=all)")
+    p.add_argument("--batch-sizes", default="1,16,64,256")
+    args = p.parse_args()
+
+    sys.path.insert(0, handout)
+    import stream_predict
+
+    model = joblib.load(args.model)
+    df = pd.read_csv(args.data)
+    if args.rows > 0:
+        df = df.head(args.rows)
+    lines = df.to_csv(index=False).splitlines(keepends=True)
+    model.predict(df.head(8))  # warm-up
+
+    with open(os.devnull, "w") as devnull:
+        t0 = time.perf_counter()
+        n = per_row_loop(model, df, devnull)
+        base = n / (time.perf_counter() - t0)
+        print(f"per_row_loop rows={n} rows_per_sec={base:.0f}")
+        for bs in [int(x) for x in args.batch_sizes.split(",") if x]:
+            t0 = time.perf_counter()
+            n = stream_predict.run(model, iter(lines), devnull, fmt="csv", batch_size=bs,
+                                   max_wait=0.05, report_every=0)
+            rate = n / (time.perf_counter() - t0)
+            print(f"micro_batch batch_size={bs} rows={n} rows_per_sec={rate:.0f} speedup={rate / base:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
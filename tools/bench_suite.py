@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""Microbenchmarks for the model and service hot paths, with saved baselines.
+
+Each benchmark is calibrated to run at least ``--min-time`` per sample and sampled
+``--repeats`` times; the per-op median and MAD are reported. ``--save`` writes them
+to a baseline JSON; ``--compare`` flags a benchmark as a regression only when it is
+slower by more than ``--threshold`` (relative) AND by more than ``--noise-k`` robust
+standard deviations (1.4826 * MAD) of either run, and exits 1 if any regressed.
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+import pandas as pd
+
+
+def load_app_module():
+    root = os.getcwd()
+    svc_path = os.path.join(root, "service", "app.py")
+    spec = importlib.util.spec_from_file_location("service_app", svc_path)
+    module = importlib.util.module_from_spec(spec)
+    assert spec and spec.loader
+    spec.loader.exec_module(module)
+    return module
+
+
+# --------------------
+# Benchmarks: each setup returns (fn, ops per fn call)
+# --------------------
+Bench = Tuple[Callable[[], object], int]
+
+
+def sample_frame(n: int) -> pd.DataFrame:
+    handout = os.path.join(os.getcwd(), "handout_from DS_agent")
+    df = pd.read_csv(os.path.join(handout, "data_sample", "train.csv")).drop(columns=["Calories"])
+    reps = -(-n // len(df))
+    return pd.concat([df] * reps, ignore_index=True).head(n) if reps > 1 else df.head(n)
+
+
+def model_benches(module, batch_sizes: List[int]) -> Dict[str, Callable[[], Bench]]:
+    from model import add_features
+    model = module.model
+    benches = {}
+    for n in batch_sizes:
+        def feats(n=n):
+            df = sample_frame(n)
+            return (lambda: add_features(df)), n
+
+        def transform(n=n):
+            Xf = add_features(sample_frame(n))
+            return (lambda: model.preprocessor.transform(Xf)), n
+
+        def predict(n=n):
+            df = sample_frame(n)
+            return (lambda: model.predict(df)), n
+
+        benches[f"add_features[{n}]"] = feats
+        benches[f"preprocessor.transform[{n}]"] = transform
+        benches[f"ModelWrapper.predict[{n}]"] = predict
+    return benches
+
+
+def state_benches(module, window: int) -> Dict[str, Callable[[], Bench]]:
+    def filled_state():
+        # fixed clock: nothing ages out, so every call sees a window of exactly `window` predictions
+        st = module.MetricsState(window_seconds=300, clock=lambda: 1_000_000.0)
+        for i in range(window):
+            st.add_prediction(i, 100.0 + i % 50)
+        return st
+
+    def add_prediction():
+        st = filled_state()
+        ids = iter(range(window, 1 << 62))
+        return (lambda: st.add_prediction(next(ids), 123.0)), 1
+
+    def add_feedback():
+        st = filled_state()
+        ids = iter(range(1 << 62))
+        return (lambda: st.add_feedback(next(ids) % window, 120.0)), 1
+
+    def recompute():
+        st = filled_state()
+        for i in range(0, window, 2):
+            st.add_feedback(i, 110.0)
+        return (lambda: st._recompute()), 1
+
+    return {
+        f"MetricsState.add_prediction[{window}]": add_prediction,
+        f"MetricsState.add_feedback[{window}]": add_feedback,
+        f"MetricsState._recompute[{window}]": recompute,
+    }
+
+
+def service_benches(module) -> Dict[str, Callable[[], Bench]]:
+    from prometheus_client import generate_latest
+
+    def render_metrics():
+        return (lambda: generate_latest(module.REGISTRY)), 1
+
+    def predict_asgi():
+        # full stack minus the socket: middleware, routing, validation, threadpool hop, handler
+        body = json.dumps({"id": 1, "Sex": "male", "Age": 30, "Height": 180, "Weight": 80,
+                           "Duration": 20, "Heart_Rate": 100, "Body_Temp": 40.0}).encode()
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+            "scheme": "http", "path": "/predict", "raw_path": b"/predict", "root_path": "", "query_string": b"",
+            "headers": [(b"host", b"bench"), (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode())],
+            "client": ("127.0.0.1", 1234), "server": ("bench", 80),
+        }
+        loop = asyncio.new_event_loop()
+        status = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+
+        async def batch(n=20):
+            for _ in range(n):
+                await module.app(dict(scope), receive, send)
+
+        def run():
+            loop.run_until_complete(batch())
+            if status[-1] != 200:
+                raise RuntimeError(f"/predict returned {status[-1]}")
+        return run, 20
+
+    return {"metrics.render": render_metrics, "asgi./predict": predict_asgi}
+
+
+# --------------------
+# Measurement
+# --------------------
+def measure(fn: Callable[[], object], ops: int, repeats: int, min_time: float) -> Dict[str, float]:
+    fn()  # warm-up
+    loops = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_time:
+            break
+        loops = max(loops * 2, int(loops * min_time / max(elapsed, 1e-9) * 1.1))
+    samples = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        samples.append((time.perf_counter() - t0) / (loops * ops))
+    med = statistics.median(samples)
+    return {"median_s": med, "mad_s": statistics.median(abs(s - med) for s in samples),
+            "loops": loops, "ops": ops, "samples_s": samples}
+
+
+def compare(baseline: Dict[str, dict], current: Dict[str, dict], threshold: float, noise_k: float) -> List[dict]:
+    rows = []
+    for name, cur in current.items():
+        base = baseline.get(name)
+        if base is None:
+            rows.append({"name": name, "status": "new", "change": None})
+            continue
+        delta = cur["median_s"] - base["median_s"]
+        noise = noise_k * 1.4826 * max(base["mad_s"], cur["mad_s"])
+        bar = max(threshold * base["median_s"], noise)
+        status = "REGRESSION" if delta > bar else "faster" if -delta > bar else "ok"
+        rows.append({"name": name, "status": status, "change": delta / base["median_s"],
+                     "baseline_s": base["median_s"]})
+    return rows
+
+
+def environment() -> dict:
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        rev = ""
+    return {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count(),
+            "git_rev": rev, "ts": time.time(),
+            "threads": {v: os.environ.get(v) for v in ("OMP_NUM_THREADS", "XGBOOST_NUM_THREADS")}}
+
+
+def fmt_time(s: float) -> str:
+    return f"{s * 1e6:10.2f}us" if s < 1e-3 else f"{s * 1e3:10.3f}ms"
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--filter", default="", help="Regex on benchmark names")
+    p.add_argument("--batch-sizes", default="1,16,256,4096", help="Rows per call for the model benches")
+    p.add_argument("--window", type=int, default=50000, help="Predictions held in MetricsState benches")
+    p.add_argument("--repeats", type=int, default=7)
+    p.add_argument("--min-time", type=float, default=0.1, help="Seconds per sample (loops are calibrated)")
+    p.add_argument("--save", default=None, help="Write results as the new baseline JSON")
+    p.add_argument("--compare", default=None, help="Baseline JSON to compare against")
+    p.add_argument("--threshold", type=float, default=0.10, help="Min relative slowdown to count as regression")
+    p.add_argument("--noise-k", type=float, default=3.0, help="Min slowdown in robust std devs (1.4826*MAD)")
+    p.add_argument("--no-fail", action="store_true", help="Report regressions but exit 0")
+    args = p.parse_args()
+
+    module = load_app_module()
+    module._startup()
+    if module.model is None:
+        raise SystemExit("Model not loaded; run `make train` first")
+    module.stage_timers_enabled = False  # measure the code paths, not the optional instrumentation
+    benches = {}
+    benches.update(model_benches(module, [int(x) for x in args.batch_sizes.split(",") if x]))
+    benches.update(state_benches(module, args.window))
+    benches.update(service_benches(module))
+    pattern = re.compile(args.filter)
+
+    results = {}
+    for name, setup in benches.items():
+        if not pattern.search(name):
+            continue
+        fn, ops = setup()
+        results[name] = measure(fn, ops, args.repeats, args.min_time)
+        r = results[name]
+        print(f"{name:40s} {fmt_time(r['median_s'])}/op  ±{r['mad_s'] / r['median_s'] * 100:5.1f}% (MAD)",
+              flush=True)
+    module._shutdown()
+
+    regressions = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        print(f"\ncompared with {args.compare} (threshold {args.threshold:.0%}, {args.noise_k:g} sigma):")
+        for row in compare(baseline, results, args.threshold, args.noise_k):
+            change = "" if row["change"] is None else f"{row['change'] * 100:+7.1f}%  (baseline {fmt_time(row['baseline_s']).strip()})"
+            print(f"  {row['status']:10s} {row['name']:40s} {change}")
+            regressions += row["status"] == "REGRESSION"
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump({"env": environment(), "results": results}, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+    if regressions and not args.no_fail:
+        print(f"{regressions} benchmark(s) regressed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
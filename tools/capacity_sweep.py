@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""Find the max sustainable RPS of the service across worker/thread/env settings.
+
+Each configuration starts uvicorn in a subprocess, then steps an open-loop constant
+load (tools/stress_burst.py) up a ladder of rates. A step passes when p99 latency and
+the error rate stay within the SLO; the first failing step ends the configuration.
+CPU time and RSS are read from /proc for the uvicorn process tree.
+"""
+import argparse
+import asyncio
+import csv
+import itertools
+import json
+import math
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from stress_burst import PayloadSource, default_data_path, run_load
+
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+# --------------------
+# /proc accounting
+# --------------------
+def process_tree(root: int) -> List[int]:
+    """root and all its descendants (uvicorn --workers forks one process per worker)."""
+    children: Dict[int, List[int]] = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(name))
+    out, todo = [], [root]
+    while todo:
+        pid = todo.pop()
+        out.append(pid)
+        todo.extend(children.get(pid, []))
+    return out
+
+
+def cpu_seconds(pids: List[int]) -> float:
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += int(fields[11]) + int(fields[12])  # utime + stime
+        except (OSError, IndexError, ValueError):
+            pass
+    return total / CLK_TCK
+
+
+def rss_bytes(pids: List[int]) -> int:
+    # plain RSS sums count pages shared between forked workers more than once: an upper bound
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                total += int(f.read().split()[1]) * PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            pass
+    return total
+
+
+# --------------------
+# Service lifecycle
+# --------------------
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_service(workers: int, threads: int, env_overrides: Dict[str, str], port: int, log_path: str,
+                  preload: bool = False):
+    env = dict(os.environ, **env_overrides)
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "XGBOOST_NUM_THREADS"):
+        env[var] = str(threads)
+    # preload: the model is loaded once in a parent that forks the workers (service/preload.py)
+    server = ["service.preload"] if preload else ["uvicorn", "service.app:app"]
+    cmd = [sys.executable, "-m", *server, "--host", "127.0.0.1", "--port", str(port),
+           "--workers", str(workers), "--log-level", "warning"]
+    log = open(log_path, "w")
+    proc = subprocess.Popen(cmd, env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    proc._log = log  # closed in stop_service
+    return proc
+
+
+def wait_healthy(url: str, proc, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            return False
+        try:
+            if httpx.get(f"{url}/healthz", timeout=1.0).json().get("status") == "ok":
+                return True
+        except (httpx.HTTPError, ValueError):
+            pass
+        time.sleep(0.25)
+    return False
+
+
+def stop_service(proc, timeout: float = 10.0):
+    if proc.poll() is None:
+        os.killpg(proc.pid, signal.SIGTERM)
+        try:
+            proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.wait()
+    proc._log.close()
+
+
+# --------------------
+# Load steps
+# --------------------
+def step_args(args, rps: float) -> argparse.Namespace:
+    # the subset of stress_burst's flags run_load reads, for a constant-rate step
+    return argparse.Namespace(profile="constant", rps=rps, duration=args.step_seconds, poisson=args.poisson,
+                              concurrency=args.concurrency, max_inflight=args.max_inflight,
+                              drain_timeout=args.drain_timeout)
+
+
+async def run_step(url: str, rps: float, args, source: PayloadSource, rng: random.Random) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=httpx.Timeout(args.timeout, pool=None)) as client:
+        return await run_load(client, "/predict", step_args(args, rps), source, rng)
+
+
+def measure_step(url: str, proc, rps: float, args, source, rng) -> dict:
+    pids = process_tree(proc.pid)
+    cpu0 = cpu_seconds(pids)
+    peak = [rss_bytes(pids)]
+
+    async def sample_rss():
+        while True:
+            await asyncio.sleep(0.5)
+            peak[0] = max(peak[0], rss_bytes(pids))
+
+    async def main():
+        sampler = asyncio.create_task(sample_rss())
+        try:
+            return await run_step(url, rps, args, source, rng)
+        finally:
+            sampler.cancel()
+
+    report = asyncio.run(main())
+    cpu = cpu_seconds(pids) - cpu0
+    req = report["requests"]
+    errors = sum(req["errors"].values())
+    p99 = report["latency_s"]["p99"]
+    err_rate = errors / req["issued"] if req["issued"] else 1.0
+    return {
+        "rps": rps,
+        "ok_rps": report["throughput"]["ok_rps"],
+        "p50_s": report["latency_s"]["p50"],
+        "p99_s": p99,
+        "error_rate": err_rate,
+        "cpu_s": cpu,
+        "cpu_s_per_1k": 1000.0 * cpu / req["ok"] if req["ok"] else math.nan,
+        "cpu_cores": cpu / report["elapsed_s"] if report["elapsed_s"] else 0.0,
+        "peak_rss_mb": peak[0] / 1e6,
+        "passed": p99 <= args.slo_p99 and err_rate <= args.max_error_rate,
+    }
+
+
+def rps_ladder(args):
+    if args.rps_levels:
+        yield from (float(x) for x in args.rps_levels.split(",") if x)
+        return
+    rps = args.start_rps
+    while rps <= args.max_rps:
+        yield rps
+        rps *= args.rps_factor
+
+
+def print_step(label: str, step: dict):
+    print(f"  {label} rps={step['rps']:.0f} p99={step['p99_s'] * 1000:.1f}ms err={step['error_rate']:.3f} "
+          f"cpu_cores={step['cpu_cores']:.2f} rss_mb={step['peak_rss_mb']:.0f} {'ok' if step['passed'] else 'FAIL'}")
+
+
+def sweep_config(workers: int, threads: int, env: Dict[str, str], args, source, rng) -> dict:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    label = f"w{workers}-t{threads}" + "".join(f"-{k}={v}" for k, v in env.items()) + ("-preload" * args.preload)
+    proc = start_service(workers, threads, env, port, os.path.join(args.out_dir, f"uvicorn-{label}.log"),
+                         preload=args.preload)
+    result = {"config": label, "workers": workers, "threads": threads, "env": env, "steps": []}
+    try:
+        if not wait_healthy(url, proc, args.startup_timeout):
+            result["error"] = "service did not become healthy"
+            return result
+        # warm-up: first requests pay lazy imports and allocator growth
+        measure_step(url, proc, args.start_rps, argparse.Namespace(**dict(vars(args), step_seconds=2.0)), source, rng)
+        last_pass, first_fail = None, None
+        for rps in rps_ladder(args):
+            step = measure_step(url, proc, rps, args, source, rng)
+            result["steps"].append(step)
+            print_step(label, step)
+            if not step["passed"]:
+                first_fail = rps
+                break
+            last_pass = step
+        # bisect between the last passing and the first failing rate
+        lo = last_pass["rps"] if last_pass else 0.0
+        for _ in range(args.refine if first_fail else 0):
+            mid = (lo + first_fail) / 2
+            if mid - lo < max(1.0, 0.05 * lo):
+                break
+            step = measure_step(url, proc, mid, args, source, rng)
+            result["steps"].append(step)
+            print_step(label, step)
+            if step["passed"]:
+                lo, last_pass = mid, step
+            else:
+                first_fail = mid
+        best = last_pass or {}
+        result.update(
+            max_rps=best.get("rps", 0.0),
+            p99_s=best.get("p99_s"),
+            cpu_s_per_1k=best.get("cpu_s_per_1k"),
+            cpu_cores=best.get("cpu_cores"),
+            peak_rss_mb=max((s["peak_rss_mb"] for s in result["steps"]), default=None),
+            saturated=first_fail is not None,
+        )
+        return result
+    finally:
+        stop_service(proc)
+
+
+# --------------------
+# Output
+# --------------------
+TABLE_COLUMNS = ("config", "max_rps", "p99_s", "cpu_s_per_1k", "cpu_cores", "peak_rss_mb", "saturated")
+
+
+def fmt(v) -> str:
+    if v is None:
+        return "-"
+    if isinstance(v, float):
+        return f"{v:.4f}" if abs(v) < 10 else f"{v:.1f}"
+    return str(v)
+
+
+def write_outputs(results: List[dict], args):
+    rows = [{c: r.get(c) for c in TABLE_COLUMNS} for r in results]
+    with open(os.path.join(args.out_dir, "sweep.json"), "w") as f:
+        json.dump({"slo_p99_s": args.slo_p99, "max_error_rate": args.max_error_rate, "results": results}, f, indent=2)
+    with open(os.path.join(args.out_dir, "sweep.csv"), "w", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=TABLE_COLUMNS)
+        w.writeheader()
+        w.writerows(rows)
+    print("| " + " | ".join(TABLE_COLUMNS) + " |")
+    print("|" + "---|" * len(TABLE_COLUMNS))
+    for r in rows:
+        print("| " + " | ".join(fmt(r[c]) for c in TABLE_COLUMNS) + " |")
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib not installed; skipping plot")
+        return
+    fig, ax = plt.subplots(figsize=(8, 4.5))
+    for r in results:
+        steps = sorted(r["steps"], key=lambda s: s["rps"])
+        if steps:
+            ax.plot([s["rps"] for s in steps], [s["p99_s"] * 1000 for s in steps], marker="o", label=r["config"])
+    ax.axhline(args.slo_p99 * 1000, color="grey", linestyle="--", label="p99 SLO")
+    ax.set_xlabel("offered RPS")
+    ax.set_ylabel("p99 latency (ms)")
+    ax.set_yscale("log")
+    ax.legend(fontsize="small")
+    fig.tight_layout()
+    fig.savefig(os.path.join(args.out_dir, "sweep.png"), dpi=120)
+    print(f"Wrote plot to {os.path.join(args.out_dir, 'sweep.png')}")
+
+
+def recommend(results: List[dict], args) -> Optional[dict]:
+    """Sizing for one replica running the most CPU-efficient configuration."""
+    ok = [r for r in results if r.get("max_rps") and r.get("cpu_s_per_1k") and not math.isnan(r["cpu_s_per_1k"])]
+    if not ok:
+        return None
+    if args.target_rps:
+        # configs that cannot carry the target within the headroom need more replicas, not this sizing
+        ok = [r for r in ok if r["max_rps"] * args.headroom >= args.target_rps] or ok
+    best = min(ok, key=lambda r: (r["cpu_s_per_1k"], -r["max_rps"]))
+    target = args.target_rps or args.headroom * best["max_rps"]
+    cores = best["cpu_s_per_1k"] / 1000.0 * target
+    millicores = int(math.ceil(cores * 1000 / 50.0) * 50)
+    mem_mib = int(math.ceil(best["peak_rss_mb"] * 1e6 / (1 << 20) * 1.25 / 64.0) * 64)
+    rec = {
+        "config": best["config"],
+        "workers": best["workers"],
+        "threads": best["threads"],
+        "replica_target_rps": target,
+        "replica_max_rps": best["max_rps"],
+        "cpu_request_millicores": max(50, millicores),
+        # what the replica burned at its max passing rate; capping below that moves the knee left
+        "cpu_limit": max(1, int(math.ceil(best["cpu_cores"]))),
+        "memory_request_mib": mem_mib,
+        "memory_limit_mib": mem_mib * 2,
+    }
+    print(f"\nRecommendation ({rec['config']}, target {target:.0f} rps per replica = "
+          f"{args.headroom:.0%} of its {best['max_rps']:.0f} rps max at p99<={args.slo_p99 * 1000:.0f}ms):")
+    print(f"  k8s/deployment.yaml  resources.requests: cpu {rec['cpu_request_millicores']}m, "
+          f"memory {rec['memory_request_mib']}Mi; limits: cpu \"{rec['cpu_limit']}\", memory {rec['memory_limit_mib']}Mi")
+    print(f"  k8s/configmap.yaml   OMP/MKL/XGBOOST_NUM_THREADS: \"{rec['threads']}\"; uvicorn --workers {rec['workers']}")
+    print(f"  docker-compose.yml   OMP_THREADS={rec['threads']}, cpus: \"{rec['cpu_limit']}\", "
+          f"mem_limit: {rec['memory_limit_mib']}m")
+    print(f"  replicas for R rps: ceil(R / {target:.0f}); HPA CPU target stays meaningful because requests "
+          f"match the measured {best['cpu_s_per_1k']:.2f} CPU-s per 1k predictions")
+    return rec
+
+
+def parse_args():
+    p = argparse.ArgumentParser()
+    p.add_argument("--workers", default="1,2", help="uvicorn --workers values")
+    p.add_argument("--threads", default="1,2", help="OMP/MKL/XGBOOST_NUM_THREADS values")
+    p.add_argument("--preload", action="store_true", help="Serve via service/preload.py (model shared across workers)")
+    p.add_argument("--env", action="append", default=[],
+                   help="Extra grid axis as KEY=v1,v2 (any service env knob); repeatable")
+    p.add_argument("--slo-p99", type=float, default=0.1, help="p99 latency SLO in seconds")
+    p.add_argument("--max-error-rate", type=float, default=0.001)
+    p.add_argument("--rps-levels", default="", help="Explicit ladder, e.g. 25,50,100 (overrides start/factor)")
+    p.add_argument("--start-rps", type=float, default=25.0)
+    p.add_argument("--rps-factor", type=float, default=1.5)
+    p.add_argument("--max-rps", type=float, default=5000.0)
+    p.add_argument("--refine", type=int, default=2, help="Bisection steps between last pass and first fail")
+    p.add_argument("--step-seconds", type=float, default=15.0)
+    p.add_argument("--concurrency", type=int, default=64)
+    p.add_argument("--max-inflight", type=int, default=10000)
+    p.add_argument("--timeout", type=float, default=5.0)
+    p.add_argument("--drain-timeout", type=float, default=10.0)
+    p.add_argument("--poisson", action="store_true")
+    p.add_argument("--data", default=None)
+    p.add_argument("--startup-timeout", type=float, default=60.0)
+    p.add_argument("--headroom", type=float, default=0.7, help="Share of max RPS to size a replica for")
+    p.add_argument("--target-rps", type=float, default=None, help="Size a replica for this RPS instead")
+    p.add_argument("--out-dir", default=os.path.join("data", "capacity"))
+    p.add_argument("--seed", type=int, default=42)
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    os.makedirs(args.out_dir, exist_ok=True)
+    rng = random.Random(args.seed)
+    source = PayloadSource(args.data or default_data_path(), 0.0, rng)
+    env_axes = []
+    for spec in args.env:
+        key, values = spec.split("=", 1)
+        env_axes.append([(key, v) for v in values.split(",")])
+    grid = list(itertools.product([int(w) for w in args.workers.split(",")],
+                                  [int(t) for t in args.threads.split(",")], *env_axes))
+    print(f"{len(grid)} configurations, SLO p99<={args.slo_p99 * 1000:.0f}ms error_rate<={args.max_error_rate}, "
+          f"{os.cpu_count()} CPUs")
+    results = []
+    for workers, threads, *env in grid:
+        results.append(sweep_config(workers, threads, dict(env), args, source, rng))
+    write_outputs(results, args)
+    rec = recommend(results, args)
+    if rec is not None:
+        with open(os.path.join(args.out_dir, "recommendation.json"), "w") as f:
+            json.dump(rec, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,209 @@
 #!/usr/bin/env python3
+"""Split a training CSV/Parquet into train and holdout files, streaming it in chunks.
+
+Rows are assigned by a stable hash of ``id`` (order-independent, reproducible across
+machines), or by a time cutoff. Memory is bounded by ``--chunk-size`` regardless of
+the source size. A ``manifest.json`` records the parameters, row counts and sha256 of
+every file.
+"""
 import argparse
+import json
 import os
+import resource
 import sys
+import time
+
+import numpy as np
 import pandas as pd
 
+ROOT = os.getcwd()
+HANDOUT = os.path.join(ROOT, 'handout_from DS_agent')
+sys.path.insert(0, HANDOUT)
+from feature_cache import file_digest  # noqa: E402
+from model import id_hash_unit  # noqa: E402
+
+# bottom-k sample used to estimate time cutoffs and target quantiles without loading the data
+SAMPLE_ROWS = 100_000
+
+
+def iter_chunks(path: str, chunk_size: int, columns=None):
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size, usecols=columns)
+
+
+def count_rows(path: str, chunk_size: int) -> int:
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).metadata.num_rows
+    return sum(len(c) for c in iter_chunks(path, chunk_size, columns=['id']))
+
+
+def bottom_k_sample(path: str, column: str, chunk_size: int, seed: int) -> np.ndarray:
+    """``column`` values of the SAMPLE_ROWS rows with the smallest id hash: uniform and order-independent."""
+    keep = None
+    for chunk in iter_chunks(path, chunk_size, columns=['id', column]):
+        part = pd.DataFrame({'h': id_hash_unit(chunk['id'].to_numpy(), seed + 1), 'v': chunk[column].to_numpy()})
+        keep = part if keep is None else pd.concat([keep, part], ignore_index=True)
+        if len(keep) > SAMPLE_ROWS:
+            keep = keep.nsmallest(SAMPLE_ROWS, 'h')
+    return keep['v'].to_numpy()
 
-def main():
-    root = os.getcwd()
-    handout = os.path.join(root, 'handout_from DS_agent')
-    src_train = os.path.join(handout, 'data_sample', 'train.csv')
 
+def as_time(values) -> np.ndarray:
+    """Numeric epoch values pass through; anything else is parsed as datetimes (ns since epoch)."""
+    s = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(s):
+        return s.to_numpy(dtype=float)
+    return pd.to_datetime(s, utc=True).astype('int64').to_numpy(dtype=float)
+
+
+class SplitWriter:
+    """Appends chunks to ``<name>.<fmt>.part`` and renames it on close."""
+
+    def __init__(self, path: str, fmt: str):
+        self.path = path
+        self.fmt = fmt
+        self.rows = 0
+        self._pq = None
+        self._header = True
+        if os.path.exists(path + '.part'):
+            os.unlink(path + '.part')
+
+    def write(self, df: pd.DataFrame):
+        if df.empty:
+            return
+        if self.fmt == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._pq is None:
+                self._pq = pq.ParquetWriter(self.path + '.part', table.schema, compression='zstd')
+            self._pq.write_table(table.cast(self._pq.schema))
+        else:
+            df.to_csv(self.path + '.part', mode='a', header=self._header, index=False)
+            self._header = False
+        self.rows += len(df)
+
+    def close(self, columns) -> dict:
+        if self.fmt == 'parquet' and self._pq is None:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            pq.write_table(pa.table({c: [] for c in columns}), self.path + '.part')
+        elif self.fmt == 'parquet':
+            self._pq.close()
+        elif self._header:
+            pd.DataFrame(columns=columns).to_csv(self.path + '.part', index=False)
+        os.replace(self.path + '.part', self.path)
+        return {'path': self.path, 'rows': self.rows, 'bytes': os.path.getsize(self.path),
+                'sha256': file_digest(self.path)}
+
+
+def main():
     p = argparse.ArgumentParser()
-    p.add_argument('--source', default=src_train, help='Path to full training CSV')
-    p.add_argument('--out-dir', default=os.path.join(root, 'data', 'holdout'), help='Output directory')
-    p.add_argument('--size', type=int, default=500, help='Number of rows for holdout set (from tail)')
+    p.add_argument('--source', default=os.path.join(HANDOUT, 'data_sample', 'train.csv'),
+                   help='Training CSV or .parquet')
+    p.add_argument('--out-dir', default=os.path.join(ROOT, 'data', 'holdout'), help='Output directory')
+    p.add_argument('--method', choices=['hash', 'time'], default='hash')
+    p.add_argument('--fraction', type=float, default=None, help='Holdout share of rows')
+    p.add_argument('--size', type=int, default=None,
+                   help='Approximate holdout rows instead of --fraction (costs one counting pass)')
+    p.add_argument('--seed', type=int, default=0, help='Hash seed for --method hash')
+    p.add_argument('--time-column', default=None, help='Column for --method time (epoch numbers or datetimes)')
+    p.add_argument('--cutoff', default=None,
+                   help='Rows at/after this time go to holdout (default: estimated from --fraction)')
+    p.add_argument('--stratify-bins', type=int, default=0,
+                   help='Hold out exactly --fraction of each target-quantile bin (row-order dependent)')
+    p.add_argument('--target', default='Calories')
+    p.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    p.add_argument('--chunk-size', type=int, default=100000)
     args = p.parse_args()
 
+    t_start = time.perf_counter()
     os.makedirs(args.out_dir, exist_ok=True)
+    if args.fraction is None:
+        size = 500 if args.size is None else args.size
+        total = count_rows(args.source, args.chunk_size)
+        args.fraction = min(1.0, max(1, size) / max(1, total))
+    if not 0.0 < args.fraction < 1.0:
+        raise SystemExit('--fraction must be in (0, 1)')
 
-    df = pd.read_csv(args.source)
-    n = len(df)
-    k = max(1, min(args.size, n - 1))
-    holdout = df.tail(k).copy()
-    train_wo = df.head(n - k).copy()
+    params = {'method': args.method, 'fraction': args.fraction, 'seed': args.seed}
+    cutoff = None
+    if args.method == 'time':
+        if not args.time_column:
+            raise SystemExit('--method time needs --time-column')
+        if args.cutoff is not None:
+            cutoff = float(as_time([args.cutoff])[0]) if not args.cutoff.replace('.', '', 1).isdigit() \
+                else float(args.cutoff)
+        else:
+            cutoff = float(np.quantile(as_time(bottom_k_sample(args.source, args.time_column, args.chunk_size,
+                                                               args.seed)), 1.0 - args.fraction))
+        params.update(time_column=args.time_column, cutoff=cutoff)
+    edges = None
+    if args.stratify_bins > 1:
+        if args.method != 'hash':
+            raise SystemExit('--stratify-bins applies to --method hash')
+        sample = bottom_k_sample(args.source, args.target, args.chunk_size, args.seed)
+        edges = np.unique(np.quantile(sample, np.linspace(0, 1, args.stratify_bins + 1)[1:-1]))
+        params.update(stratify_bins=args.stratify_bins, strata_edges=edges.tolist())
+        seen = np.zeros(len(edges) + 1, dtype=np.int64)
+        held = np.zeros(len(edges) + 1, dtype=np.int64)
 
-    # Save files with expected names for train.py
-    train_path = os.path.join(args.out_dir, 'train.csv')
-    holdout_path = os.path.join(args.out_dir, 'holdout.csv')
-    train_wo.to_csv(train_path, index=False)
-    holdout.to_csv(holdout_path, index=False)
+    ext = 'parquet' if args.format == 'parquet' else 'csv'
+    train_w = SplitWriter(os.path.join(args.out_dir, f'train.{ext}'), args.format)
+    hold_w = SplitWriter(os.path.join(args.out_dir, f'holdout.{ext}'), args.format)
+    columns = None
+    for chunk in iter_chunks(args.source, args.chunk_size):
+        columns = list(chunk.columns)
+        if args.method == 'time':
+            in_holdout = as_time(chunk[args.time_column].to_numpy()) >= cutoff
+        elif edges is None:
+            in_holdout = id_hash_unit(chunk['id'].to_numpy(), args.seed) < args.fraction
+        else:
+            # systematic sampling per stratum: the k-th row of a stratum is held out when
+            # floor(f * k) steps, so every stratum ends within one row of f * n_s; rows are
+            # visited in hash order within the chunk so the choice still depends on the id
+            strata = np.searchsorted(edges, chunk[args.target].to_numpy(), side='right')
+            order = np.argsort(id_hash_unit(chunk['id'].to_numpy(), args.seed), kind='stable')
+            in_holdout = np.zeros(len(chunk), dtype=bool)
+            for s in range(len(seen)):
+                rows = order[strata[order] == s]
+                k = seen[s] + np.arange(1, len(rows) + 1)
+                take = np.floor(k * args.fraction) > np.floor((k - 1) * args.fraction)
+                in_holdout[rows[take]] = True
+                seen[s] += len(rows)
+                held[s] += int(take.sum())
+        hold_w.write(chunk[in_holdout])
+        train_w.write(chunk[~in_holdout])
+    if columns is None:
+        raise SystemExit(f'No rows in {args.source}')
+    outputs = {'train': train_w.close(columns), 'holdout': hold_w.close(columns)}
 
-    print(f'Wrote train (no holdout) to {train_path} ({len(train_wo)} rows)')
-    print(f'Wrote holdout to {holdout_path} ({len(holdout)} rows)')
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    manifest = {
+        'created': time.time(),
+        'source': {'path': os.path.abspath(args.source), 'bytes': os.path.getsize(args.source),
+                   'sha256': file_digest(args.source)},
+        'params': params,
+        'rows': {'train': train_w.rows, 'holdout': hold_w.rows, 'total': train_w.rows + hold_w.rows},
+        'outputs': outputs,
+        'wall_time_sec': time.perf_counter() - t_start,
+        'peak_rss_mb': peak_rss_mb,
+    }
+    if edges is not None:
+        manifest['strata'] = {'rows': seen.tolist(), 'holdout': held.tolist()}
+    with open(os.path.join(args.out_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f'Wrote train (no holdout) to {outputs["train"]["path"]} ({train_w.rows} rows)')
+    print(f'Wrote holdout to {outputs["holdout"]["path"]} ({hold_w.rows} rows)')
+    print(f'method={args.method} fraction={args.fraction:.4f} wall_time_sec={manifest["wall_time_sec"]:.1f} '
+          f'peak_rss_mb={peak_rss_mb:.0f}')
 
 
 if __name__ == '__main__':
     main()
-
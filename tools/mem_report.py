@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""Per-process unique vs shared memory of the service, from /proc/<pid>/smaps_rollup.
+
+RSS counts a page shared by N forked workers N times. USS (private pages) is what a
+process would free on exit; PSS splits every shared page evenly between its users,
+so the PSS sum over the process tree is the real footprint a cgroup limit sees.
+
+  --pid PID       report a running service tree (uvicorn or service/preload.py parent)
+  --compare N     start `uvicorn --workers N` and `service.preload --workers N` in turn,
+                  send warm-up traffic and print both trees side by side
+"""
+import argparse
+import json
+import os
+import random
+from typing import Dict
+
+import httpx
+
+from capacity_sweep import free_port, process_tree, start_service, stop_service, wait_healthy
+from stress_burst import PayloadSource, default_data_path
+
+FIELDS = ("Rss", "Pss", "Private_Clean", "Private_Dirty", "Shared_Clean", "Shared_Dirty", "Anonymous", "Swap")
+
+
+def smaps_rollup(pid: int) -> Dict[str, int]:
+    """Bytes per smaps_rollup field (kernel >= 4.14); empty if the process is gone."""
+    out = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in FIELDS:
+                    out[key] = int(rest.split()[0]) * 1024
+    except (OSError, ValueError):
+        return {}
+    return out
+
+
+def cmdline(pid: int) -> str:
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return f.read().replace(b"\0", b" ").decode(errors="replace").strip()
+    except OSError:
+        return ""
+
+
+def memory_table(root: int) -> dict:
+    rows = []
+    for pid in process_tree(root):
+        m = smaps_rollup(pid)
+        if not m:
+            continue
+        cmd = cmdline(pid)
+        # uvicorn's spawn-based supervisor also runs multiprocessing's resource tracker
+        role = "parent" if pid == root else "helper" if "resource_tracker" in cmd else "worker"
+        rows.append({
+            "pid": pid,
+            "role": role,
+            "rss": m.get("Rss", 0),
+            "pss": m.get("Pss", 0),
+            "uss": m.get("Private_Clean", 0) + m.get("Private_Dirty", 0),
+            "shared": m.get("Shared_Clean", 0) + m.get("Shared_Dirty", 0),
+            "anon": m.get("Anonymous", 0),
+            "swap": m.get("Swap", 0),
+        })
+    totals = {k: sum(r[k] for r in rows) for k in ("rss", "pss", "uss", "shared", "swap")}
+    return {"root": root, "cmdline": cmdline(root), "processes": rows, "totals": totals}
+
+
+def print_table(title: str, table: dict):
+    mib = 1 << 20
+    print(f"{title}: {table['cmdline']}")
+    print(f"  {'pid':>7s} {'role':7s} {'RSS':>8s} {'PSS':>8s} {'USS':>8s} {'shared':>8s} {'anon':>8s}  (MiB)")
+    for r in table["processes"]:
+        print(f"  {r['pid']:7d} {r['role']:7s} {r['rss'] / mib:8.1f} {r['pss'] / mib:8.1f} {r['uss'] / mib:8.1f} "
+              f"{r['shared'] / mib:8.1f} {r['anon'] / mib:8.1f}")
+    t = table["totals"]
+    print(f"  {'total':15s} {t['rss'] / mib:8.1f} {t['pss'] / mib:8.1f} {t['uss'] / mib:8.1f} {t['shared'] / mib:8.1f}")
+
+
+def warm_up(url: str, n: int, seed: int):
+    # every worker must have served predictions, so lazily touched pages show up as private
+    source = PayloadSource(default_data_path(), 0.0, random.Random(seed), limit=max(n, 1))
+    with httpx.Client(base_url=url, timeout=10.0) as client:
+        for _ in range(n):
+            client.post("/predict", json=source.next())
+
+
+def measure_mode(preload: bool, args) -> dict:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    log_path = os.path.join(args.out_dir, f"mem-{'preload' if preload else 'uvicorn'}.log")
+    proc = start_service(args.compare, args.threads, {}, port, log_path, preload=preload)
+    try:
+        if not wait_healthy(url, proc, args.startup_timeout):
+            raise SystemExit(f"Service did not become healthy; see {log_path}")
+        warm_up(url, args.requests, args.seed)
+        return memory_table(proc.pid)
+    finally:
+        stop_service(proc)
+
+
+def main():
+    p = argparse.ArgumentParser()
+    g = p.add_mutually_exclusive_group(required=True)
+    g.add_argument("--pid", type=int, help="Root pid of a running service")
+    g.add_argument("--compare", type=int, metavar="N", help="Start both launch modes with N workers and compare")
+    p.add_argument("--threads", type=int, default=1, help="OMP/MKL/XGBOOST_NUM_THREADS for --compare")
+    p.add_argument("--requests", type=int, default=200, help="Warm-up predictions per mode before measuring")
+    p.add_argument("--startup-timeout", type=float, default=60.0)
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--out-dir", default=os.path.join("data", "capacity"))
+    p.add_argument("--report", default=None, help="Write the JSON report here")
+    args = p.parse_args()
+
+    report: Dict[str, object] = {}
+    if args.pid:
+        report["service"] = memory_table(args.pid)
+        print_table("service", report["service"])
+    else:
+        os.makedirs(args.out_dir, exist_ok=True)
+        for name, preload in (("uvicorn", False), ("preload", True)):
+            report[name] = measure_mode(preload, args)
+            print_table(f"{name} --workers {args.compare}", report[name])
+        base, pre = report["uvicorn"]["totals"], report["preload"]["totals"]
+        report["pss_saved_bytes"] = base["pss"] - pre["pss"]
+        print(f"\nPSS total: uvicorn {base['pss'] / (1 << 20):.1f} MiB -> preload {pre['pss'] / (1 << 20):.1f} MiB "
+              f"({(base['pss'] - pre['pss']) / (1 << 20):+.1f} MiB saved)")
+    if args.report:
+        os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote report to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""Replay a traffic capture (service CAPTURE_DIR) against a URL or the in-process ASGI app.
+
+Events are re-issued in capture order with their original gaps divided by ``--speed``
+(``--speed max`` sends as fast as ``--concurrency`` allows). A feedback for an id waits
+until the replayed predict for that id has answered, so joins see the same dependency
+as in production. Paced replays measure latency from the intended send time.
+"""
+import argparse
+import asyncio
+import glob
+import gzip
+import json
+import math
+import os
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from stress_burst import LatencyHistogram, error_class, load_service_app
+
+PREDICT_FIELDS = ("id", "Gender", "Sex", "Age", "Height", "Weight", "Duration", "Heart_Rate", "Body_Temp")
+# gauges/counters reported back from the target's /metrics after the replay
+SERVICE_METRICS = ("app_rolling_rmsle_5m", "app_rolling_mae_5m", "app_feedback_coverage_5m",
+                   "app_rolling_late_rmsle_5m", "app_feedback_joins_total")
+
+
+def capture_files(paths: List[str]) -> List[str]:
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            files += glob.glob(os.path.join(p, "capture-*.ndjson.gz")) + glob.glob(os.path.join(p, "capture-*.parquet"))
+        else:
+            files.append(p)
+    if not files:
+        raise SystemExit(f"No capture segments found in {paths} (in-progress .part files are skipped)")
+    return sorted(files)
+
+
+def read_capture(files: List[str]) -> List[dict]:
+    events = []
+    for path in files:
+        if path.endswith(".parquet"):
+            import pyarrow.parquet as pq
+            events += pq.read_table(path).to_pylist()
+        else:
+            with gzip.open(path, "rt") as f:
+                events += [json.loads(line) for line in f if line.strip()]
+    # several workers write separate segments; merge them on arrival time (stable within a file)
+    events.sort(key=lambda e: e["ts"])
+    return events
+
+
+def to_request(event: dict, id_offset: int):
+    rec_id = int(event["id"]) + id_offset
+    if event["kind"] == "predict":
+        body = {k: event[k] for k in PREDICT_FIELDS if event.get(k) is not None}
+        body["id"] = rec_id
+        return "/predict", body
+    # ts_true is dropped: the service stamps feedback on arrival, so the replayed gap is the lag
+    return "/feedback", {"id": rec_id, "Calories": float(event["Calories"])}
+
+
+def parse_service_metrics(text: str) -> Dict[str, float]:
+    from prometheus_client.parser import text_string_to_metric_families
+    out = {}
+    for family in text_string_to_metric_families(text):
+        for sample in family.samples:
+            if sample.name in SERVICE_METRICS:
+                key = sample.name + "".join(f"{{{k}={v}}}" for k, v in sorted(sample.labels.items()))
+                out[key] = sample.value
+    return out
+
+
+class Replay:
+    def __init__(self, client: httpx.AsyncClient, events: List[dict], args):
+        self.client = client
+        self.events = events
+        self.args = args
+        self.speed = math.inf if args.speed == "max" else float(args.speed)
+        self.sem = asyncio.Semaphore(args.concurrency)
+        self.latency = {"predict": LatencyHistogram(), "feedback": LatencyHistogram()}
+        self.counts = {"predict": {"ok": 0}, "feedback": {"ok": 0}}
+        self.pending_predict: Dict[int, asyncio.Task] = {}  # id -> replayed predict still in flight
+        self.predictions: Dict[int, float] = {}
+        self.sq_log_err: List[float] = []
+        self.max_lag = 0.0
+        self.responses: List[Optional[dict]] = [None] * len(events)  # by capture position
+
+    def _count(self, kind: str, cls: str):
+        self.counts[kind][cls] = self.counts[kind].get(cls, 0) + 1
+
+    async def send(self, seq: int, path: str, body: dict, intended: float, depends: Optional[asyncio.Task]):
+        kind = path.strip("/")
+        if depends is not None:
+            await asyncio.gather(depends, return_exceptions=True)
+            intended = max(intended, time.perf_counter())  # the wait is the capture's own dependency
+        async with self.sem:
+            if self.speed == math.inf:
+                intended = time.perf_counter()  # no schedule to fall behind: service time only
+            try:
+                r = await self.client.post(path, json=body)
+                cls = "ok" if r.status_code == 200 else f"http_{r.status_code}"
+            except Exception as e:  # noqa: BLE001 - every failure is a data point
+                cls, r = error_class(e), None
+        self.latency[kind].record(time.perf_counter() - intended)
+        self._count(kind, cls)
+        self.responses[seq] = {"seq": seq, "path": path, "request": body, "result": cls,
+                               "response": r.json() if r is not None else None}
+        if cls != "ok":
+            return
+        if kind == "predict":
+            self.predictions[body["id"]] = float(r.json()["Calories"])
+        elif body["id"] in self.predictions:
+            # what the target model scores on the captured labels, independent of its windows
+            self.sq_log_err.append((math.log1p(body["Calories"]) - math.log1p(self.predictions[body["id"]])) ** 2)
+
+    async def run(self) -> float:
+        inflight = set()
+        t0_capture = self.events[0]["ts"]
+        start = time.perf_counter()
+        for seq, event in enumerate(self.events):
+            path, body = to_request(event, self.args.id_offset)
+            if self.speed == math.inf:
+                intended = 0.0  # set when the request goes on the wire
+                # closed loop: keep a bounded number of tasks instead of scheduling the whole capture
+                while len(inflight) >= 4 * self.args.concurrency:
+                    _, inflight = await asyncio.wait(inflight, return_when=asyncio.FIRST_COMPLETED)
+            else:
+                intended = start + (event["ts"] - t0_capture) / self.speed
+                delay = intended - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    self.max_lag = max(self.max_lag, -delay)
+            depends = self.pending_predict.get(body["id"]) if path == "/feedback" else None
+            task = asyncio.create_task(self.send(seq, path, body, intended, depends))
+            inflight.add(task)
+            task.add_done_callback(inflight.discard)
+            if path == "/predict":
+                rid = body["id"]
+                self.pending_predict[rid] = task
+                task.add_done_callback(lambda t, rid=rid: self.pending_predict.pop(rid, None)
+                                       if self.pending_predict.get(rid) is t else None)
+        if inflight:
+            await asyncio.wait(inflight)
+        return time.perf_counter() - start
+
+
+async def replay(client: httpx.AsyncClient, events: List[dict], args) -> dict:
+    runner = Replay(client, events, args)
+    elapsed = await runner.run()
+    # the service refreshes its rolling gauges on a background tick; give it one before scraping
+    await asyncio.sleep(args.settle)
+    try:
+        service = parse_service_metrics((await client.get("/metrics")).text)
+    except Exception as e:  # noqa: BLE001
+        service = {"error": str(e)}
+    span = events[-1]["ts"] - events[0]["ts"]
+    n_sq = len(runner.sq_log_err)
+    n_feedback = sum(1 for e in events if e["kind"] == "feedback")
+    return {
+        "events": len(events),
+        "capture_span_s": span,
+        "speed": args.speed,
+        "elapsed_s": elapsed,
+        "achieved_rps": len(events) / elapsed if elapsed else 0.0,
+        "max_schedule_lag_s": runner.max_lag,
+        "requests": runner.counts,
+        "latency_s": {k: h.summary() for k, h in runner.latency.items()},
+        "client": {
+            "rmsle": math.sqrt(sum(runner.sq_log_err) / n_sq) if n_sq else None,
+            "feedback_with_prediction": n_sq,
+            "coverage": n_sq / n_feedback if n_feedback else None,
+        },
+        "service": service,
+        "responses": runner.responses,
+    }
+
+
+async def replay_url(events: List[dict], args) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    timeout = httpx.Timeout(args.timeout, pool=None)
+    async with httpx.AsyncClient(base_url=args.url.rstrip("/"), limits=limits, timeout=timeout) as client:
+        return await replay(client, events, args)
+
+
+async def replay_asgi(events: List[dict], args) -> dict:
+    module = load_service_app()
+    try:
+        transport = httpx.ASGITransport(app=module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=args.timeout) as client:
+            return await replay(client, events, args)
+    finally:
+        module._shutdown()
+
+
+def parse_args():
+    p = argparse.ArgumentParser()
+    p.add_argument("capture", nargs="+", help="Capture directory (CAPTURE_DIR) and/or segment files")
+    p.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL of API (ignored in --asgi mode)")
+    p.add_argument("--asgi", action="store_true", help="Replay against the in-process ASGI app (no network)")
+    p.add_argument("--speed", default="1", help="Time compression factor (1, 10, ...) or 'max'")
+    p.add_argument("--concurrency", type=int, default=64, help="Max requests on the wire")
+    p.add_argument("--timeout", type=float, default=10.0, help="Per-request timeout")
+    p.add_argument("--limit", type=int, default=0, help="Replay only the first N events (0=all)")
+    p.add_argument("--id-offset", type=int, default=0, help="Added to every id, to replay into a warm service")
+    p.add_argument("--settle", type=float, default=2.0, help="Seconds to wait before scraping /metrics")
+    p.add_argument("--report", default=None, help="Write the JSON report here")
+    p.add_argument("--responses", default=None,
+                   help="Write every replayed request and its response as NDJSON, in capture order")
+    args = p.parse_args()
+    if args.speed != "max" and float(args.speed) <= 0:
+        raise SystemExit("--speed must be > 0 or 'max'")
+    return args
+
+
+def main():
+    args = parse_args()
+    events = read_capture(capture_files(args.capture))
+    if args.limit > 0:
+        events = events[: args.limit]
+    if not events:
+        raise SystemExit("Capture is empty")
+    report = asyncio.run(replay_asgi(events, args) if args.asgi else replay_url(events, args))
+    report["target"] = "asgi" if args.asgi else args.url
+    responses = report.pop("responses")
+
+    print(f"events={report['events']} capture_span_s={report['capture_span_s']:.1f} speed={args.speed} "
+          f"elapsed_s={report['elapsed_s']:.1f} achieved_rps={report['achieved_rps']:.1f}")
+    for kind, counts in report["requests"].items():
+        lat = report["latency_s"][kind]
+        print(f"{kind}: {counts} latency_p50={lat['p50']:.4f}s latency_p99={lat['p99']:.4f}s")
+    client = report["client"]
+    if client["rmsle"] is not None:
+        print(f"client rmsle={client['rmsle']:.5f} coverage={client['coverage']:.3f}")
+    print("service " + " ".join(f"{k}={v}" for k, v in report["service"].items()))
+    if args.report:
+        os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote report to {args.report}")
+    if args.responses:
+        os.makedirs(os.path.dirname(os.path.abspath(args.responses)), exist_ok=True)
+        with open(args.responses, "w") as f:
+            for rec in responses:
+                f.write(json.dumps(rec) + "\n")
+        print(f"Wrote {len(responses)} responses to {args.responses}")
+
+
+if __name__ == "__main__":
+    main()
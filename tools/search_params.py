@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""Parallel hyperparameter search over the model.* / train.* keys of config.yaml.
+
+The transformed train/valid matrices are built once (via train.py's feature cache) and
+memory-mapped by every worker, which builds its DMatrix pair once and reuses it for all
+of its trials. Each trial trains with a fixed nthread so ``workers * threads`` fills the
+machine. Trials are pruned when their valid RMSE falls behind the best finished trial's
+curve at the same shrinkage budget (``eta * rounds``, so a low-eta trial is compared with
+the reference's earlier rounds); early stopping uses the config's ``early_stopping_rounds``.
+
+Space file (YAML), keys are dotted config paths:
+
+    model.eta: {loguniform: [0.01, 0.2]}
+    model.max_depth: [5, 7, 9]              # list = grid axis / uniform choice
+    model.subsample: {uniform: [0.6, 1.0]}
+    model.min_child_weight: {randint: [1, 10]}
+"""
+import argparse
+import copy
+import itertools
+import json
+import math
+import multiprocessing as mp
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import yaml
+
+# train.data / split keys define the shared matrices and cannot vary per trial
+SEARCHABLE_TRAIN_KEYS = {"num_boost_round", "early_stopping_rounds"}
+
+# Set once per worker by _init_worker
+_DATA = None
+_BEST_CURVE = None
+_BEST_ETA = None
+
+
+def load_space(path: str) -> dict:
+    with open(path, "r") as f:
+        space = yaml.safe_load(f) or {}
+    for key in space:
+        section, _, name = key.partition(".")
+        if section == "model" and name:
+            continue
+        if section == "train" and name in SEARCHABLE_TRAIN_KEYS:
+            continue
+        raise SystemExit(f"Cannot search {key!r}: only model.* and train.{{{','.join(sorted(SEARCHABLE_TRAIN_KEYS))}}}")
+    return space
+
+
+def sample_value(spec, rng: random.Random):
+    if isinstance(spec, list):
+        return rng.choice(spec)
+    if not isinstance(spec, dict) or len(spec) != 1:
+        return spec
+    (kind, arg), = spec.items()
+    if kind == "choice":
+        return rng.choice(arg)
+    lo, hi = arg
+    if kind == "uniform":
+        return rng.uniform(lo, hi)
+    if kind == "loguniform":
+        return math.exp(rng.uniform(math.log(lo), math.log(hi)))
+    if kind == "randint":
+        return rng.randint(lo, hi)
+    raise SystemExit(f"Unknown distribution {kind!r}")
+
+
+def grid_points(space: dict):
+    axes = []
+    for key, spec in space.items():
+        if isinstance(spec, dict) and set(spec) == {"choice"}:
+            spec = spec["choice"]
+        if not isinstance(spec, list):
+            raise SystemExit(f"Grid search needs a list of values for {key!r}")
+        axes.append([(key, v) for v in spec])
+    return [dict(combo) for combo in itertools.product(*axes)]
+
+
+def random_points(space: dict, n: int, seed: int):
+    rng = random.Random(seed)
+    return [{k: sample_value(spec, rng) for k, spec in space.items()} for _ in range(n)]
+
+
+def apply_params(cfg: dict, params: dict) -> dict:
+    out = copy.deepcopy(cfg)
+    for key, value in params.items():
+        section, name = key.split(".", 1)
+        out[section][name] = value
+    return out
+
+
+def _init_worker(handout: str, entry_dir: str, best_curve, best_eta, threads: int):
+    global _DATA, _BEST_CURVE, _BEST_ETA
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    sys.path.insert(0, handout)
+    import xgboost as xgb
+    from feature_cache import load_entry
+
+    entry = load_entry(entry_dir)
+    arrays, names = entry["arrays"], entry["feature_names"]
+    _DATA = (
+        xgb.DMatrix(arrays["X_train"], label=arrays["y_train"], feature_names=names, nthread=threads),
+        xgb.DMatrix(arrays["X_valid"], label=arrays["y_valid"], feature_names=names, nthread=threads),
+    )
+    _BEST_CURVE = best_curve
+    _BEST_ETA = best_eta
+
+
+def _make_pruner(warmup: int, tolerance: float, eta: float):
+    import xgboost as xgb
+
+    class CurvePruner(xgb.callback.TrainingCallback):
+        """Stops a trial whose valid RMSE trails the best finished trial's curve by more than ``tolerance``."""
+
+        def __init__(self):
+            super().__init__()
+            self.curve = []
+            self.pruned = False
+
+        def after_iteration(self, model, epoch, evals_log):
+            score = evals_log["valid"]["rmse"][-1]
+            self.curve.append(score)
+            if warmup <= 0 or epoch < warmup:
+                return False
+            # same lock as the writer, so the curve and its eta always come from one trial
+            with _BEST_CURVE.get_lock():
+                ref_eta = _BEST_ETA.value
+                if ref_eta <= 0:
+                    return False
+                # early rounds are dominated by the learning rate; compare at equal eta * rounds
+                ref_epoch = int(epoch * eta / ref_eta)
+                ref = _BEST_CURVE[ref_epoch] if ref_epoch < len(_BEST_CURVE) else float("inf")
+            if score > ref * (1.0 + tolerance):
+                self.pruned = True
+                return True
+            return False
+
+    return CurvePruner()
+
+
+def run_trial(trial_id: int, cfg: dict, params: dict, threads: int, prune_warmup: int,
+              prune_tolerance: float) -> dict:
+    import xgboost as xgb
+    from train import booster_params
+
+    dtr, dval = _DATA
+    xgb_params = dict(booster_params(cfg), nthread=threads)
+    pruner = _make_pruner(prune_warmup, prune_tolerance, xgb_params["eta"])
+    t0 = time.perf_counter()
+    booster = xgb.train(
+        xgb_params,
+        dtr,
+        num_boost_round=cfg["train"]["num_boost_round"],
+        evals=[(dval, "valid")],
+        early_stopping_rounds=cfg["train"]["early_stopping_rounds"],
+        callbacks=[pruner],
+        verbose_eval=False,
+    )
+    seconds = time.perf_counter() - t0
+    if not pruner.pruned:
+        # the reference is the whole curve of the best finished trial, not a per-round minimum
+        # across trials: that envelope follows fast high-eta starts and prunes slow, better configs
+        with _BEST_CURVE.get_lock():
+            if min(pruner.curve) < min(_BEST_CURVE):
+                curve = pruner.curve[:len(_BEST_CURVE)]
+                # rounds past its early stop stay inf, so nothing is pruned there
+                _BEST_CURVE[:] = curve + [float("inf")] * (len(_BEST_CURVE) - len(curve))
+                _BEST_ETA.value = xgb_params["eta"]
+    return {
+        "trial": trial_id,
+        "params": params,
+        "status": "pruned" if pruner.pruned else "ok",
+        # labels are log1p(Calories), so valid RMSE is RMSLE
+        "valid_rmsle": float(booster.best_score),
+        "best_iteration": int(booster.best_iteration),
+        "rounds": len(pruner.curve),
+        "budget": cfg["train"]["num_boost_round"],
+        "seconds": round(seconds, 3),
+        "nthread": threads,
+        "pid": os.getpid(),
+    }
+
+
+class Leaderboard:
+    """Appends one JSON line per trial; optionally mirrors trials as nested MLflow runs."""
+
+    def __init__(self, path: str, strategy: str, use_mlflow: bool):
+        self.path = path
+        self.strategy = strategy
+        self.results = []
+        self._mlflow = None
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        if use_mlflow:
+            import mlflow
+            self._mlflow = mlflow
+            mlflow.start_run(run_name=f"search-{strategy}")
+
+    def add(self, result: dict):
+        result = dict(result, strategy=self.strategy, ts=time.time())
+        self.results.append(result)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(result) + "\n")
+        if self._mlflow is not None and result["status"] != "error":
+            with self._mlflow.start_run(run_name=f"trial-{result['trial']}", nested=True):
+                self._mlflow.log_params(result["params"])
+                self._mlflow.log_metrics({
+                    "valid_rmsle": result["valid_rmsle"],
+                    "best_iteration": result["best_iteration"],
+                    "train_seconds": result["seconds"],
+                    "pruned": float(result["status"] == "pruned"),
+                })
+
+    def best(self):
+        ok = [r for r in self.results if r["status"] == "ok"]
+        return min(ok, key=lambda r: r["valid_rmsle"]) if ok else None
+
+    def close(self):
+        if self._mlflow is not None:
+            best = self.best()
+            if best is not None:
+                self._mlflow.log_metric("best_valid_rmsle", best["valid_rmsle"])
+            self._mlflow.end_run()
+
+
+def run_batch(pool, trials, threads, prune_warmup, prune_tolerance, board: Leaderboard, extra=None):
+    """Run (trial_id, cfg, params) tuples; each result hits the leaderboard as it completes."""
+    results = []
+
+    def record(r):
+        r.update(extra or {})
+        board.add(r)
+        results.append(r)
+        if r["status"] == "error":
+            print(f"trial={r['trial']} status=error error={r['error']}", flush=True)
+        else:
+            print(f"trial={r['trial']} status={r['status']} valid_rmsle={r['valid_rmsle']:.5f} "
+                  f"best_iter={r['best_iteration']} rounds={r['rounds']} seconds={r['seconds']:.1f} "
+                  f"params={json.dumps(r['params'])}", flush=True)
+
+    if pool is None:
+        for trial_id, cfg, params in trials:
+            try:
+                record(run_trial(trial_id, cfg, params, threads, prune_warmup, prune_tolerance))
+            except Exception as e:  # keep searching; the failure is on the leaderboard
+                record({"trial": trial_id, "params": params, "status": "error", "error": str(e)})
+        return results
+    futures = {pool.submit(run_trial, trial_id, cfg, params, threads, prune_warmup, prune_tolerance):
+               (trial_id, params) for trial_id, cfg, params in trials}
+    for fut in as_completed(futures):
+        trial_id, params = futures[fut]
+        try:
+            record(fut.result())
+        except Exception as e:
+            record({"trial": trial_id, "params": params, "status": "error", "error": str(e)})
+    return results
+
+
+def main():
+    root = os.getcwd()
+    handout = os.path.join(root, "handout_from DS_agent")
+    p = argparse.ArgumentParser()
+    p.add_argument("--space", required=True, help="YAML parameter space (see module docstring)")
+    p.add_argument("--strategy", choices=["grid", "random", "halving"], default="random")
+    p.add_argument("--trials", type=int, default=20, help="Sampled configs for random/halving")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--config", default=os.path.join(handout, "config.yaml"))
+    p.add_argument("--data-dir", default=os.path.join(handout, "data_sample"))
+    p.add_argument("--workers", type=int, default=0, help="Trial processes (0=cpu_count/threads)")
+    p.add_argument("--threads", type=int, default=1, help="XGBoost threads per trial")
+    p.add_argument("--prune-warmup", type=int, default=50,
+                   help="Rounds before curve pruning applies (0=off; off for halving)")
+    p.add_argument("--prune-tolerance", type=float, default=0.02,
+                   help="Prune when valid RMSE exceeds the best curve by this fraction")
+    p.add_argument("--min-rounds", type=int, default=100, help="Halving: rounds for the first rung")
+    p.add_argument("--factor", type=int, default=3, help="Halving: keep 1/factor, multiply rounds by factor")
+    p.add_argument("--leaderboard", default=os.path.join(root, "data", "search", "leaderboard.jsonl"))
+    p.add_argument("--best-config", default=None, help="Write config.yaml with the best params here")
+    p.add_argument("--feature-cache-dir", default=os.getenv("FEATURE_CACHE_DIR"),
+                   help="Feature cache shared with train.py (default: $FEATURE_CACHE_DIR or a temp dir)")
+    p.add_argument("--mlflow", action="store_true", help="Also log trials as nested MLflow runs")
+    args = p.parse_args()
+
+    sys.path.insert(0, handout)
+    from feature_cache import FeatureCache
+    from train import build_feature_arrays, feature_cache_key, load_config
+
+    cfg = load_config(args.config)
+    space = load_space(args.space)
+    if args.strategy == "grid":
+        points = grid_points(space)
+    else:
+        points = random_points(space, args.trials, args.seed)
+
+    # build (or reuse) the transformed matrices once; workers mmap the same files
+    tmp_cache = None
+    if not args.feature_cache_dir:
+        tmp_cache = tempfile.TemporaryDirectory(prefix="search-features-")
+    cache = FeatureCache(args.feature_cache_dir or tmp_cache.name, max_bytes=1 << 62)
+    train_csv = os.path.join(args.data_dir, cfg["data"]["train_csv"])
+    key = feature_cache_key(cfg, train_csv)
+    if cache.entry_path(key) is None:
+        pre, arrays = build_feature_arrays(cfg, train_csv)
+        cache.store(key, arrays, pre, pre.get_feature_names_out().tolist())
+    entry_dir = cache.entry_path(key)
+
+    workers = args.workers or max(1, (os.cpu_count() or 1) // max(1, args.threads))
+    prune_warmup = 0 if args.strategy == "halving" else args.prune_warmup
+    max_rounds = max([cfg["train"]["num_boost_round"]] +
+                     [v for pt in points for k, v in pt.items() if k == "train.num_boost_round"])
+    ctx = mp.get_context("spawn")
+    best_curve = ctx.Array("d", [float("inf")] * int(max_rounds))
+    best_eta = ctx.Value("d", 0.0, lock=False)  # written under best_curve's lock
+    print(f"strategy={args.strategy} configs={len(points)} workers={workers} threads_per_trial={args.threads} "
+          f"leaderboard={args.leaderboard}", flush=True)
+
+    board = Leaderboard(args.leaderboard, args.strategy, args.mlflow)
+    t0 = time.perf_counter()
+    pool = None
+    try:
+        if workers > 1:
+            # spawn: workers start without inherited OpenMP state
+            pool = ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_worker,
+                                       initargs=(handout, entry_dir, best_curve, best_eta, args.threads))
+        else:
+            _init_worker(handout, entry_dir, best_curve, best_eta, args.threads)
+
+        trials = [(i, apply_params(cfg, pt), pt) for i, pt in enumerate(points)]
+        if args.strategy != "halving":
+            run_batch(pool, trials, args.threads, prune_warmup, args.prune_tolerance, board)
+        else:
+            # successive halving: short budgets for everyone, longer budgets for survivors; the
+            # last rung trains every survivor to its own full train.num_boost_round
+            rounds, rung = args.min_rounds, 0
+            while trials:
+                final = len(trials) <= 1 or all(rounds >= t[1]["train"]["num_boost_round"] for t in trials)
+                rung_trials = []
+                for trial_id, tcfg, pt in trials:
+                    tcfg = copy.deepcopy(tcfg)
+                    if not final:
+                        tcfg["train"]["num_boost_round"] = min(rounds, tcfg["train"]["num_boost_round"])
+                    rung_trials.append((trial_id, tcfg, pt))
+                results = run_batch(pool, rung_trials, args.threads, 0, args.prune_tolerance, board,
+                                    extra={"rung": rung})
+                if final:
+                    break
+                ranked = sorted((r for r in results if r["status"] == "ok"), key=lambda r: r["valid_rmsle"])
+                keep = {r["trial"] for r in ranked[:max(1, len(trials) // args.factor)]}
+                trials = [t for t in trials if t[0] in keep]
+                rounds *= args.factor
+                rung += 1
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        board.close()
+        if tmp_cache is not None:
+            tmp_cache.cleanup()
+
+    dt = time.perf_counter() - t0
+    done = board.results
+    pruned = sum(r["status"] == "pruned" for r in done)
+    best = board.best()
+    print(f"trials={len(done)} pruned={pruned} errors={sum(r['status'] == 'error' for r in done)} seconds={dt:.1f}")
+    if best is None:
+        raise SystemExit("No trial finished")
+    print(f"best trial={best['trial']} valid_rmsle={best['valid_rmsle']:.5f} "
+          f"best_iter={best['best_iteration']} params={json.dumps(best['params'])}")
+    if args.best_config:
+        with open(args.best_config, "w") as f:
+            yaml.safe_dump(apply_params(cfg, best["params"]), f, sort_keys=False)
+        print(f"Wrote best config to {args.best_config}")
+
+
+if __name__ == "__main__":
+    main()
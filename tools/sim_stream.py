@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 import argparse
 import asyncio
+import heapq
+import itertools
 import os
 import time
 from typing import Optional
@@ -24,6 +26,9 @@ def parse_args():
     p.add_argument("--burst-rps", type=float, default=20.0, help="Requests per second during burst")
     p.add_argument("--burst-duration", type=float, default=5.0, help="Seconds per burst active period")
     p.add_argument("--idle-duration", type=float, default=25.0, help="Seconds per idle period between bursts")
+    p.add_argument("--time-scale", type=float, default=1.0,
+                   help="Simulated seconds per wall second; start the service with the same CLOCK_SCALE")
+    p.add_argument("--max-connections", type=int, default=32, help="Connection pool size (= sender workers)")
     return p.parse_args()
 
 
@@ -57,70 +62,153 @@ async def send_predict(client: httpx.AsyncClient, base_url: str, payload: dict)
         return None
 
 
-async def send_feedback(client: httpx.AsyncClient, base_url: str, rec_id: int, calories: float, ts_true: Optional[float] = None):
+async def send_feedback(client: httpx.AsyncClient, base_url: str, rec_id: int, calories: float, ts_true: Optional[float] = None) -> bool:
     body = {"id": int(rec_id), "Calories": float(calories)}
     if ts_true is not None:
         body["ts"] = float(ts_true)
     try:
         r = await client.post(f"{base_url}/feedback", json=body, timeout=10.0)
         r.raise_for_status()
+        return True
     except Exception as e:
         print(f"feedback error for id={rec_id}: {e}")
+        return False
 
 
-async def burst_cycle(client: httpx.AsyncClient, base_url: str, df: pd.DataFrame, start_idx: int, n_records: int, rps: float, duration: float, feedback_delay: float):
+def predict_schedule(n_total: int, cycles: int, rps: float, burst_duration: float, idle_duration: float):
+    """(sim_offset, row index) for every prediction across the burst/idle cycles."""
     inter_arrival = 1.0 / max(0.1, rps)
-    sent = 0
-    t0 = time.time()
-    while sent < n_records and (time.time() - t0) < duration:
-        idx = start_idx + sent
-        if idx >= len(df):
-            break
-        row = df.iloc[idx]
-        payload = row_to_payload(row)
-        y_true = float(row.get("Calories")) if "Calories" in row else None
-        # Fire prediction
-        asyncio.create_task(send_predict(client, base_url, payload))
-        # Schedule feedback after delay (use true timestamp of now+delay)
-        if y_true is not None:
-            async def _schedule_feedback(rid: int, yt: float):
-                await asyncio.sleep(feedback_delay)
-                await send_feedback(client, base_url, rid, yt, ts_true=time.time())
-            asyncio.create_task(_schedule_feedback(int(payload["id"]), y_true))
-
-        sent += 1
-        await asyncio.sleep(inter_arrival)
-    return sent
+    per_burst = int(rps * burst_duration)
+    idx = 0
+    for c in range(cycles):
+        cycle_start = c * (burst_duration + idle_duration)
+        for k in range(min(per_burst, n_total - idx)):
+            yield cycle_start + k * inter_arrival, idx
+            idx += 1
+        if idx >= n_total:
+            return
+
+
+class Simulator:
+    """One timer heap for every pending event, drained by a fixed pool of sender workers.
+
+    Heap entries are (due sim time, seq, kind, row index). Only the next prediction is on
+    the heap at any time, plus one entry per pending feedback; whatever is due is handed
+    to the workers as a batch. Simulated time runs ``time_scale`` times faster than wall
+    time, so delays and burst/idle periods shrink accordingly.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, base_url: str, df: pd.DataFrame, args):
+        self.client = client
+        self.base_url = base_url
+        self.df = df
+        self.args = args
+        self.scale = args.time_scale
+        self.heap = []
+        self.seq = itertools.count()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=4 * args.max_connections)
+        self.outstanding = 0  # queued or in-flight; may still push a feedback entry
+        self.wake = asyncio.Event()  # set on every push and completion so the loop re-checks
+        self.counts = {"predict_ok": 0, "predict_err": 0, "feedback_ok": 0, "feedback_err": 0, "feedback_skipped": 0}
+        self.max_lag = 0.0  # worst wall-clock lateness of a dispatched event
+
+    def sim_now(self) -> float:
+        return (time.perf_counter() - self.wall_start) * self.scale
+
+    def push(self, due: float, kind: str, idx: int):
+        heapq.heappush(self.heap, (due, next(self.seq), kind, idx))
+        self.wake.set()
+
+    async def worker(self):
+        while True:
+            kind, idx = await self.queue.get()
+            try:
+                row = self.df.iloc[idx]
+                if kind == "predict":
+                    pred = await send_predict(self.client, self.base_url, row_to_payload(row))
+                    self.counts["predict_ok" if pred is not None else "predict_err"] += 1
+                    if "Calories" not in row:
+                        continue
+                    if pred is None:
+                        self.counts["feedback_skipped"] += 1  # nothing to join against
+                    else:
+                        self.push(self.sim_now() + self.args.feedback_delay, "feedback", idx)
+                else:
+                    # at scale 1 stamp the true wall time; otherwise let the service's clock stamp it
+                    ts = time.time() if self.scale == 1 else None
+                    ok = await send_feedback(self.client, self.base_url, int(row["id"]), float(row["Calories"]), ts)
+                    self.counts["feedback_ok" if ok else "feedback_err"] += 1
+            finally:
+                self.outstanding -= 1
+                self.wake.set()
+
+    async def run(self):
+        args = self.args
+        predictions = predict_schedule(len(self.df), args.cycles, args.burst_rps, args.burst_duration,
+                                       args.idle_duration)
+        workers = [asyncio.create_task(self.worker()) for _ in range(args.max_connections)]
+        self.wall_start = time.perf_counter()
+        nxt = next(predictions, None)
+        if nxt is not None:
+            self.push(nxt[0], "predict", nxt[1])
+        last_report = 0.0
+        # runs until every prediction is sent and every feedback it spawned has been delivered
+        while self.heap or self.outstanding:
+            wait = (self.heap[0][0] - self.sim_now()) / self.scale if self.heap else None
+            if wait is None or wait > 0:
+                # sleep until the earliest entry is due or a worker pushes a new one
+                self.wake.clear()
+                try:
+                    await asyncio.wait_for(self.wake.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            now = self.sim_now()
+            while self.heap and self.heap[0][0] <= now:
+                due, _, kind, idx = heapq.heappop(self.heap)
+                self.max_lag = max(self.max_lag, (now - due) / self.scale)
+                self.outstanding += 1
+                await self.queue.put((kind, idx))
+                if kind == "predict":
+                    nxt = next(predictions, None)
+                    if nxt is not None:
+                        self.push(nxt[0], "predict", nxt[1])
+            if now - last_report >= max(10.0, args.feedback_delay / 10):
+                last_report = now
+                pending = sum(1 for e in self.heap if e[2] == "feedback")
+                print(f"sim_t={now:.0f}s {self.counts} pending_feedback={pending}")
+        for w in workers:
+            w.cancel()
+        return self.counts
 
 
 async def main_async():
     args = parse_args()
     if not os.path.exists(args.data):
         raise SystemExit(f"Simulator data not found at {args.data}. Generate holdout via: make holdout")
+    if args.time_scale <= 0:
+        raise SystemExit("--time-scale must be > 0")
     df = pd.read_csv(args.data)
     if args.limit > 0:
         df = df.iloc[: args.limit].copy()
-    total = len(df)
     base_url = args.url.rstrip("/")
 
-    async with httpx.AsyncClient() as client:
-        idx = 0
-        per_burst = int(args.burst_rps * args.burst_duration)
-        for c in range(args.cycles):
-            if idx >= total:
-                break
-            n = min(per_burst, total - idx)
-            print(f"cycle {c+1}/{args.cycles}: burst sending {n} records @ {args.burst_rps} rps for {args.burst_duration}s")
-            sent = await burst_cycle(client, base_url, df, idx, n, args.burst_rps, args.burst_duration, args.feedback_delay)
-            idx += sent
-            if idx >= total:
-                break
-            idle = args.idle_duration
-            print(f"cycle {c+1}: idle for {idle}s")
-            await asyncio.sleep(idle)
-        # Wait a short grace period for outstanding feedback tasks (not full delay)
-        print("simulation complete; waiting 2s for in-flight tasks")
-        await asyncio.sleep(2.0)
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(limits=limits) as client:
+        if args.time_scale != 1:
+            try:
+                service_scale = (await client.get(f"{base_url}/healthz", timeout=5.0)).json().get("clock_scale", 1.0)
+            except Exception:
+                service_scale = None
+            if service_scale != args.time_scale:
+                print(f"warning: service CLOCK_SCALE={service_scale} but --time-scale={args.time_scale}; "
+                      f"rolling metrics will not match the simulated timeline")
+        sim_span = args.cycles * (args.burst_duration + args.idle_duration) + args.feedback_delay
+        print(f"simulating {len(df)} records over ~{sim_span:.0f}s sim time "
+              f"(~{sim_span / args.time_scale:.0f}s wall at --time-scale {args.time_scale})")
+        sim = Simulator(client, base_url, df, args)
+        counts = await sim.run()
+    print(f"simulation complete: {counts} max_dispatch_lag_s={sim.max_lag:.3f}")
 
 
 def main():
@@ -1,86 +1,303 @@
 #!/usr/bin/env python3
+"""Open-loop load generator for /predict.
+
+Requests are issued on a precomputed schedule regardless of how fast the service
+answers, and latency is measured from the *intended* send time, so a stalled server
+shows up as latency instead of silently lowering the offered rate (coordinated
+omission). Latencies go into fixed-memory log-linear histograms; payloads are drawn
+from a labelled CSV with a configurable share of repeated ids.
+"""
 import argparse
 import asyncio
+import json
+import math
 import os
 import random
-import statistics
 import time
-from typing import List, Optional
+from typing import Dict, Iterator, List, Optional
 
 import httpx
+import numpy as np
+import pandas as pd
+
+
+class LatencyHistogram:
+    """HDR-style histogram: 2**sub_bits linear sub-buckets per power of two.
+
+    Memory is fixed by the (lowest, highest) range, relative error is ~1/2**sub_bits,
+    and values above ``highest`` land in the last bucket (``max`` stays exact).
+    """
+
+    def __init__(self, lowest: float = 1e-6, highest: float = 120.0, sub_bits: int = 7):
+        self.lowest = lowest
+        self.sub = 1 << sub_bits
+        n_exp = int(math.ceil(math.log2(highest / lowest))) + 1
+        self.counts = np.zeros(n_exp * self.sub, dtype=np.int64)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def _index(self, value: float) -> int:
+        m, e = math.frexp(max(value / self.lowest, 1.0))  # value/lowest = (2m) * 2**(e-1), 2m in [1, 2)
+        idx = (e - 1) * self.sub + int((2.0 * m - 1.0) * self.sub)
+        return min(idx, len(self.counts) - 1)
+
+    def _value(self, idx: int) -> float:
+        e, sub = divmod(idx, self.sub)
+        return self.lowest * (2.0 ** e) * (1.0 + (sub + 0.5) / self.sub)
+
+    def record(self, value: float):
+        self.counts[self._index(value)] += 1
+        self.total += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        if self.total == 0:
+            return 0.0
+        rank = max(1, int(math.ceil(q * self.total)))
+        idx = int(np.searchsorted(np.cumsum(self.counts), rank))
+        return min(self._value(idx), self.max)
+
+    def summary(self) -> Dict[str, float]:
+        out = {name: self.quantile(q) for name, q in
+               (("p50", 0.5), ("p90", 0.9), ("p95", 0.95), ("p99", 0.99), ("p999", 0.999))}
+        out.update(count=self.total, mean=self.sum / self.total if self.total else 0.0, max=self.max)
+        return out
+
+
+# --------------------
+# Load profiles
+# --------------------
+def parse_steps(spec: str) -> List[tuple]:
+    """'50:10,200:5' -> [(50.0, 10.0), (200.0, 5.0)] as (rps, seconds)."""
+    steps = []
+    for part in spec.split(","):
+        if part.strip():
+            rps, secs = part.split(":")
+            steps.append((float(rps), float(secs)))
+    if not steps:
+        raise SystemExit("--steps needs at least one RPS:SECONDS entry")
+    return steps
+
+
+def rate_fn(args):
+    if args.profile == "constant":
+        return lambda t: args.rps
+    if args.profile == "ramp":
+        return lambda t: args.start_rps + (args.rps - args.start_rps) * min(1.0, t / args.duration)
+    if args.profile == "step":
+        steps = parse_steps(args.steps)
+
+        def step(t):
+            for rps, secs in steps:
+                if t < secs:
+                    return rps
+                t -= secs
+            return steps[-1][0]  # hold the last level for the rest of --duration
+        return step
+    if args.profile == "burst":
+        def burst(t):
+            return args.burst_rps if (t % args.burst_every) < args.burst_duration else args.rps
+        return burst
+    raise SystemExit(f"unknown profile {args.profile}")
+
+
+def schedule(rate, duration: float, poisson: bool, rng: random.Random) -> Iterator[float]:
+    """Intended send offsets (seconds from start) for an arbitrary rate(t)."""
+    t = 0.0
+    while t < duration:
+        r = rate(t)
+        if r <= 0:
+            t += 0.1  # idle step: nothing issued, re-check the rate shortly
+            continue
+        yield t
+        # round to 1ns: summed 1/r gaps drift below profile boundaries (10 x 0.1 < 1.0)
+        t = round(t + (rng.expovariate(r) if poisson else 1.0 / r), 9)
+
+
+# --------------------
+# Payloads
+# --------------------
+def default_data_path() -> str:
+    root = os.getcwd()
+    holdout = os.path.join(root, "data", "holdout", "holdout.csv")
+    return holdout if os.path.exists(holdout) else os.path.join(root, "handout_from DS_agent", "data_sample", "train.csv")
+
+
+class PayloadSource:
+    """Cycles through CSV rows; ``repeat_ratio`` of requests resend an id already sent.
+
+    Fresh ids stay unique across laps over the file (id + lap * stride), so the repeat
+    share is exactly what was asked for.
+    """
+
+    def __init__(self, path: str, repeat_ratio: float, rng: random.Random, limit: int = 0):
+        df = pd.read_csv(path, nrows=limit or None).drop(columns=["Calories"], errors="ignore")
+        if df.empty:
+            raise SystemExit(f"No rows in {path}")
+        self.rows = [{k: (v.item() if hasattr(v, "item") else v) for k, v in rec.items() if not pd.isna(v)}
+                     for rec in df.to_dict(orient="records")]
+        self.stride = int(df["id"].max()) + 1
+        self.repeat_ratio = repeat_ratio
+        self.rng = rng
+        self.sent: List[dict] = []
+        self.n = 0
+        self.repeats = 0
 
+    def next(self) -> dict:
+        if self.sent and self.rng.random() < self.repeat_ratio:
+            self.repeats += 1
+            return self.rng.choice(self.sent)
+        lap, i = divmod(self.n, len(self.rows))
+        self.n += 1
+        payload = dict(self.rows[i], id=int(self.rows[i]["id"]) + lap * self.stride)
+        if len(self.sent) < 100_000:  # bounded pool of candidates for repeats
+            self.sent.append(payload)
+        else:
+            self.sent[self.rng.randrange(len(self.sent))] = payload
+        return payload
+
+
+# --------------------
+# Run
+# --------------------
+def error_class(exc: BaseException) -> str:
+    if isinstance(exc, httpx.TimeoutException):
+        return "timeout"
+    if isinstance(exc, httpx.ConnectError):
+        return "connect"
+    if isinstance(exc, httpx.TransportError):
+        return "transport"
+    return type(exc).__name__
+
+
+class Stats:
+    def __init__(self, duration: float):
+        self.latency = LatencyHistogram()  # intended send -> response (coordinated-omission corrected)
+        self.service = LatencyHistogram()  # actual send -> response
+        self.ok = 0
+        self.errors: Dict[str, int] = {}
+        self.timeline = [{"offered": 0, "ok": 0, "err": 0, "hist": LatencyHistogram(sub_bits=4)}
+                         for _ in range(int(math.ceil(duration)) + 1)]
+
+    def offered(self, offset: float):
+        self.timeline[min(int(offset), len(self.timeline) - 1)]["offered"] += 1
+
+    def record(self, offset: float, latency: float, service: Optional[float], cls: str):
+        slot = self.timeline[min(int(offset), len(self.timeline) - 1)]
+        self.latency.record(latency)
+        slot["hist"].record(latency)
+        if service is not None:
+            self.service.record(service)
+        if cls == "ok":
+            self.ok += 1
+            slot["ok"] += 1
+        else:
+            self.fail(offset, cls)
+
+    def fail(self, offset: float, cls: str):
+        """Count an error without a latency sample (e.g. a request that was never sent)."""
+        self.errors[cls] = self.errors.get(cls, 0) + 1
+        self.timeline[min(int(offset), len(self.timeline) - 1)]["err"] += 1
+
+    def timeline_rows(self) -> List[dict]:
+        rows = []
+        for t, s in enumerate(self.timeline):
+            h = s["hist"]
+            rows.append({"t": t, "offered": s["offered"], "ok": s["ok"], "err": s["err"],
+                         "p50": h.quantile(0.5), "p99": h.quantile(0.99), "max": h.max})
+        while rows and rows[-1]["offered"] == 0:
+            rows.pop()
+        return rows
+
+
+async def run_load(client: httpx.AsyncClient, path: str, args, source: PayloadSource, rng: random.Random) -> dict:
+    stats = Stats(args.duration)
+    sem = asyncio.Semaphore(args.concurrency)  # requests on the wire; the rest queue client-side
+    inflight: Dict[asyncio.Task, float] = {}
+    issued = 0
+    max_lag = 0.0
+
+    async def fire(offset: float, intended: float, payload: dict):
+        async with sem:
+            sent = time.perf_counter()
+            try:
+                r = await client.post(path, json=payload)
+                cls = "ok" if r.status_code == 200 else f"http_{r.status_code}"
+            except Exception as e:  # noqa: BLE001 - every failure is a data point
+                cls = error_class(e)
+        done = time.perf_counter()
+        stats.record(offset, done - intended, done - sent, cls)
+
+    start = time.perf_counter()
+    for offset in schedule(rate_fn(args), args.duration, args.poisson, rng):
+        intended = start + offset
+        delay = intended - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            max_lag = max(max_lag, -delay)
+        stats.offered(offset)
+        issued += 1
+        if len(inflight) >= args.max_inflight:
+            # never block the schedule: count the request as failed at its intended time. It was
+            # never sent, so it has no latency; a 0s sample would pull the quantiles down
+            stats.fail(offset, "client_overload")
+            continue
+        task = asyncio.create_task(fire(offset, intended, source.next()))
+        inflight[task] = offset
+        task.add_done_callback(lambda t: inflight.pop(t, None))
+    schedule_end = time.perf_counter()
+
+    # wait for stragglers up to the drain timeout; whatever is left is recorded, not dropped
+    if inflight:
+        await asyncio.wait(list(inflight), timeout=args.drain_timeout)
+    now = time.perf_counter()
+    unfinished = dict(inflight)
+    for task, offset in unfinished.items():
+        task.cancel()
+        # lower bound on its latency: it had not answered by the end of the drain
+        stats.record(offset, now - (start + offset), None, "unfinished")
+    elapsed = now - start
 
-def make_payload(i: int) -> dict:
     return {
-        "id": i,
-        "Gender": "male",
-        "Age": 30,
-        "Height": 180,
-        "Weight": 80,
-        "Duration": 30,
-        "Heart_Rate": 120,
-        "Body_Temp": 37.0,
+        "profile": args.profile,
+        "duration_s": args.duration,
+        "elapsed_s": elapsed,
+        "drain_s": now - schedule_end,
+        "max_schedule_lag_s": max_lag,
+        "requests": {
+            "issued": issued,
+            # answered or failed on the wire; excludes client_overload and unfinished requests
+            "completed": stats.latency.total - len(unfinished),
+            "ok": stats.ok,
+            "errors": dict(sorted(stats.errors.items())),
+            "repeated_ids": source.repeats,
+        },
+        "throughput": {
+            "offered_rps": issued / args.duration if args.duration else 0.0,
+            "ok_rps": stats.ok / elapsed if elapsed else 0.0,
+        },
+        "latency_s": stats.latency.summary(),
+        "service_time_s": stats.service.summary(),
+        "timeline": stats.timeline_rows(),
     }
 
 
-async def run_once(client: httpx.AsyncClient, url: str, payload: dict):
-    t0 = time.perf_counter()
-    try:
-        r = await client.post(url, json=payload)
-        ok = r.status_code == 200
-    except Exception:
-        ok = False
-    dt = time.perf_counter() - t0
-    return ok, dt
-
-
-async def stress(
-    base_url: str,
-    duration: float,
-    rps: float,
-    concurrency: int,
-    seed: int = 42,
-):
-    random.seed(seed)
-    url = base_url.rstrip("/") + "/predict"
-    inter = 1.0 / max(0.1, rps)
-    end = time.perf_counter() + duration
-    latencies: List[float] = []
-    ok_count = 0
-    err_count = 0
-    issued = 0
+async def stress(args, source: PayloadSource, rng: random.Random) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    timeout = httpx.Timeout(args.timeout, pool=None)
+    async with httpx.AsyncClient(base_url=args.url.rstrip("/"), limits=limits, timeout=timeout) as client:
+        return await run_load(client, "/predict", args, source, rng)
+
+
+def load_service_app():
+    """Import service/app.py as ``service_app`` and run its startup hook.
 
-    sem = asyncio.Semaphore(concurrency)
-
-    async with httpx.AsyncClient(timeout=5.0) as client:
-        async def worker(i: int):
-            nonlocal ok_count, err_count
-            async with sem:
-                ok, dt = await run_once(client, url, make_payload(i))
-                latencies.append(dt)
-                if ok:
-                    ok_count += 1
-                else:
-                    err_count += 1
-
-        i = 0
-        while time.perf_counter() < end:
-            asyncio.create_task(worker(i))
-            i += 1
-            issued += 1
-            await asyncio.sleep(inter)
-        # wait for in-flight
-        await asyncio.sleep(min(5.0, duration))
-
-    total = ok_count + err_count
-    p50 = statistics.quantiles(latencies, n=100)[49] if latencies else 0.0
-    p95 = statistics.quantiles(latencies, n=100)[94] if latencies else 0.0
-    p99 = statistics.quantiles(latencies, n=100)[98] if latencies else 0.0
-    print(f"issued={issued} total={total} ok={ok_count} err={err_count}")
-    print(f"latency_p50={p50:.4f}s latency_p95={p95:.4f}s latency_p99={p99:.4f}s")
-
-
-async def stress_asgi(duration: float, rps: float, concurrency: int):
+    ASGITransport does not run lifespan events; callers run ``module._shutdown()`` when done.
+    """
     import importlib.util
     root = os.getcwd()
     svc_path = os.path.join(root, "service", "app.py")
@@ -88,66 +305,68 @@ async def stress_asgi(duration: float, rps: float, concurrency: int):
     module = importlib.util.module_from_spec(spec)
     assert spec and spec.loader
     spec.loader.exec_module(module)
+    module._startup()
+    return module
 
-    inter = 1.0 / max(0.1, rps)
-    end = time.perf_counter() + duration
-    latencies: List[float] = []
-    ok_count = 0
-    err_count = 0
-    issued = 0
-    sem = asyncio.Semaphore(concurrency)
-
-    transport = httpx.ASGITransport(app=module.app)
-    async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=5.0) as client:
-        async def worker(i: int):
-            nonlocal ok_count, err_count
-            async with sem:
-                t0 = time.perf_counter()
-                try:
-                    r = await client.post("/predict", json=make_payload(i))
-                    ok = r.status_code == 200
-                except Exception:
-                    ok = False
-                dt = time.perf_counter() - t0
-                latencies.append(dt)
-                if ok:
-                    ok_count += 1
-                else:
-                    err_count += 1
-        i = 0
-        while time.perf_counter() < end:
-            asyncio.create_task(worker(i))
-            i += 1
-            issued += 1
-            await asyncio.sleep(inter)
-        await asyncio.sleep(min(5.0, duration))
-
-    total = ok_count + err_count
-    p50 = statistics.quantiles(latencies, n=100)[49] if latencies else 0.0
-    p95 = statistics.quantiles(latencies, n=100)[94] if latencies else 0.0
-    p99 = statistics.quantiles(latencies, n=100)[98] if latencies else 0.0
-    print(f"issued={issued} total={total} ok={ok_count} err={err_count}")
-    print(f"latency_p50={p50:.4f}s latency_p95={p95:.4f}s latency_p99={p99:.4f}s")
+
+async def stress_asgi(args, source: PayloadSource, rng: random.Random) -> dict:
+    module = load_service_app()
+    try:
+        transport = httpx.ASGITransport(app=module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=args.timeout) as client:
+            return await run_load(client, "/predict", args, source, rng)
+    finally:
+        module._shutdown()
 
 
 def parse_args():
     p = argparse.ArgumentParser()
     p.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL of API (ignored in --asgi mode)")
     p.add_argument("--duration", type=float, default=60.0)
-    p.add_argument("--rps", type=float, default=100.0)
-    p.add_argument("--concurrency", type=int, default=64)
+    p.add_argument("--rps", type=float, default=100.0, help="Target rate (constant/burst base, ramp end)")
+    p.add_argument("--concurrency", type=int, default=64, help="Max requests on the wire (connection pool size)")
     p.add_argument("--asgi", action="store_true", help="Use in-process ASGI app (no network)")
+    p.add_argument("--profile", choices=["constant", "ramp", "step", "burst"], default="constant")
+    p.add_argument("--start-rps", type=float, default=1.0, help="Ramp start rate")
+    p.add_argument("--steps", default="", help="Step profile as RPS:SECONDS,... (last level held)")
+    p.add_argument("--burst-rps", type=float, default=500.0)
+    p.add_argument("--burst-every", type=float, default=20.0, help="Seconds between burst starts")
+    p.add_argument("--burst-duration", type=float, default=5.0)
+    p.add_argument("--poisson", action="store_true", help="Exponential inter-arrival gaps instead of uniform")
+    p.add_argument("--data", default=None, help="CSV of payload rows (default: data/holdout/holdout.csv, else data_sample)")
+    p.add_argument("--rows", type=int, default=0, help="Read only the first N rows of --data (0=all)")
+    p.add_argument("--repeat-ratio", type=float, default=0.0, help="Share of requests resending an already-sent id")
+    p.add_argument("--timeout", type=float, default=5.0, help="Per-request timeout")
+    p.add_argument("--drain-timeout", type=float, default=30.0, help="Max wait for in-flight requests after the schedule")
+    p.add_argument("--max-inflight", type=int, default=10000, help="Beyond this, requests fail as client_overload")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--report", default=None, help="Write the JSON report here")
     return p.parse_args()
 
 
 def main():
     args = parse_args()
+    rng = random.Random(args.seed)
+    source = PayloadSource(args.data or default_data_path(), args.repeat_ratio, rng, limit=args.rows)
     if args.asgi:
-        asyncio.run(stress_asgi(args.duration, args.rps, args.concurrency))
+        report = asyncio.run(stress_asgi(args, source, rng))
+        report["target"] = "asgi"
     else:
-        asyncio.run(stress(args.url, args.duration, args.rps, args.concurrency))
+        report = asyncio.run(stress(args, source, rng))
+        report["target"] = args.url
+
+    req, lat = report["requests"], report["latency_s"]
+    err = sum(req["errors"].values())
+    print(f"issued={req['issued']} total={req['ok'] + err} ok={req['ok']} err={err}")
+    print(f"latency_p50={lat['p50']:.4f}s latency_p95={lat['p95']:.4f}s latency_p99={lat['p99']:.4f}s")
+    print(f"offered_rps={report['throughput']['offered_rps']:.1f} ok_rps={report['throughput']['ok_rps']:.1f} "
+          f"max_schedule_lag_s={report['max_schedule_lag_s']:.3f} errors={req['errors']}")
+    if args.report:
+        os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote report to {args.report}")
 
 
 if __name__ == "__main__":
     main()
-
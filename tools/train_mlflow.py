@@ -1,92 +1,204 @@
 #!/usr/bin/env python3
+"""Train with the handout train.py and log the run to MLflow, skipping unchanged work.
+
+Runs are content-addressed: ``input_hash`` is sha256 over the training data, the
+config, the training code and the train.py arguments. If a finished training run
+with the same hash exists, its metrics are copied into a new run tagged
+``cache_hit=true`` and its model is downloaded only when the local file differs;
+nothing is retrained or re-uploaded. Otherwise train.py runs as a subprocess whose
+output is streamed: per-iteration validation metrics and phase timings are logged
+as they are printed.
+
+Unknown arguments are passed to train.py (and hashed), e.g. ``--out-of-core quantile``.
+"""
 import argparse
+import hashlib
 import json
 import os
+import re
 import subprocess
 import sys
+import tempfile
 import time
 from pathlib import Path
 
 import mlflow
 import yaml
+from mlflow.entities import Metric
+from mlflow.tracking import MlflowClient
 
+ROOT = Path(os.getcwd())
+HANDOUT = ROOT / 'handout_from DS_agent'
+sys.path.insert(0, str(HANDOUT))
+from feature_cache import file_digest  # noqa: E402
 
-def main():
-    root = Path(os.getcwd())
-    handout = root / 'handout_from DS_agent'
-    cfg_path = handout / 'config.yaml'
-    model_path = handout / 'model.joblib'
-    metrics_path = handout / 'metrics.json'
+# bump when the hash inputs change meaning
+CACHE_VERSION = 1
+TRAIN_CODE = ('train.py', 'model.py', 'feature_cache.py')
+# xgboost's verbose_eval line: "[120]\tvalid-rmse:0.06123"; train.py's "phase train seconds=4.210"
+ITERATION_RE = re.compile(r'^\[(\d+)\]\t(.+)$')
+PHASE_RE = re.compile(r'^phase (\w+) seconds=([0-9.]+)$')
+
+
+def flatten_config(cfg: dict) -> dict:
+    params = {}
+    for k, v in cfg.items():
+        if isinstance(v, dict):
+            for k2, v2 in v.items():
+                params[f'{k}.{k2}'] = v2
+        else:
+            params[k] = v
+    return params
+
+
+def input_hash(data_files, config_path: Path, code_files, train_args) -> str:
+    h = hashlib.sha256(f'train-mlflow-v{CACHE_VERSION}'.encode())
+    for path in [*data_files, config_path, *code_files]:
+        h.update(f'{Path(path).name}:{file_digest(str(path))}\n'.encode())
+    h.update(json.dumps(list(train_args)).encode())
+    return h.hexdigest()[:32]
+
+
+def find_cached_run(key: str):
+    """Latest finished run that trained on these inputs (cache-hit runs never count as sources)."""
+    runs = mlflow.search_runs(
+        filter_string=f"tags.input_hash = '{key}' and tags.cache_hit = 'false' and attributes.status = 'FINISHED'",
+        order_by=['attributes.start_time DESC'], max_results=1, output_format='list',
+    )
+    return runs[0] if runs else None
+
+
+class MetricBuffer:
+    """Batches streamed metrics into log_batch calls instead of one request per line."""
 
+    def __init__(self, client: MlflowClient, run_id: str, max_items: int = 100, max_wait: float = 2.0):
+        self.client = client
+        self.run_id = run_id
+        self.max_items = max_items
+        self.max_wait = max_wait
+        self._items = []
+        self._last = time.monotonic()
+
+    def add(self, key: str, value: float, step: int = 0):
+        self._items.append(Metric(key, value, int(time.time() * 1000), step))
+        if len(self._items) >= self.max_items or time.monotonic() - self._last >= self.max_wait:
+            self.flush()
+
+    def flush(self):
+        if self._items:
+            self.client.log_batch(self.run_id, metrics=self._items)
+            self._items = []
+        self._last = time.monotonic()
+
+
+def stream_training(cmd, metrics: MetricBuffer) -> int:
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1,
+                            env=dict(os.environ, PYTHONUNBUFFERED='1'))
+    for line in proc.stdout:
+        print(line, end='', flush=True)
+        line = line.rstrip('\n')
+        m = ITERATION_RE.match(line)
+        if m:
+            for item in m.group(2).split('\t'):
+                name, _, value = item.partition(':')
+                metrics.add(name.replace('-', '_'), float(value), step=int(m.group(1)))
+            continue
+        m = PHASE_RE.match(line)
+        if m:
+            metrics.add(f'phase_{m.group(1)}_sec', float(m.group(2)))
+    return proc.wait()
+
+
+def restore_artifact(run_id: str, artifact: str, dest: Path, sha256: str = None) -> bool:
+    """Download a cached run's artifact over ``dest`` unless the local file already matches."""
+    if sha256 and dest.exists() and file_digest(str(dest)) == sha256:
+        return False
+    with tempfile.TemporaryDirectory(dir=dest.parent) as tmp:
+        local = mlflow.artifacts.download_artifacts(run_id=run_id, artifact_path=artifact, dst_path=tmp)
+        os.replace(local, dest)
+    return True
+
+
+def main():
     p = argparse.ArgumentParser()
     p.add_argument('--run-name', default='local-train')
     p.add_argument('--tracking-uri', default=os.environ.get('MLFLOW_TRACKING_URI', 'http://127.0.0.1:5000'))
     p.add_argument('--register', action='store_true', help='Register model in MLflow registry')
     p.add_argument('--model-name', default='CaloriesPredictor')
-    args = p.parse_args()
+    p.add_argument('--data-dir', default=str(HANDOUT / 'data_sample'))
+    p.add_argument('--config', default=str(HANDOUT / 'config.yaml'))
+    p.add_argument('--out', default=str(HANDOUT / 'model.joblib'), help='Model artifact path')
+    p.add_argument('--metrics', default=str(HANDOUT / 'metrics.json'))
+    p.add_argument('--log-every', type=int, default=25, help='Stream the validation metric every N rounds')
+    p.add_argument('--force', action='store_true', help='Retrain even if a run with the same inputs exists')
+    args, train_args = p.parse_known_args()
 
+    cfg_path, model_path, metrics_path = Path(args.config), Path(args.out), Path(args.metrics)
     mlflow.set_tracking_uri(args.tracking_uri)
 
-    # Load params from config
-    params = {}
-    if cfg_path.exists():
-        with open(cfg_path, 'r') as f:
-            cfg = yaml.safe_load(f)
-        # flatten
-        for k, v in cfg.items():
-            if isinstance(v, dict):
-                for k2, v2 in v.items():
-                    params[f'{k}.{k2}'] = v2
-            else:
-                params[k] = v
+    with open(cfg_path, 'r') as f:
+        cfg = yaml.safe_load(f)
+    params = flatten_config(cfg)
+    data_files = [Path(args.data_dir) / cfg['data']['train_csv']]
+    key = input_hash(data_files, cfg_path, [HANDOUT / name for name in TRAIN_CODE], train_args)
+    cached = None if args.force else find_cached_run(key)
 
     with mlflow.start_run(run_name=args.run_name) as run:
         run_id = run.info.run_id
-        # Print artifact URI to verify server-side artifact service
+        client = MlflowClient()
+        metrics = MetricBuffer(client, run_id)
+        mlflow.set_tags({'input_hash': key, 'cache_hit': str(cached is not None).lower()})
         try:
             art_uri = mlflow.get_artifact_uri()
             print(f"Artifact URI: {art_uri}")
-            if art_uri.startswith('file:'):
+            if art_uri.startswith('file:') and not args.tracking_uri.startswith('file:'):
                 print("WARNING: Artifact URI is local file. Ensure MLflow server is started with --serve-artifacts and that you're using the HTTP tracking URI.")
         except Exception as e:
             print(f"Could not determine artifact URI: {e}")
-        # log params
         if params:
             mlflow.log_params(params)
 
-        # Run training script as a subprocess
-        cmd = [sys.executable, str(handout / 'train.py')]
-        print('Running:', ' '.join(cmd), flush=True)
-        t0 = time.time()
-        proc = subprocess.run(cmd, capture_output=True, text=True)
-        dt = time.time() - t0
-        print(proc.stdout)
-        if proc.returncode != 0:
-            print(proc.stderr, file=sys.stderr)
-            raise SystemExit(f'Training failed with code {proc.returncode}')
-        mlflow.log_metric('train_wall_time_sec', dt)
-
-        # Log metrics
-        if metrics_path.exists():
+        if cached is not None:
+            src = cached.info.run_id
+            print(f'cache hit input_hash={key}: reusing run {src}', flush=True)
+            mlflow.set_tag('source_run_id', src)
+            t0 = time.time()
+            fetched = restore_artifact(src, 'model/model.joblib', model_path, cached.data.tags.get('model_sha256'))
+            restore_artifact(src, 'metrics/metrics.json', metrics_path, cached.data.tags.get('metrics_sha256'))
+            mlflow.set_tag('model_sha256', cached.data.tags.get('model_sha256', ''))
+            mlflow.log_metrics(dict(cached.data.metrics, phase_download_sec=time.time() - t0))
+            print(f'model {"downloaded to" if fetched else "already current at"} {model_path}')
+            model_uri = f'runs:/{src}/model/model.joblib'
+        else:
+            print(f'cache miss input_hash={key}', flush=True)
+            cmd = [sys.executable, str(HANDOUT / 'train.py'), '--data-dir', args.data_dir, '--config', str(cfg_path),
+                   '--out', str(model_path), '--metrics', str(metrics_path), '--log-every', str(args.log_every),
+                   *train_args]
+            print('Running:', ' '.join(cmd), flush=True)
+            t0 = time.time()
+            code = stream_training(cmd, metrics)
+            metrics.flush()
+            if code != 0:
+                raise SystemExit(f'Training failed with code {code}')
+            mlflow.log_metric('train_wall_time_sec', time.time() - t0)
+
             with open(metrics_path, 'r') as f:
                 m = json.load(f)
-            for k, v in m.items():
-                if isinstance(v, (int, float)):
-                    mlflow.log_metric(k, float(v))
+            mlflow.log_metrics({k: float(v) for k, v in m.items() if isinstance(v, (int, float))})
 
-        # Log artifacts
-        if model_path.exists():
+            t0 = time.time()
             mlflow.log_artifact(str(model_path), artifact_path='model')
-        if cfg_path.exists():
             mlflow.log_artifact(str(cfg_path), artifact_path='config')
-        if metrics_path.exists():
             mlflow.log_artifact(str(metrics_path), artifact_path='metrics')
+            # a later cache hit compares these to the local files and skips identical downloads
+            mlflow.set_tags({'model_sha256': file_digest(str(model_path)),
+                             'metrics_sha256': file_digest(str(metrics_path))})
+            mlflow.log_metric('phase_upload_sec', time.time() - t0)
+            model_uri = f'runs:/{run_id}/model/model.joblib'
 
-        # Optionally register the model
-        if args.register and model_path.exists():
-            uri = f'runs:/{run_id}/model/model.joblib'
+        if args.register:
             try:
-                mlflow.register_model(uri, args.model_name)
+                mlflow.register_model(model_uri, args.model_name)
             except Exception as e:
                 print(f'Registration failed: {e}', file=sys.stderr)
 